@@ -1,4 +1,7 @@
+import multiprocessing
+
 from .main import main
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,328 @@
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image
+
+from core.editor_tools import HistoryTile, LayerTiles
+
+
+DEFAULT_DIR = Path.home() / ".icon_editor_autosave"
+# Background writes are throttled to this many bytes per second
+DEFAULT_BANDWIDTH = 8 * 1024 * 1024
+# The journal is rewritten once it is this many times the size of the state it holds
+COMPACT_RATIO = 3
+COMPACT_MIN_BYTES = 4 * 1024 * 1024
+
+_MAGIC = b"ICJ1"
+# payload length, record type, crc32 of the payload
+_RECORD = struct.Struct("<IBI")
+_TILE_ID = struct.Struct("<Q")
+_TILE = 1
+_STATE = 2
+
+
+@dataclass
+class JournalState:
+    """A session rebuilt from a journal: full-size RGBA layers plus their metadata."""
+    size: tuple[int, int]
+    layers: list
+    visible: list
+    names: list
+    active: int
+
+
+def _record(kind: int, payload: bytes) -> bytes:
+    return _RECORD.pack(len(payload), kind, zlib.crc32(payload)) + payload
+
+
+def _iter_records(data: bytes):
+    """Yield (kind, payload, offset) for each intact record; stops at the first torn one."""
+    pos = len(_MAGIC)
+    while pos + _RECORD.size <= len(data):
+        length, kind, crc = _RECORD.unpack_from(data, pos)
+        start = pos + _RECORD.size
+        payload = data[start:start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        yield kind, payload, pos
+        pos = start + length
+
+
+def read_journal(path) -> Optional[JournalState]:
+    """Rebuild the last complete state in the journal at path, or None if there is none."""
+    try:
+        data = Path(path).read_bytes()
+    except OSError:
+        return None
+    if not data.startswith(_MAGIC):
+        return None
+    tiles = {}
+    state = None
+    for kind, payload, _ in _iter_records(data):
+        if kind == _TILE:
+            tiles[_TILE_ID.unpack_from(payload)[0]] = payload[_TILE_ID.size:]
+        elif kind == _STATE:
+            meta = json.loads(payload.decode("utf-8"))
+            # A state is only usable once every tile it names has been written
+            if all(j in tiles for ly in meta["layers"] for j in ly["tiles"]):
+                state = (meta, {j: tiles[j] for ly in meta["layers"] for j in ly["tiles"]})
+    if state is None:
+        return None
+
+    meta, packed = state
+    size = tuple(meta["size"])
+    layers = []
+    for ly in meta["layers"]:
+        cells = tuple(HistoryTile(zlib.decompress(packed[j])) for j in ly["tiles"])
+        layers.append(LayerTiles(size, cells).to_image())
+    return JournalState(
+        size=size,
+        layers=layers,
+        visible=[ly["visible"] for ly in meta["layers"]],
+        names=[ly["name"] for ly in meta["layers"]],
+        active=meta["active"],
+    )
+
+
+def _process_start(pid: int) -> Optional[int]:
+    """
+    An opaque start time of process pid, or None if it is not running or the platform
+    offers no cheap way to ask. Together with the PID it tells a process apart from a
+    later one that got the same PID.
+    """
+    if os.name == "nt":
+        import ctypes
+        from ctypes import wintypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return None
+        times = [wintypes.FILETIME() for _ in range(4)]
+        ok = kernel32.GetProcessTimes(handle, *(ctypes.byref(t) for t in times))
+        kernel32.CloseHandle(handle)
+        if not ok:
+            return None
+        return (times[0].dwHighDateTime << 32) | times[0].dwLowDateTime
+    try:
+        with open(f"/proc/{pid}/stat", "rb") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # Field 22 (starttime); the command name before it may itself contain spaces
+    try:
+        return int(stat.rsplit(b")", 1)[1].split()[19])
+    except (IndexError, ValueError):
+        return None
+
+
+def _pid_alive(pid: int, start: Optional[int] = None) -> bool:
+    """Whether process pid is running; with start, also that it is the process that started then."""
+    if pid == os.getpid():
+        alive = True
+    elif os.name == "nt":
+        import ctypes
+        kernel32 = ctypes.windll.kernel32
+        handle = kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        alive = code.value == 259  # STILL_ACTIVE
+    else:
+        try:
+            os.kill(pid, 0)
+            alive = True
+        except ProcessLookupError:
+            return False
+        except OSError:
+            alive = True
+    if alive and start is not None:
+        # A PID reused by an unrelated process: the journal's editor is gone
+        now = _process_start(pid)
+        return now is None or now == start
+    return alive
+
+
+def session_journal_name(pid: Optional[int] = None) -> str:
+    """File name of the journal for process pid (this one by default), tagged with its start time."""
+    pid = os.getpid() if pid is None else pid
+    start = _process_start(pid)
+    return f"session-{pid}.journal" if start is None else f"session-{pid}-{start}.journal"
+
+
+def find_recoverable(directory=DEFAULT_DIR) -> list[Path]:
+    """Journals left behind by editor processes that are no longer running, newest first."""
+    directory = Path(directory)
+    if not directory.is_dir():
+        return []
+    found = []
+    for p in directory.glob("session-*.journal"):
+        # session-<pid>-<start>, or session-<pid> where the start time was unknown
+        try:
+            ids = [int(v) for v in p.stem.split("-")[1:]]
+        except ValueError:
+            continue
+        if len(ids) not in (1, 2):
+            continue
+        if not _pid_alive(ids[0], ids[1] if len(ids) == 2 else None):
+            found.append(p)
+    return sorted(found, key=lambda p: p.stat().st_mtime, reverse=True)
+
+
+class AutosaveJournal:
+    """
+    Append-only crash-recovery journal of the editor's layers. record() is called on
+    the UI thread after each history step and only hands over tiles the previous
+    state did not have; a daemon thread compresses and appends them, followed by a
+    state record naming every tile, at no more than bandwidth bytes per second.
+    Records carry a CRC so a write torn by a crash is ignored on recovery, and the
+    file is rewritten with just the current state once it grows COMPACT_RATIO times
+    larger than that.
+    """
+
+    def __init__(self, path=None, bandwidth: int = DEFAULT_BANDWIDTH):
+        if path is None:
+            path = DEFAULT_DIR / session_journal_name()
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.bandwidth = bandwidth
+        self.bytes_written = 0
+        # UI thread: id(tile) -> (tile, journal id) for the last recorded state. Holding
+        # the tile keeps its id() from being reused while the mapping refers to it.
+        self._sent: dict[int, tuple[HistoryTile, int]] = {}
+        self._next_id = 0
+        # Writer thread: journal id -> (offset, length) of tile records in the file
+        self._offsets: dict[int, tuple[int, int]] = {}
+        self._file = open(self.path, "wb")
+        self._file.write(_MAGIC)
+        self._size = len(_MAGIC)
+        self._io_free_at = 0.0
+        self._jobs: queue.Queue = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="autosave-journal", daemon=True)
+        self._thread.start()
+
+    def record(self, layers: list[LayerTiles], visible, names, active: int):
+        """Queue the state made of these layer snapshots; returns at once."""
+        if self._stop.is_set() or not layers:
+            return
+        sent = {}
+        fresh = {}
+        meta_layers = []
+        for ly, vis, name in zip(layers, visible, names):
+            ids = []
+            for tile in ly.tiles:
+                hit = sent.get(id(tile)) or self._sent.get(id(tile))
+                if hit is None:
+                    hit = (tile, self._next_id)
+                    self._next_id += 1
+                    fresh[hit[1]] = tile.data
+                sent[id(tile)] = hit
+                ids.append(hit[1])
+            meta_layers.append({"name": name, "visible": bool(vis), "tiles": ids})
+        self._sent = sent
+        meta = {"size": list(layers[0].size), "layers": meta_layers, "active": active}
+        self._jobs.put((meta, fresh))
+
+    def close(self, discard: bool = False):
+        """Stop the writer; with discard the journal file is deleted (a clean exit)."""
+        self._stop.set()
+        self._jobs.put(None)
+        self._thread.join(timeout=5)
+        try:
+            self._file.close()
+        except OSError:
+            pass
+        if discard:
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+
+    # ---------- Writer thread ----------
+    def _run(self):
+        while not self._stop.is_set():
+            job = self._jobs.get()
+            if job is None:
+                return
+            meta, fresh = job
+            # Catch up in one go: only the newest state and the tiles it needs get written
+            while True:
+                try:
+                    job = self._jobs.get_nowait()
+                except queue.Empty:
+                    break
+                if job is None:
+                    return
+                meta = job[0]
+                fresh.update(job[1])
+            try:
+                self._write_state(meta, fresh)
+            except OSError:
+                # A full or vanished disk must not take the editor down; stop journaling
+                self._stop.set()
+                return
+
+    def _throttle(self, nbytes: int):
+        now = time.monotonic()
+        self._io_free_at = max(self._io_free_at, now) + nbytes / self.bandwidth
+        if self._io_free_at > now:
+            self._stop.wait(self._io_free_at - now)
+
+    def _append(self, kind: int, payload: bytes) -> tuple[int, int]:
+        rec = _record(kind, payload)
+        offset = self._size
+        self._file.write(rec)
+        self._size += len(rec)
+        self.bytes_written += len(rec)
+        self._throttle(len(rec))
+        return offset, len(rec)
+
+    def _write_state(self, meta: dict, fresh: dict):
+        needed = [j for ly in meta["layers"] for j in ly["tiles"]]
+        for j in dict.fromkeys(needed):
+            if j not in self._offsets:
+                self._offsets[j] = self._append(_TILE, _TILE_ID.pack(j) + zlib.compress(fresh[j], 1))
+        state = json.dumps(meta, separators=(",", ":")).encode("utf-8")
+        self._append(_STATE, state)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        # Tiles the current state no longer names are dead weight in the file
+        live = set(needed)
+        self._offsets = {j: span for j, span in self._offsets.items() if j in live}
+        live_bytes = sum(span[1] for span in self._offsets.values()) + len(state)
+        if self._size > max(COMPACT_MIN_BYTES, COMPACT_RATIO * live_bytes):
+            self._compact(state)
+
+    def _compact(self, state: bytes):
+        """Rewrite the journal with only the live tiles and the current state, then swap it in."""
+        tmp = self.path.with_suffix(".tmp")
+        self._file.close()
+        with open(self.path, "rb") as src, open(tmp, "wb") as dst:
+            dst.write(_MAGIC)
+            offsets = {}
+            size = len(_MAGIC)
+            for j, (offset, length) in self._offsets.items():
+                src.seek(offset)
+                dst.write(src.read(length))
+                offsets[j] = (size, length)
+                size += length
+                self._throttle(length)
+            rec = _record(_STATE, state)
+            dst.write(rec)
+            size += len(rec)
+            dst.flush()
+            os.fsync(dst.fileno())
+        os.replace(tmp, self.path)
+        self._offsets = offsets
+        self._size = size
+        self._file = open(self.path, "ab")
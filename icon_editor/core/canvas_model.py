@@ -0,0 +1,1315 @@
+import queue
+import threading
+import time
+
+from PIL import Image, ImageDraw, ImageChops, ImageFont
+
+from core.editor_tools import (
+    ToolType,
+    UndoRedoStack,
+    HistoryCommand,
+    LayerTiles,
+    tiles_touching,
+    flood_fill,
+    draw_brush_line,
+    draw_dab,
+    StrokeBuffer,
+    select_color_global,
+    replace_color_global,
+)
+from core.project import write_project
+from core.document import Document
+from core.macros import Macro
+from utils.helpers import clamp, clip_rect, union_rect
+from utils.profiler import FrameProfiler, profiled
+
+# Undo history kept in RAM (older tiles compressed, then spilled) and on disk, in bytes
+HISTORY_MEMORY_BUDGET = 256 * 1024 * 1024
+HISTORY_DISK_BUDGET = 2048 * 1024 * 1024
+# Lazy project loading: at most this many ms of caller time per drain_loading() batch
+LOAD_SLICE_MS = 8
+
+SHAPE_TOOLS = (ToolType.SHAPE_LINE, ToolType.SHAPE_RECT, ToolType.SHAPE_ELLIPSE)
+
+
+class CanvasModel:
+    """
+    The editable document behind the canvas, without any Tk: layers and their
+    visibility, the flattened composite, selection and floating selection, undo
+    history, and the tools applied at image coordinates through press() / drag() /
+    release(). It can be driven headless, e.g. by benchmarks or batch jobs.
+
+    A view hooks in through the callbacks: on_change whenever something needs
+    redrawing, plus the status, size, layer list, colour and history notifications.
+    Changed pixels are reported to a Renderer via take_render_damage().
+    """
+
+    def __init__(
+        self,
+        on_change=None,
+        on_status=None,
+        on_size_change=None,
+        on_layers_changed=None,
+        on_color=None,
+        on_history_change=None,
+    ):
+        self.on_change = on_change or (lambda: None)
+        self.on_status = on_status or (lambda text: None)
+        self.on_size_change = on_size_change or (lambda w, h: None)
+        self.on_layers_changed = on_layers_changed or (lambda: None)
+        self.on_color = on_color or (lambda rgba: None)
+        self.on_history_change = on_history_change or (lambda memory_bytes, disk_bytes: None)
+        # Stage timings for the performance HUD; a no-op until enabled
+        self.profiler = FrameProfiler()
+
+        self.layers: list[Image.Image] = []
+        self.layer_visible: list[bool] = []
+        self.layer_names: list[str] = []
+        self.active_layer = 0
+
+        self._composite_cache: Image.Image | None = None
+        self._composite_dirty = True
+        # Visible layers below / above the active one, flattened (None when there are none),
+        # so an edit to the active layer blends three images instead of the whole stack
+        self._below: Image.Image | None = None
+        self._above: Image.Image | None = None
+        self._stack_key = None
+        # Rects where a layer other than the active one may have changed
+        self._stack_rects: list[tuple[int, int, int, int]] = []
+        # Image-space rects changed since the last composite / render
+        self._composite_rects: list[tuple[int, int, int, int]] = []
+        self._render_rects: list[tuple[int, int, int, int]] = []
+        self._render_full = True
+
+        self.tool = ToolType.PENCIL
+        self.brush_size = 5
+        self.brush_shape = "round"
+        self.brush_hardness = 1.0
+        self.brush_spacing = 0.25
+        # Active soft / semi-transparent stroke, blended into the layer on release
+        self._stroke: StrokeBuffer | None = None
+        self.color = (0, 0, 0, 255)
+        self.alpha = 255
+        self.fill_tolerance = 0
+        self.shape_fill = False
+        # Fill / Magic Eraser / Selection act on every matching pixel, not just the contiguous region
+        self.global_select = False
+
+        # Selection / move
+        self.sel_active = False
+        self.sel_start = None
+        self.sel_rect = None
+        self.sel_floating = None
+        self.sel_offset = (0, 0)
+        # Optional "L" mask (sized to sel_rect) for non-rectangular colour selections
+        self.sel_mask = None
+
+        # Gestures
+        self.is_drawing = False
+        self.last_pos = None
+
+        # Shapes: preview_image covers the image-space preview_rect
+        self.shape_start = None
+        self.preview_image = None
+        self.preview_rect = None
+        self.clipboard_image = None
+
+        self.history = UndoRedoStack(
+            limit=50,
+            memory_budget=HISTORY_MEMORY_BUDGET,
+            disk_budget=HISTORY_DISK_BUDGET,
+            rebase=lambda dropped, entry: self._snapshot_with_command(dropped, entry),
+        )
+        # The layers equal this snapshot apart from edits inside _history_rects (None = anywhere);
+        # _history_layers are the layer objects it was taken from, to follow inserts and reorders
+        self._history_synced = None
+        self._history_layers: list[Image.Image] = []
+        self._history_rects: list | None = None
+        # Selection as of the current history entry, the "before" of a selection command
+        self._history_selection = (False, None, None)
+        # Optional AutosaveJournal told about every history step
+        self.journal = None
+        # ProjectFile the document was opened from or last saved to; while it is still
+        # loading, _load_tiles holds the tiles pasted so far (None = not yet)
+        self.project = None
+        # Macro being recorded, if any
+        self.macro: Macro | None = None
+        self._load_tiles: list[list] | None = None
+        self._load_queue = None
+        self._load_stop = None
+        self.is_unsaved = False
+
+    # ---------- Size helpers ----------
+    def width(self):
+        return self.layers[0].width if self.layers else 0
+
+    def height(self):
+        return self.layers[0].height if self.layers else 0
+
+    # ---------- Composite ----------
+    def _mark_dirty(self, bbox=None, active_only: bool = False, unsaved: bool = True):
+        """
+        Layer pixels changed inside bbox (image space); None means anything may have
+        changed. active_only promises that only the active layer was edited, which
+        keeps the flattened layers below and above it valid. unsaved=False is for pixels
+        that are not an edit, such as project tiles arriving during a lazy load.
+        """
+        if unsaved:
+            self.is_unsaved = True
+        if bbox is None:
+            self._composite_dirty = True
+            self._render_full = True
+            self._history_rects = None
+            self._stack_key = None
+        else:
+            if not active_only:
+                self._stack_rects.append(bbox)
+            self._composite_rects.append(bbox)
+            self._render_rects.append(bbox)
+            if self._history_rects is not None:
+                self._history_rects.append(bbox)
+                if len(self._history_rects) > 64:
+                    merged = None
+                    for r in self._history_rects:
+                        merged = union_rect(merged, r)
+                    self._history_rects = [merged]
+
+    def _mark_composite_dirty(self):
+        """Layer order or visibility changed: rebuild the composite, but no pixels were edited."""
+        self.is_unsaved = True
+        self._composite_dirty = True
+        self._render_full = True
+
+    def take_render_damage(self):
+        """Image-space rects changed since the last call, or None if anything may have changed."""
+        rects = None if self._render_full else self._render_rects
+        self._render_rects = []
+        self._render_full = False
+        return rects
+
+    def _stack_signature(self):
+        # Everything the below / above images depend on apart from pixels: which layer is
+        # active, and the identity and visibility of every other layer
+        others = tuple(id(ly) if i != self.active_layer else None for i, ly in enumerate(self.layers))
+        return (self.active_layer, others, tuple(self.layer_visible), (self.width(), self.height()))
+
+    def _flatten(self, layers, rect, dst=None):
+        """Blend the visible ones of (layer, visible) pairs inside rect into dst, or a new image if any are visible."""
+        for ly, vis in layers:
+            if not vis:
+                continue
+            if dst is None:
+                dst = Image.new("RGBA", ly.size, (0, 0, 0, 0))
+            dst.alpha_composite(ly, rect[:2], rect)
+        return dst
+
+    def _update_stacks(self, size):
+        """Bring the below / above images up to date; returns True if they were rebuilt."""
+        pairs = list(zip(self.layers, self.layer_visible))
+        below, above = pairs[:self.active_layer], pairs[self.active_layer + 1:]
+        key = self._stack_signature()
+        if key != self._stack_key:
+            full = (0, 0, size[0], size[1])
+            self._below = self._flatten(below, full)
+            self._above = self._flatten(above, full)
+            self._stack_key = key
+            self._stack_rects = []
+            return True
+        for rect in self._stack_rects:
+            rect = clip_rect(rect, size)
+            if rect is None:
+                continue
+            for stack in (self._below, self._above):
+                if stack is not None:
+                    stack.paste((0, 0, 0, 0), rect)
+            self._flatten(below, rect, self._below)
+            self._flatten(above, rect, self._above)
+        self._stack_rects = []
+        return False
+
+    @profiled("composite")
+    def live_composite(self):
+        """
+        The composite as the layers are now, without finishing a lazy load, including the
+        stroke in progress. This is the live cache: treat it as read-only.
+        """
+        if not self.layers:
+            return None
+        size = (self.width(), self.height())
+        rebuilt = self._update_stacks(size)
+        if rebuilt or self._composite_dirty or self._composite_cache is None or self._composite_cache.size != size:
+            self._composite_cache = Image.new("RGBA", size, (0, 0, 0, 0))
+            self._composite_region((0, 0, size[0], size[1]))
+            self._composite_dirty = False
+        else:
+            for rect in self._composite_rects:
+                rect = clip_rect(rect, size)
+                if rect is None:
+                    continue
+                self._composite_region(rect)
+        self._composite_rects = []
+        return self._composite_cache
+
+    def _composite_region(self, rect):
+        if self._below is not None:
+            self._composite_cache.paste(self._below.crop(rect), rect[:2])
+        else:
+            self._composite_cache.paste((0, 0, 0, 0), rect)
+        ly = self.layers[self.active_layer]
+        if self.layer_visible[self.active_layer]:
+            if self._stroke is not None:
+                # Live preview of the stroke in progress, at the active layer's depth
+                self._composite_cache.alpha_composite(self._stroke.apply(ly.crop(rect), rect[:2]), rect[:2])
+            else:
+                self._composite_cache.alpha_composite(ly, rect[:2], rect)
+        if self._above is not None:
+            self._composite_cache.alpha_composite(self._above, rect[:2], rect)
+
+    def get_composite(self):
+        """The flattened visible layers. This is the live cache: treat it as read-only."""
+        self.ensure_loaded()
+        return self.live_composite()
+
+    @staticmethod
+    def _composite_clipped(dst, src, offset):
+        """alpha_composite src onto dst at offset, clipping any part hanging off either edge."""
+        ox, oy = offset
+        sx0, sy0 = max(0, -ox), max(0, -oy)
+        sx1 = min(src.width, dst.width - ox)
+        sy1 = min(src.height, dst.height - oy)
+        if sx0 >= sx1 or sy0 >= sy1:
+            return
+        dst.alpha_composite(src, (ox + sx0, oy + sy0), (sx0, sy0, sx1, sy1))
+
+    def _sample_composite(self, x, y):
+        """The RGBA shown at image pixel (x, y), floating selection and shape preview included."""
+        px = self.get_composite().crop((x, y, x + 1, y + 1))
+        if self.sel_floating is not None:
+            self._composite_clipped(px, self.sel_floating, (self.sel_offset[0] - x, self.sel_offset[1] - y))
+        if self.preview_image is not None:
+            self._composite_clipped(px, self.preview_image, (self.preview_rect[0] - x, self.preview_rect[1] - y))
+        return px.getpixel((0, 0))
+
+    def memory_stats(self) -> dict:
+        """Bytes held by the layers, the undo history (in RAM and spilled to disk) and the composite caches."""
+        def nbytes(im):
+            return im.width * im.height * len(im.getbands()) if im is not None else 0
+
+        return {
+            "layers": sum(nbytes(ly) for ly in self.layers),
+            "history": self.history.memory_bytes,
+            "history_disk": self.history.disk_bytes,
+            "composite": sum(nbytes(im) for im in (self._composite_cache, self._below, self._above)),
+        }
+
+    # ---------- Layer controls ----------
+    def active_layer_index(self):
+        return self.active_layer
+
+    def get_layer_list(self):
+        return [(self.layer_names[i], self.layer_visible[i]) for i in range(len(self.layers))]
+
+    def set_active_layer(self, idx: int):
+        if 0 <= idx < len(self.layers):
+            self.active_layer = idx
+            self.on_status(f"Active layer: {self.layer_names[idx]}")
+
+    def layer_add(self):
+        self.ensure_loaded()
+        if not self.layers:
+            return
+        new_layer = Image.new("RGBA", (self.width(), self.height()), (0, 0, 0, 0))
+        self.layers.insert(self.active_layer + 1, new_layer)
+        self.layer_visible.insert(self.active_layer + 1, True)
+        self.layer_names.insert(self.active_layer + 1, f"Layer {len(self.layers)}")
+        self.active_layer += 1
+        self._mark_dirty()
+        self._push_state()
+        self.on_change()
+        self.on_layers_changed()
+
+    def layer_delete(self) -> bool:
+        """Delete the active layer; returns False if it is the only one."""
+        self.ensure_loaded()
+        if len(self.layers) <= 1:
+            return False
+        del self.layers[self.active_layer]
+        del self.layer_visible[self.active_layer]
+        del self.layer_names[self.active_layer]
+        self.active_layer = max(0, self.active_layer - 1)
+        self._mark_dirty()
+        self._push_state()
+        self.on_change()
+        self.on_layers_changed()
+        return True
+
+    def layer_move(self, direction: int):
+        i = self.active_layer
+        j = i + direction
+        if 0 <= i < len(self.layers) and 0 <= j < len(self.layers):
+            self._run_command(HistoryCommand("move", (i, j), i, j))
+
+    def layer_toggle_visibility(self):
+        if not self.layers:
+            return
+        i = self.active_layer
+        self._run_command(HistoryCommand("visibility", i, self.layer_visible[i], not self.layer_visible[i]))
+
+    def layer_rename(self, name: str):
+        if not self.layers or not name or name == self.layer_names[self.active_layer]:
+            return
+        i = self.active_layer
+        self._run_command(HistoryCommand("rename", i, self.layer_names[i], name))
+
+    # ---------- Lifecycle ----------
+    def new_blank(self, size):
+        w, h = size
+        self._replace_layers([Image.new("RGBA", (w, h), (0, 0, 0, 0))], ["Layer 1"], [True])
+        self.on_status(f"New {w}x{h} canvas")
+        self.on_size_change(w, h)
+        self.on_layers_changed()
+        self.is_unsaved = False
+
+    def load_image(self, image):
+        img = image.convert("RGBA")
+        self._replace_layers([img], ["Background"], [True])
+        self.on_status("Image loaded")
+        self.on_size_change(img.width, img.height)
+        self.on_layers_changed()
+        self.is_unsaved = False
+
+    def load_layers(self, layers, names, visible, active=0):
+        """Replace the document with ready-made RGBA layers, e.g. a recovered session."""
+        self._replace_layers([ly.convert("RGBA") for ly in layers], names, visible, active)
+        self.on_size_change(self.width(), self.height())
+        self.on_layers_changed()
+
+    def _replace_layers(self, layers, names, visible, active=0):
+        self._cancel_loading()
+        self.project = None
+        self.layers = layers
+        self.layer_visible = list(visible)
+        self.layer_names = list(names)
+        self.active_layer = clamp(active, 0, len(self.layers) - 1)
+        self._reset_selection()
+        self._clear_history()
+        self._push_state()
+        self._mark_dirty()
+        self.on_change()
+
+    def open_project(self, project):
+        """
+        Start opening a ProjectFile lazily: the layers are sized but still blank. Follow
+        with start_loading(), once the view knows which part of the image it shows.
+        """
+        self._cancel_loading()
+        w, h = project.size
+        self.layers = [Image.new("RGBA", (w, h), (0, 0, 0, 0)) for _ in project.names]
+        self.layer_visible = list(project.visible)
+        self.layer_names = list(project.names)
+        self.active_layer = clamp(project.active, 0, len(self.layers) - 1)
+        self._reset_selection()
+        self._clear_history()
+        self.project = project
+        self._load_tiles = [[None] * len(project.tile_boxes) for _ in self.layers]
+        self._mark_dirty()
+        self.on_change()
+
+    def start_loading(self, view=None):
+        """
+        Decode the project tiles under the image-space rect view right away and the rest
+        on a background thread. Returns the token to pass to drain_loading() while tiles
+        are still coming, or None if the load already finished. Anything that needs the
+        whole document first finishes the load (see ensure_loaded).
+        """
+        project = self.project
+        boxes = project.tile_boxes
+        later = []
+        first = None
+        for i, box in enumerate(boxes):
+            if view is not None and box[0] < view[2] and box[2] > view[0] and box[1] < view[3] and box[3] > view[1]:
+                for li in range(len(self.layers)):
+                    first = union_rect(first, self._paste_loaded(li, i, project.load_tile(li, i)))
+            else:
+                later.extend((li, i) for li in range(len(self.layers)))
+        if first is not None:
+            self._mark_dirty(first, unsaved=False)
+
+        token = None
+        if later:
+            token = self._load_queue = queue.SimpleQueue()
+            self._load_stop = threading.Event()
+            threading.Thread(
+                target=self._load_worker, args=(project, later, self._load_queue, self._load_stop), daemon=True
+            ).start()
+            self.on_status(f"Loading {project.path.name}...")
+        else:
+            self._finish_loading()
+        self.on_change()
+        self.on_size_change(self.width(), self.height())
+        self.on_layers_changed()
+        self.is_unsaved = False
+        return token
+
+    @staticmethod
+    def _load_worker(project, jobs, out, stop):
+        for li, i in jobs:
+            if stop.is_set():
+                return
+            try:
+                tile = project.load_tile(li, i)
+            except ValueError as e:
+                # Handed to the UI thread, which raises it from drain_loading
+                out.put((li, i, e))
+                return
+            out.put((li, i, tile))
+
+    def _paste_loaded(self, layer: int, index: int, tile):
+        """Paste a decoded tile unless it already is; returns the box to mark dirty, or None."""
+        if self._load_tiles[layer][index] is not None:
+            return None
+        box = self.project.tile_boxes[index]
+        self.layers[layer].paste(Image.frombytes("RGBA", (box[2] - box[0], box[3] - box[1]), tile.data), box[:2])
+        self._load_tiles[layer][index] = tile
+        return box
+
+    def drain_loading(self, token, budget_ms: float = LOAD_SLICE_MS) -> bool:
+        """
+        Paste tiles the loader thread has decoded, for up to budget_ms; returns True while
+        more are due. Raises ValueError if the project turns out to be damaged.
+        """
+        if token is not self._load_queue:
+            return False  # A load that has since finished or been replaced
+        deadline = time.perf_counter() + budget_ms / 1000
+        dirty = None
+        while time.perf_counter() < deadline:
+            try:
+                li, i, tile = token.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(tile, ValueError):
+                self._cancel_loading()
+                raise tile
+            # Tiles arrive in row order, so one union per batch stays a narrow band
+            dirty = union_rect(dirty, self._paste_loaded(li, i, tile))
+        if dirty is not None:
+            self._mark_dirty(dirty, unsaved=False)
+        more = not all(t is not None for row in self._load_tiles for t in row)
+        if not more:
+            self._finish_loading()
+        self.on_change()
+        return more
+
+    def ensure_loaded(self):
+        """Finish a lazy project load now, decoding whatever the background thread has not reached."""
+        if self._load_tiles is None:
+            return
+        if self._load_stop is not None:
+            self._load_stop.set()
+            while True:
+                try:
+                    li, i, tile = self._load_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if not isinstance(tile, ValueError):
+                    # A damaged tile is decoded again below, which raises here
+                    self._paste_loaded(li, i, tile)
+        for li, row in enumerate(self._load_tiles):
+            for i, tile in enumerate(row):
+                if tile is None:
+                    self._paste_loaded(li, i, self.project.load_tile(li, i))
+        self._mark_dirty(unsaved=False)
+        self._finish_loading()
+        self.on_change()
+
+    def _finish_loading(self):
+        size = (self.width(), self.height())
+        # The decoded tiles are exactly the first history snapshot, and sharing them
+        # lets the next project save recognise what is unchanged
+        captured = [LayerTiles(size, tuple(row)) for row in self._load_tiles]
+        self._cancel_loading()
+        self._push_state(captured)
+        self.on_status(f"Opened project {self.project.path.name}")
+
+    def _cancel_loading(self):
+        if self._load_stop is not None:
+            self._load_stop.set()
+        self._load_tiles = None
+        self._load_queue = None
+        self._load_stop = None
+
+    def save_project(self, path):
+        """Write the document as a layered project, appending only tiles changed since it was last opened or saved."""
+        self.ensure_loaded()
+        if self.sel_floating is not None:
+            self._commit_floating_selection()
+            self._push_state()
+        self.project = write_project(
+            path, self._current_layer_tiles(), self.layer_names, self.layer_visible, self.active_layer, previous=self.project
+        )
+        self.is_unsaved = False
+
+    def _reset_selection(self):
+        self.sel_active = False
+        self.sel_start = None
+        self.sel_rect = None
+        self.sel_floating = None
+        self.sel_offset = (0, 0)
+        self.sel_mask = None
+        self.preview_image = None
+
+    # ---------- Tool settings ----------
+    def set_tool(self, tool: ToolType):
+        if self.tool == ToolType.MOVE and self.sel_floating is not None and tool != ToolType.MOVE:
+            self._commit_floating_selection()
+        self.tool = tool
+        self.on_status(f"Tool: {tool.value}")
+
+    def set_brush_size(self, size: int):
+        size = clamp(size, 1, 128)
+        self.brush_size = size
+        self.on_status(f"Brush size: {self.brush_size}")
+
+    def set_brush_hardness(self, hardness: float):
+        self.brush_hardness = max(0.0, min(1.0, float(hardness)))
+        self.on_status(f"Brush hardness: {int(round(self.brush_hardness * 100))}%")
+
+    def set_alpha(self, alpha: int):
+        self.alpha = clamp(alpha, 0, 255)
+        r, g, b, _ = self.color
+        self.set_color((r, g, b, self.alpha))
+
+    def set_color(self, rgba):
+        # Force the color tuple to use the current live canvas alpha variable
+        # instead of letting the color dialog override it with 255
+        self.color = (
+            clamp(int(rgba[0]), 0, 255),
+            clamp(int(rgba[1]), 0, 255),
+            clamp(int(rgba[2]), 0, 255),
+            self.alpha  # <--- Retain your slider's value here
+        )
+        try:
+            self.on_color(self.color)
+        except Exception:
+            pass
+        self.on_status(f"Color: RGBA{self.color}")
+
+    def set_shape_fill(self, filled: bool):
+        self.shape_fill = bool(filled)
+        self.on_status(f"Shape fill: {'On' if self.shape_fill else 'Off'}")
+
+    def set_fill_tolerance(self, tolerance: int):
+        self.fill_tolerance = clamp(tolerance, 0, 255)
+        self.on_status(f"Fill tolerance: {self.fill_tolerance}")
+
+    def set_global_select(self, enabled: bool):
+        self.global_select = bool(enabled)
+        self.on_status(f"Global color mode: {'On' if self.global_select else 'Off'}")
+
+    # ---------- Quick Actions ----------
+    def _document(self) -> Document:
+        """A Document sharing this model's layer lists, so its edits land here directly."""
+        return Document(self.layers, self.layer_visible, self.layer_names, self.active_layer)
+
+    def _run_document_op(self, op: str, status: str, **params):
+        """Apply a Document edit to the active layer (or all, for trim) as one history step."""
+        self.ensure_loaded()
+        if not self.layers:
+            return None
+        old_size = (self.width(), self.height())
+        bbox = getattr(self._document(), op)(**params)
+        if self.macro is not None:
+            self.macro.record(op, **params)
+        if bbox is None:
+            return None
+        # Every edit but trim changes only the active layer, and trim changes the size
+        self._mark_dirty(bbox if (self.width(), self.height()) == old_size else None, active_only=True)
+        self._push_state()
+        self.on_change()
+        if (self.width(), self.height()) != old_size:
+            self.on_size_change(self.width(), self.height())
+            self.on_layers_changed()
+        self.on_status(status)
+        return bbox
+
+    def quick_invert(self):
+        self._run_document_op("invert", "Inverted colors")
+
+    def quick_grayscale(self):
+        self._run_document_op("grayscale", "Grayscale applied")
+
+    def quick_flip_h(self):
+        self._run_document_op("flip_h", "Flipped horizontally")
+
+    def quick_flip_v(self):
+        self._run_document_op("flip_v", "Flipped vertically")
+
+    def quick_trim_transparent(self):
+        if self.layers and self._run_document_op("trim", "Trimmed transparent borders") is None:
+            self.on_status("Nothing to trim (no opaque pixels)")
+
+    def make_background_transparent(self, tolerance: int = 0, contiguous: bool = False, feather: float = 0):
+        bbox = self._run_document_op(
+            "remove_background", "Background made transparent", tolerance=tolerance, contiguous=contiguous, feather=feather
+        )
+        if bbox is None and self.layers:
+            self.on_status("No background pixels matched")
+
+    # ---------- Macros ----------
+    def start_macro(self):
+        self.macro = Macro()
+        self.on_status("Recording macro")
+
+    def stop_macro(self):
+        """Stop recording and return the Macro (None if nothing was recording)."""
+        macro, self.macro = self.macro, None
+        return macro
+
+    def play_macro(self, macro: Macro):
+        for step in macro.steps:
+            params = dict(step)
+            op = params.pop("op")
+            if op == "remove_background":
+                self.make_background_transparent(**params)
+            else:
+                self._run_document_op(op, f"Macro: {op}", **params)
+        self.on_status(f"Played macro ({len(macro.steps)} steps)")
+
+    # ---------- Selection ----------
+    def select_all(self):
+        if not self.layers:
+            return False
+
+        # If we are dragging a floating selection, commit it to the canvas first
+        if self.sel_floating is not None:
+            self._commit_floating_selection()
+
+        # Set the selection rectangle to the full dimensions of the canvas
+        self.sel_active = True
+        self.sel_start = (0, 0)
+        self.sel_rect = (0, 0, self.width(), self.height())
+        self.sel_mask = None
+
+        self.on_change()
+        self.on_status("Selected all")
+        return True
+
+    def clear_selection(self):
+        if self.sel_floating is not None:
+            self._commit_floating_selection()
+        self.sel_active = False
+        self.sel_start = None
+        self.sel_rect = None
+        self.sel_mask = None
+        self.preview_image = None
+        self.preview_rect = None
+        self.on_change()
+        self.on_status("Selection cleared")
+
+    def delete_selection(self):
+        """Fills the currently selected bounding box area with full transparency."""
+        self.ensure_loaded()
+        if not self.layers or not self.sel_active or not self.sel_rect:
+            return
+
+        x0, y0, x1, y1 = self._norm_rect(self.sel_rect)
+
+        if self.sel_mask is not None:
+            # Colour selection: clear only the matched pixels
+            self.layers[self.active_layer].paste((0, 0, 0, 0), (x0, y0, x1, y1), self.sel_mask)
+            self._mark_dirty((x0, y0, x1, y1), active_only=True)
+            self._push_state()
+            self.on_change()
+            self.on_status("Selection cleared to transparency")
+            return
+
+        # Draw a transparent rectangle.
+        # By using x1 and y1 directly (exclusive boundary),
+        # Pillow will cover the range from x0 to x1-1 (which includes the last pixel).
+        draw = ImageDraw.Draw(self.layers[self.active_layer], "RGBA")
+        draw.rectangle([x0, y0, x1, y1], fill=(0, 0, 0, 0))
+
+        self._mark_dirty((x0, y0, x1 + 1, y1 + 1), active_only=True)
+        self._push_state()
+        self.on_change()
+        self.on_status("Selection cleared to transparency")
+
+    def copy_selection(self):
+        """Copy the floating or selected pixels to clipboard_image; returns False if nothing is selected."""
+        self.ensure_loaded()
+        if not self.layers:
+            return False
+
+        if self.sel_floating is not None:
+            self.clipboard_image = self.sel_floating.copy()
+        elif self.sel_active and self.sel_rect is not None:
+            self.clipboard_image = self._crop_selection()
+        else:
+            self.on_status("Nothing selected to copy")
+            return False
+        self.on_status("Selection copied")
+        return True
+
+    def paste(self, at=(0, 0)):
+        """Drop clipboard_image in as a floating selection (Move tool) with its top-left at image pixel at."""
+        self.ensure_loaded()
+        if not getattr(self, "clipboard_image", None):
+            self.on_status("Clipboard is empty")
+            return False
+
+        # If we are already dragging something else, commit it to the canvas first
+        if self.sel_floating is not None:
+            self._commit_floating_selection()
+
+        # Load the clipboard image as a new floating selection
+        self.sel_floating = self.clipboard_image.copy()
+        self.sel_mask = None
+
+        x0, y0 = at
+        self.sel_offset = (x0, y0)
+        x1 = x0 + self.sel_floating.width
+        y1 = y0 + self.sel_floating.height
+
+        self.sel_rect = (x0, y0, x1, y1)
+        self.sel_active = True
+        self.tool = ToolType.MOVE
+
+        self._mark_dirty()
+        self._push_state()
+        self.on_change()
+        self.on_status("Pasted selection")
+        return True
+
+    def marquee_rect(self):
+        """Image-space rect the selection marquee outlines, or None."""
+        if not self.sel_active:
+            return None
+        if self.sel_floating is not None:
+            return self._floating_rect()
+        if self.sel_rect:
+            return self._norm_rect(self.sel_rect)
+        return None
+
+    # ---------- Tools ----------
+    def press(self, ix, iy, global_mode=None):
+        """
+        Start a gesture of the current tool at image pixel (ix, iy). global_mode, if
+        given, replaces global_select for this one click. The Text tool only draws
+        through draw_text(), since it needs the text first.
+        """
+        self.ensure_loaded()
+        if not self.layers:
+            return
+        if not (0 <= ix < self.width() and 0 <= iy < self.height()):
+            return
+        if global_mode is None:
+            global_mode = self.global_select
+
+        # Track that a drawing action has started (excluding tools that don't draw)
+        if self.tool not in (ToolType.TEXT, ToolType.EYEDROPPER):
+            self.is_drawing = True
+
+        # Bounding box of layer pixels touched by this event (image space)
+        dirty = None
+        if self.tool in (ToolType.PENCIL, ToolType.ERASER):
+            erase = self.tool == ToolType.ERASER
+            color = (0, 0, 0, 0) if erase else self.color
+            if self._needs_stroke_buffer(erase):
+                self._stroke = StrokeBuffer(
+                    (self.width(), self.height()), color, self.brush_size, shape=self.brush_shape,
+                    hardness=self.brush_hardness, spacing=self.brush_spacing, erase=erase,
+                )
+                dirty = self._stroke.add_dab((ix, iy))
+            else:
+                dirty = self._draw_point(ix, iy, color)
+        elif self.tool == ToolType.EYEDROPPER:
+            if self.layers:
+                try:
+                    # Explicitly lock the coordinates to target pixel integers
+                    cx = max(0, min(int(ix), self.width() - 1))
+                    cy = max(0, min(int(iy), self.height() - 1))
+                    r, g, b, a = self._sample_composite(cx, cy)
+                    self.set_color((r, g, b, a))
+                except Exception as e:
+                    self.on_status(f"Eyedropper sample failed: {e}")
+        elif self.tool == ToolType.FILL:
+            if global_mode:
+                dirty = replace_color_global(self.layers[self.active_layer], (ix, iy), self.color, tolerance=self.fill_tolerance)
+            else:
+                dirty = flood_fill(self.layers[self.active_layer], (ix, iy), self.color, tolerance=self.fill_tolerance)
+        elif self.tool == ToolType.MAGIC_ERASER:
+            r, g, b, a = self.layers[self.active_layer].getpixel((ix, iy))
+            if global_mode:
+                dirty = replace_color_global(self.layers[self.active_layer], (ix, iy), (r, g, b, 0), tolerance=self.fill_tolerance)
+            else:
+                dirty = flood_fill(self.layers[self.active_layer], (ix, iy), (r, g, b, 0), tolerance=self.fill_tolerance)
+        elif self.tool == ToolType.SELECTION:
+            if global_mode:
+                self._select_by_color(ix, iy)
+            else:
+                # Deselect if clicking on a new area without dragging
+                self.sel_active = True
+                self.sel_start = (ix, iy)
+                self.sel_rect = None  # Don't create a 1x1 box yet; wait for drag
+                self.sel_mask = None
+        elif self.tool == ToolType.MOVE:
+            if self.sel_floating is None and self.sel_rect and self._point_in_rect((ix, iy), self.sel_rect):
+                x0, y0, x1, y1 = self._norm_rect(self.sel_rect)
+                box = (x0, y0, x1, y1)
+                self.sel_floating = self._crop_selection()
+                if self.sel_mask is not None:
+                    self.layers[self.active_layer].paste((0, 0, 0, 0), box, self.sel_mask)
+                    self.sel_mask = None
+                else:
+                    draw = ImageDraw.Draw(self.layers[self.active_layer], "RGBA")
+                    draw.rectangle([x0, y0, x1, y1], fill=(0, 0, 0, 0))
+                self.sel_offset = (x0, y0)
+                self.sel_rect = (x0, y0, x1, y1)
+                dirty = (x0, y0, x1 + 1, y1 + 1)
+        elif self.tool in SHAPE_TOOLS:
+            self.shape_start = (ix, iy)
+
+        self.last_pos = (ix, iy)
+        if dirty is not None:
+            self._mark_dirty(dirty, active_only=True)
+        self.on_change()
+
+    def drag(self, ix, iy):
+        """Continue the gesture to image pixel (ix, iy), clamped to the image."""
+        if not self.layers:
+            return
+        ix = clamp(ix, 0, max(1, self.width()) - 1)
+        iy = clamp(iy, 0, max(1, self.height()) - 1)
+
+        dirty = None
+        if self._stroke is not None:
+            dirty = self._stroke.add_line(self.last_pos, (ix, iy))
+        elif self.tool == ToolType.PENCIL:
+            dirty = self._draw_line(self.last_pos, (ix, iy), self.color)
+        elif self.tool == ToolType.ERASER:
+            dirty = self._draw_line(self.last_pos, (ix, iy), (0, 0, 0, 0))
+        elif self.tool == ToolType.SELECTION and self.sel_active:
+            # Only start the rectangle once the mouse has moved from the start point
+            if self.sel_start:
+                x0, y0 = self.sel_start
+                self.sel_rect = (x0, y0, ix, iy)
+        elif self.tool == ToolType.MOVE and self.sel_floating is not None:
+            dx = ix - self.last_pos[0]
+            dy = iy - self.last_pos[1]
+            self.sel_offset = (self.sel_offset[0] + dx, self.sel_offset[1] + dy)
+
+            # Keep the visible selection box aligned with the floating selection
+            x0, y0 = self.sel_offset
+            x1 = x0 + self.sel_floating.width
+            y1 = y0 + self.sel_floating.height
+            self.sel_rect = (x0, y0, x1, y1)
+        elif self.tool in SHAPE_TOOLS and self.shape_start:
+            self._update_shape_preview(self.shape_start, (ix, iy))
+
+        self.last_pos = (ix, iy)
+        if dirty is not None:
+            self._mark_dirty(dirty, active_only=True)
+        self.on_change()
+
+    def release(self):
+        """Finish the gesture: commit shapes and soft strokes, and record the history step."""
+        if not self.layers:
+            return
+
+        # If we clicked but never dragged (sel_rect is still None), clear selection
+        if self.tool == ToolType.SELECTION and self.sel_active and self.sel_rect is None:
+            self.clear_selection()
+
+        if self.tool in SHAPE_TOOLS and self.shape_start:
+            self._commit_shape(self.shape_start, self.last_pos)
+            self.shape_start = None
+            self.preview_image = None
+            self.preview_rect = None
+
+        if self._stroke is not None:
+            stroke, self._stroke = self._stroke, None
+            dirty = stroke.commit(self.layers[self.active_layer])
+            if dirty is not None:
+                self._mark_dirty(dirty, active_only=True)
+
+        # Save the state AFTER the stroke is finished
+        if getattr(self, "is_drawing", False):
+            if self.tool == ToolType.SELECTION and self.sel_floating is None and self._history_rects == []:
+                # Only the selection changed: record it without touching layer pixels
+                after = self._selection_state()
+                if after != self._history_selection:
+                    self._push_command(HistoryCommand("selection", None, self._history_selection, after))
+            else:
+                self._push_state()
+            self.is_drawing = False
+
+        self.on_change()
+
+    # ---------- Drawing helpers ----------
+    def _draw_point(self, x, y, color):
+        if not (0 <= x < self.width() and 0 <= y < self.height()):
+            return None
+        return draw_dab(self.layers[self.active_layer], (x, y), color, self.brush_size, self.brush_shape, self.brush_hardness)
+
+    def _needs_stroke_buffer(self, erase: bool) -> bool:
+        # Hard opaque dabs simply overwrite pixels; anything softer has to be blended once per stroke
+        if self.brush_hardness < 1.0:
+            return True
+        return not erase and self.color[3] < 255
+
+    def _draw_line(self, p0, p1, color):
+        return draw_brush_line(
+            self.layers[self.active_layer], p0, p1, color, self.brush_size,
+            shape=self.brush_shape, hardness=self.brush_hardness, spacing=self.brush_spacing,
+        )
+
+    def draw_text(self, x, y, text, size_px):
+        draw = ImageDraw.Draw(self.layers[self.active_layer], "RGBA")
+
+        font = None
+        # Check common cross-platform font fallbacks
+        for font_name in ["arial.ttf", "calibri.ttf", "Helvetica.ttf", "DejaVuSans.ttf"]:
+            try:
+                font = ImageFont.truetype(font_name, size_px)
+                break
+            except IOError:
+                continue
+
+        if font is None:
+            font = ImageFont.load_default()
+
+        draw.text((x, y), text, fill=self.color, font=font)
+        self._mark_dirty(draw.textbbox((x, y), text, font=font), active_only=True)
+        self._push_state()
+        self.on_change()
+        self.on_status("Text added")
+
+    def _select_by_color(self, x, y):
+        mask = select_color_global(self.layers[self.active_layer], (x, y), self.fill_tolerance)
+        bbox = mask.getbbox() if mask is not None else None
+        if bbox is None:
+            self.sel_active = False
+            self.sel_rect = None
+            self.sel_mask = None
+            return
+        self.sel_active = True
+        self.sel_start = None
+        self.sel_rect = bbox
+        self.sel_mask = mask.crop(bbox)
+        self.on_status(f"Selected color at {x}, {y}")
+
+    def _crop_selection(self):
+        x0, y0, x1, y1 = self._norm_rect(self.sel_rect)
+        clip = self.layers[self.active_layer].crop((x0, y0, x1, y1))
+        if self.sel_mask is not None:
+            clip.putalpha(ImageChops.multiply(clip.getchannel("A"), self.sel_mask))
+        return clip
+
+    def _point_in_rect(self, pt, rect):
+        x0, y0, x1, y1 = self._norm_rect(rect)
+        x, y = pt
+        return x0 <= x < x1 and y0 <= y < y1
+
+    def _norm_rect(self, rect):
+        x0, y0, x1, y1 = rect
+        if x0 > x1:
+            x0, x1 = x1, x0
+        if y0 > y1:
+            y0, y1 = y1, y0
+        return x0, y0, x1, y1
+
+    def _floating_rect(self):
+        if self.sel_floating is None:
+            return None
+        x0, y0 = self.sel_offset
+        return (x0, y0, x0 + self.sel_floating.width, y0 + self.sel_floating.height)
+
+    def _shape_rect(self, start, end):
+        # Generous bounds for a shape stroked with the current brush width
+        x0, y0, x1, y1 = self._norm_rect((start[0], start[1], end[0], end[1]))
+        pad = self.brush_size + 1
+        return (x0 - pad, y0 - pad, x1 + pad + 1, y1 + pad + 1)
+
+    def _commit_floating_selection(self):
+        if self.sel_floating is None:
+            return
+        rect = self._floating_rect()
+        self._composite_clipped(self.layers[self.active_layer], self.sel_floating, self.sel_offset)
+        self.sel_floating = None
+        self.sel_rect = None
+        self.sel_active = False
+        self._mark_dirty(rect, active_only=True)
+        self.on_change()
+        self.on_status("Selection moved")
+
+    @profiled("preview")
+    def _update_shape_preview(self, start, end):
+        # The preview only covers the shape's bounds; it is drawn shifted to that origin
+        rect = clip_rect(self._shape_rect(start, end), (self.width(), self.height()))
+        self.preview_rect = rect
+        if rect is None:
+            self.preview_image = None
+            return
+        ox, oy = rect[:2]
+        self.preview_image = Image.new("RGBA", (rect[2] - ox, rect[3] - oy), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(self.preview_image, "RGBA")
+        start = (start[0] - ox, start[1] - oy)
+        end = (end[0] - ox, end[1] - oy)
+
+        # Normalize the coordinates instantly to allow multi-directional drawing
+        x0, y0, x1, y1 = self._norm_rect((start[0], start[1], end[0], end[1]))
+
+        if self.tool == ToolType.SHAPE_LINE:
+            # Lines don't require sorting, use original track points
+            draw.line([start[0], start[1], end[0], end[1]], fill=self.color, width=self.brush_size)
+        elif self.tool == ToolType.SHAPE_RECT:
+            if self.shape_fill:
+                draw.rectangle([x0, y0, x1, y1], fill=self.color, outline=self.color, width=self.brush_size)
+            else:
+                draw.rectangle([x0, y0, x1, y1], outline=self.color, width=self.brush_size)
+        elif self.tool == ToolType.SHAPE_ELLIPSE:
+            if self.shape_fill:
+                draw.ellipse([x0, y0, x1, y1], fill=self.color, outline=self.color, width=self.brush_size)
+            else:
+                draw.ellipse([x0, y0, x1, y1], outline=self.color, width=self.brush_size)
+
+    def _commit_shape(self, start, end):
+        draw = ImageDraw.Draw(self.layers[self.active_layer], "RGBA")
+
+        # Normalize coordinates before final commitment to the layer
+        x0, y0, x1, y1 = self._norm_rect((start[0], start[1], end[0], end[1]))
+
+        if self.tool == ToolType.SHAPE_LINE:
+            draw.line([start[0], start[1], end[0], end[1]], fill=self.color, width=self.brush_size)
+            self.on_status("Line drawn")
+        elif self.tool == ToolType.SHAPE_RECT:
+            if self.shape_fill:
+                draw.rectangle([x0, y0, x1, y1], fill=self.color, outline=self.color, width=self.brush_size)
+                self.on_status("Filled rectangle drawn")
+            else:
+                draw.rectangle([x0, y0, x1, y1], outline=self.color, width=self.brush_size)
+                self.on_status("Rectangle drawn")
+        elif self.tool == ToolType.SHAPE_ELLIPSE:
+            if self.shape_fill:
+                draw.ellipse([x0, y0, x1, y1], fill=self.color, outline=self.color, width=self.brush_size)
+                self.on_status("Filled ellipse drawn")
+            else:
+                draw.ellipse([x0, y0, x1, y1], outline=self.color, width=self.brush_size)
+                self.on_status("Ellipse drawn")
+        self._mark_dirty(self._shape_rect(start, end), active_only=True)
+
+    # ---------- Undo / Redo ----------
+    @profiled("history_push")
+    def _push_state(self, captured=None):
+        """Push the current state; captured, if given, is already the LayerTiles of every layer."""
+        prev = self._history_synced
+        changed = tiles_touching((self.width(), self.height()), self._history_rects)
+        layers = captured if captured is not None else []
+        for i, ly in enumerate(self.layers if captured is None else ()):
+            # Diff each layer against its own previous snapshot, wherever it has moved to
+            j = next((k for k, old in enumerate(self._history_layers) if old is ly), None)
+            if j is not None:
+                layers.append(LayerTiles.capture(ly, prev["layers"][j], changed))
+            elif prev is not None and i < len(prev["layers"]):
+                layers.append(LayerTiles.capture(ly, prev["layers"][i]))
+            else:
+                layers.append(LayerTiles.capture(ly))
+        snapshot = {
+            "layers": layers,
+            "visible": list(self.layer_visible),
+            "names": list(self.layer_names),
+            "active": self.active_layer,
+            "selection": (self.sel_active, self.sel_rect, self.sel_floating.copy() if self.sel_floating else None, self.sel_offset),
+            # Masks are replaced, never edited in place, so sharing the reference is safe
+            "selection_mask": self.sel_mask,
+        }
+        extra = (self.sel_floating.width * self.sel_floating.height * 4) if self.sel_floating else 0
+        self.history.push(snapshot, tiles=[t for ly in layers for t in ly.tiles], extra_bytes=extra)
+        self._sync_history(snapshot)
+        self._journal_state()
+        self.on_history_change(self.history.memory_bytes, self.history.disk_bytes)
+
+    def _clear_history(self):
+        self.history.clear()
+        self._history_synced = None
+        self._history_layers = []
+        self._history_rects = None
+
+    def set_history_budget(self, memory_bytes: int | None, disk_bytes: int | None):
+        self.history.memory_budget = memory_bytes
+        self.history.disk_budget = disk_bytes
+
+    def _sync_history(self, snapshot):
+        self._history_synced = snapshot
+        self._history_layers = list(self.layers)
+        self._history_rects = []
+        s_active, s_rect, _, _ = snapshot["selection"]
+        self._history_selection = (s_active, s_rect, snapshot.get("selection_mask"))
+
+    def attach_journal(self, journal):
+        """Start recording history steps to journal (None to stop) from the current state."""
+        self.journal = journal
+        self._journal_state()
+
+    def _current_layer_tiles(self) -> list[LayerTiles]:
+        """LayerTiles of the live layers, in live order, as of the current history entry."""
+        # Commands change order and metadata but never pixels, so every live layer
+        # still has tiles in the synced snapshot
+        tiles = {id(obj): ly for obj, ly in zip(self._history_layers, self._history_synced["layers"])}
+        return [tiles[id(ly)] for ly in self.layers]
+
+    def _journal_state(self):
+        if self.journal is None or self._history_synced is None:
+            return
+        self.journal.record(self._current_layer_tiles(), self.layer_visible, self.layer_names, self.active_layer)
+
+    def _selection_state(self):
+        return (self.sel_active, self.sel_rect, self.sel_mask)
+
+    @profiled("history_push")
+    def _push_command(self, cmd: HistoryCommand):
+        self.history.push(cmd, shares_tiles=True)
+        self._history_selection = self._selection_state()
+        if cmd.kind != "selection":
+            # The journal does not keep the selection
+            self._journal_state()
+
+    def _run_command(self, cmd: HistoryCommand):
+        self.ensure_loaded()
+        self._apply_command(cmd, undo=False)
+        self._push_command(cmd)
+        self.on_change()
+        self.on_layers_changed()
+
+    def _apply_command(self, cmd: HistoryCommand, undo: bool):
+        value = cmd.before if undo else cmd.after
+        if cmd.kind == "visibility":
+            self.layer_visible[cmd.target] = value
+            self._mark_composite_dirty()
+        elif cmd.kind == "rename":
+            self.layer_names[cmd.target] = value
+        elif cmd.kind == "move":
+            # A swap is its own inverse; before/after are the active layer
+            i, j = cmd.target
+            self.layers[i], self.layers[j] = self.layers[j], self.layers[i]
+            self.layer_visible[i], self.layer_visible[j] = self.layer_visible[j], self.layer_visible[i]
+            self.layer_names[i], self.layer_names[j] = self.layer_names[j], self.layer_names[i]
+            self.active_layer = value
+            self._mark_composite_dirty()
+        elif cmd.kind == "selection":
+            self.sel_active, self.sel_rect, self.sel_mask = value
+            self.is_unsaved = True
+        self._history_selection = self._selection_state()
+
+    def _restore_state(self, snapshot):
+        current = self._history_synced
+        targets = snapshot["layers"]
+        changed = tiles_touching((self.width(), self.height()), self._history_rects)
+
+        # Reuse live layers wherever they can be diffed: first those already synced to the
+        # exact target tiles (unchanged or merely reordered), then any other synced layer
+        live = {id(ly) for ly in self.layers}
+        synced = {}
+        if current is not None:
+            for obj, tiles in zip(self._history_layers, current["layers"]):
+                if id(obj) in live:
+                    synced[id(tiles)] = (obj, tiles)
+        matched = [synced.pop(id(t), None) for t in targets]
+        spare = list(synced.values())
+        layers = []
+        dirty = None
+        rebuilt = False
+        for target, hit in zip(targets, matched):
+            if hit is None and spare and spare[0][0].size == target.size:
+                hit = spare.pop(0)
+            if hit is None:
+                layers.append(target.to_image())
+                rebuilt = True
+                continue
+            obj, now = hit
+            dirty = union_rect(dirty, target.restore_into(obj, now, changed))
+            layers.append(obj)
+        reordered = rebuilt or [id(ly) for ly in layers] != [id(ly) for ly in self.layers]
+        self.layers = layers
+
+        visibility_changed = list(snapshot["visible"]) != self.layer_visible
+        self.layer_visible = list(snapshot["visible"])
+        self.layer_names = list(snapshot["names"])
+        self.active_layer = snapshot["active"]
+        s_active, s_rect, s_float, s_off = snapshot["selection"]
+        self.sel_active = s_active
+        self.sel_rect = s_rect
+        self.sel_floating = s_float.copy() if s_float else None
+        self.sel_offset = s_off
+        self.sel_mask = snapshot.get("selection_mask")
+        self.is_unsaved = True
+        if reordered or visibility_changed:
+            self._mark_dirty()
+        elif dirty is not None:
+            self._mark_dirty(dirty)
+        self._sync_history(snapshot)
+
+    @staticmethod
+    def _snapshot_with_command(snapshot, cmd):
+        """The snapshot dict cmd would produce from snapshot (cmd itself if it is not a command)."""
+        if not isinstance(cmd, HistoryCommand):
+            return cmd
+        out = dict(snapshot)
+        if cmd.kind == "visibility":
+            out["visible"] = list(snapshot["visible"])
+            out["visible"][cmd.target] = cmd.after
+        elif cmd.kind == "rename":
+            out["names"] = list(snapshot["names"])
+            out["names"][cmd.target] = cmd.after
+        elif cmd.kind == "move":
+            i, j = cmd.target
+            for key in ("layers", "visible", "names"):
+                out[key] = list(snapshot[key])
+                out[key][i], out[key][j] = out[key][j], out[key][i]
+            out["active"] = cmd.after
+        elif cmd.kind == "selection":
+            active, rect, mask = cmd.after
+            out["selection"] = (active, rect, None, snapshot["selection"][3])
+            out["selection_mask"] = mask
+        return out
+
+    def _restore_index(self, index: int):
+        """Bring the editor to history entry index: its nearest snapshot with the commands after it folded in."""
+        base = index
+        while isinstance(self.history.entry(base), HistoryCommand):
+            base -= 1
+        snapshot = self.history.entry(base)
+        for k in range(base + 1, index + 1):
+            snapshot = self._snapshot_with_command(snapshot, self.history.entry(k))
+        self._restore_state(snapshot)
+
+    def _history_moved(self, message):
+        self._journal_state()
+        self.on_change()
+        self.on_layers_changed()
+        self.on_size_change(self.width(), self.height())
+        self.on_status(message)
+
+    @profiled("undo")
+    def undo(self):
+        self.ensure_loaded()
+        leaving = self.history.current()
+        if self.history.undo() is None:
+            return
+        if isinstance(leaving, HistoryCommand):
+            self._apply_command(leaving, undo=True)
+        else:
+            self._restore_index(self.history.index)
+        self._history_moved("Undo")
+
+    @profiled("redo")
+    def redo(self):
+        self.ensure_loaded()
+        entry = self.history.redo()
+        if entry is None:
+            return
+        if isinstance(entry, HistoryCommand):
+            self._apply_command(entry, undo=False)
+        else:
+            self._restore_state(entry)
+        self._history_moved("Redo")
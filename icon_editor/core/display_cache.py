@@ -0,0 +1,184 @@
+from collections import OrderedDict
+from functools import lru_cache
+
+from PIL import Image, ImageDraw
+
+from utils.helpers import clip_rect, union_rect
+
+# Edge of a display tile in screen pixels; its image-space size depends on the zoom
+DISPLAY_TILE = 256
+GRID_COLOR = (0, 0, 0, 40)
+
+
+def display_tile_size(zoom) -> int:
+    """Image pixels per display tile edge at zoom (a whole number, or 1/2, 1/4... below 1x)."""
+    return max(1, int(DISPLAY_TILE / zoom))
+
+
+def tiles_in_rect(rect, zoom: int):
+    """Yield (tx, ty) of the display tiles at zoom overlapping an image-space rect."""
+    t = display_tile_size(zoom)
+    x0, y0, x1, y1 = rect
+    for ty in range(y0 // t, (y1 - 1) // t + 1):
+        for tx in range(x0 // t, (x1 - 1) // t + 1):
+            yield tx, ty
+
+
+@lru_cache(maxsize=2)
+def grid_overlay(zoom: int, size: tuple[int, int]) -> Image.Image:
+    """
+    Transparent RGBA image of size with a line on the first column and row of every
+    zoom x zoom cell, to lay over the display at a cell boundary. Shared between
+    callers; treat the result as read-only.
+    """
+    w, h = size
+    overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(overlay)
+    for x in range(0, w, zoom):
+        draw.line([(x, 0), (x, h)], fill=GRID_COLOR)
+    for y in range(0, h, zoom):
+        draw.line([(0, y), (w, y)], fill=GRID_COLOR)
+    return overlay
+
+
+class DisplayTileCache:
+    """
+    LRU cache of rendered display tiles: the composite over the checkerboard, zoomed.
+    Tiles are keyed by (tx, ty, zoom). Every region the document
+    reports changed bumps revision and drops the tiles it touches; the caller patches
+    tiles at the zoom on screen in place instead. Once over max_bytes, the least
+    recently viewed tiles are evicted.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.revision = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._tiles: OrderedDict = OrderedDict()
+        # zoom -> number of cached tiles, to know which grids an invalidation must visit
+        self._zooms: dict[int, int] = {}
+
+    def __len__(self):
+        return len(self._tiles)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def get(self, key):
+        """The cached tile image for key, or None; a hit counts as a view for LRU."""
+        image = self._tiles.get(key)
+        if image is None:
+            self.misses += 1
+            return None
+        self._tiles.move_to_end(key)
+        self.hits += 1
+        return image
+
+    def peek(self, key):
+        """Like get(), but without touching LRU order or the hit statistics."""
+        return self._tiles.get(key)
+
+    def put(self, key, image):
+        self.discard(key)
+        self._tiles[key] = image
+        self.nbytes += image.width * image.height * 4
+        self._zooms[key[2]] = self._zooms.get(key[2], 0) + 1
+        while self.nbytes > self.max_bytes and len(self._tiles) > 1:
+            old = next(iter(self._tiles))
+            self.discard(old)
+            self.evictions += 1
+
+    def discard(self, key):
+        image = self._tiles.pop(key, None)
+        if image is not None:
+            self.nbytes -= image.width * image.height * 4
+            self._zooms[key[2]] -= 1
+            if not self._zooms[key[2]]:
+                del self._zooms[key[2]]
+
+    def invalidate(self, rect, keep_zoom=None):
+        """The document changed inside rect: drop every tile it touches, except at keep_zoom."""
+        self.revision += 1
+        for zoom in list(self._zooms):
+            if zoom == keep_zoom:
+                continue
+            for tx, ty in tiles_in_rect(rect, zoom):
+                self.discard((tx, ty, zoom))
+
+    def clear(self):
+        self.revision += 1
+        self._tiles.clear()
+        self._zooms.clear()
+        self.nbytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "tiles": len(self._tiles),
+            "bytes": self.nbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+            "evictions": self.evictions,
+            "revision": self.revision,
+        }
+
+
+class MipPyramid:
+    """
+    Reductions of an image by 2, 4, 8..., each a box filter of the source itself, so a
+    partial block at the right or bottom edge averages just the pixels it covers, and
+    kept premultiplied ("RGBa") so transparent pixels do not darken their neighbours.
+    Levels are built on first use. Changed rects queued by invalidate() are re-reduced
+    locally the next time a level is read.
+    """
+
+    def __init__(self):
+        self._levels: dict[int, Image.Image] = {}
+        self._pending: dict[int, list] = {}
+        self._size = None
+
+    @property
+    def nbytes(self) -> int:
+        return sum(image.width * image.height * 4 for image in self._levels.values())
+
+    def clear(self):
+        self._levels.clear()
+        self._pending.clear()
+
+    def invalidate(self, rect):
+        for factor, rects in self._pending.items():
+            rects.append(rect)
+            if len(rects) > 16:
+                merged = None
+                for r in rects:
+                    merged = union_rect(merged, r)
+                self._pending[factor] = [merged]
+
+    def level(self, source: Image.Image, factor: int) -> Image.Image:
+        """source reduced factor times, with every invalidated rect brought up to date."""
+        if source.size != self._size:
+            self.clear()
+            self._size = source.size
+        image = self._levels.get(factor)
+        if image is None:
+            image = source.convert("RGBa").reduce(factor)
+            self._levels[factor] = image
+            self._pending[factor] = []
+            return image
+
+        rects, self._pending[factor] = self._pending[factor], []
+        for rect in rects:
+            # Grow to whole blocks of this level; partial blocks at the right and bottom
+            # edges reduce the same way they did when the level was built
+            x0, y0 = rect[0] // factor * factor, rect[1] // factor * factor
+            rect = clip_rect((x0, y0, -(-rect[2] // factor) * factor, -(-rect[3] // factor) * factor), source.size)
+            if rect is None:
+                continue
+            block = source.crop(rect).convert("RGBa").reduce(factor)
+            image.paste(block, (rect[0] // factor, rect[1] // factor))
+        return image
@@ -0,0 +1,67 @@
+from dataclasses import dataclass, field
+
+from PIL import Image, ImageChops, ImageOps
+
+from core.transparency import remove_background
+
+
+@dataclass
+class Document:
+    """
+    Headless layered document: the layer stack plus the whole-layer edits of the
+    Quick Actions menu. It needs no Tk, so macros can run in worker processes. The
+    lists may be shared with an editor, since every edit assigns into them in place.
+    Edits return the image-space bbox they changed, or None if nothing changed.
+    """
+    layers: list = field(default_factory=list)
+    visible: list = field(default_factory=list)
+    names: list = field(default_factory=list)
+    active: int = 0
+
+    @classmethod
+    def from_image(cls, image: Image.Image, name: str = "Background") -> "Document":
+        return cls([image.convert("RGBA")], [True], [name], 0)
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.layers[0].size if self.layers else (0, 0)
+
+    def composite(self) -> Image.Image:
+        out = Image.new("RGBA", self.size, (0, 0, 0, 0))
+        for ly, vis in zip(self.layers, self.visible):
+            if vis:
+                out.alpha_composite(ly)
+        return out
+
+    def _full(self):
+        return (0, 0, *self.size)
+
+    def invert(self):
+        r, g, b, a = self.layers[self.active].split()
+        r, g, b = ImageChops.invert(r), ImageChops.invert(g), ImageChops.invert(b)
+        self.layers[self.active] = Image.merge("RGBA", (r, g, b, a))
+        return self._full()
+
+    def grayscale(self):
+        self.layers[self.active] = ImageOps.grayscale(self.layers[self.active]).convert("RGBA")
+        return self._full()
+
+    def flip_h(self):
+        self.layers[self.active] = self.layers[self.active].transpose(Image.FLIP_LEFT_RIGHT)
+        return self._full()
+
+    def flip_v(self):
+        self.layers[self.active] = self.layers[self.active].transpose(Image.FLIP_TOP_BOTTOM)
+        return self._full()
+
+    def trim(self):
+        """Crop every layer to the opaque bbox of the visible composite; returns that bbox in the old coordinates."""
+        bbox = self.composite().getchannel("A").getbbox()
+        if bbox is None:
+            return None
+        for i in range(len(self.layers)):
+            self.layers[i] = self.layers[i].crop(bbox)
+        return bbox
+
+    def remove_background(self, tolerance: int = 0, contiguous: bool = False, feather: float = 0):
+        return remove_background(self.layers[self.active], tolerance, contiguous, feather)
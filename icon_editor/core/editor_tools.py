@@ -1,6 +1,20 @@
+import math
+import mmap
+import tempfile
+import zlib
 from enum import Enum
 from dataclasses import dataclass
-from typing import Optional, Any
+from functools import lru_cache
+from typing import Optional, Any, Callable
+
+from PIL import Image, ImageChops, ImageDraw
+
+from utils.helpers import clip_rect, union_rect
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; Pillow channel ops are used instead
+    np = None
 
 class ToolType(Enum):
     PENCIL = "pencil"
@@ -15,53 +29,464 @@ class ToolType(Enum):
     SHAPE_RECT = "shape_rect"
     SHAPE_ELLIPSE = "shape_ellipse"
 
+class HistoryTile:
+    """
+    One tile buffer in the undo history. It starts raw, is zlib-packed once the entry
+    that introduced it is no longer recent, and packed data can be spilled to disk.
+    """
+    __slots__ = ("_raw", "_packed", "_spill", "_span", "pinned")
+
+    def __init__(self, raw: bytes, pinned: bool = False):
+        self._raw = raw
+        self._packed = None
+        self._spill = None
+        self._span = None
+        # Pinned tiles (the shared blank tile) are never packed, spilled or counted
+        self.pinned = pinned
+
+    @property
+    def data(self) -> bytes:
+        if self._raw is not None:
+            return self._raw
+        if self._packed is not None:
+            return zlib.decompress(self._packed)
+        return zlib.decompress(self._spill.read(*self._span))
+
+    @property
+    def is_raw(self) -> bool:
+        return self._raw is not None
+
+    @property
+    def is_packed(self) -> bool:
+        return self._packed is not None
+
+    @property
+    def is_released(self) -> bool:
+        """Released while spilled: the data is gone (see release)."""
+        return self._raw is None and self._packed is None and self._spill is None
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held in memory."""
+        if self._raw is not None:
+            return len(self._raw)
+        return len(self._packed) if self._packed is not None else 0
+
+    def pack(self):
+        if self._raw is not None and not self.pinned:
+            self._packed = zlib.compress(self._raw, 1)
+            self._raw = None
+
+    def spill(self, spill: "_SpillFile"):
+        if self._packed is not None and not self.pinned:
+            self._span = spill.write(self._packed)
+            self._spill = spill
+            self._packed = None
+
+    def move_spill(self, spill: "_SpillFile"):
+        if self._spill is not None and self._spill is not spill:
+            self._packed = self._spill.read(*self._span)
+            self._spill = self._span = None
+            self.spill(spill)
+
+    def release(self):
+        """Give the tile's spilled bytes back; a released tile is never read again."""
+        if self._spill is not None:
+            self._spill.dead += self._span[1]
+            self._spill = self._span = None
+
+
+class _SpillFile:
+    """Append-only temporary file of packed tiles, read back through mmap."""
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile(prefix="icon_editor_undo_")
+        self._map = None
+        self.size = 0
+        self.dead = 0
+
+    def write(self, data: bytes) -> tuple[int, int]:
+        self._file.seek(self.size)
+        self._file.write(data)
+        offset = self.size
+        self.size += len(data)
+        return offset, len(data)
+
+    def read(self, offset: int, length: int) -> bytes:
+        if self._map is None or len(self._map) < offset + length:
+            # The file grew since it was last mapped
+            self._file.flush()
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._map[offset:offset + length]
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+@dataclass(frozen=True)
+class HistoryCommand:
+    """
+    A history entry for a change that touches no pixels (visibility, reorder, rename,
+    selection). It records only what changed, so it is applied or reverted in O(1)
+    and shares the pixel tiles of the entry before it.
+    """
+    kind: str
+    target: Any
+    before: Any
+    after: Any
+
+
 @dataclass
 class UndoRedoStack:
+    """
+    Linear undo history. Entries may list the HistoryTiles they reference; each tile is
+    owned, and counted, by the first entry that introduced it. Tiles owned by all but the
+    newest hot_entries entries are zlib-packed. Past memory_budget bytes, packed tiles of
+    the oldest entries are spilled to a temporary file, and past disk_budget bytes on
+    disk the oldest entries are dropped. A budget of None is unlimited.
+
+    rebase(dropped, next_entry), if set, is called when the oldest entry is dropped and
+    returns what to keep in next_entry's place, so entries that only make sense on top
+    of the one before (see HistoryCommand) can be folded into a standalone entry.
+    """
     limit: int = 50
+    memory_budget: Optional[int] = None
+    disk_budget: Optional[int] = None
+    hot_entries: int = 8
+    rebase: Optional[Callable[[Any, Any], Any]] = None
+
     def __post_init__(self):
         self._stack: list[Any] = []
+        self._refs: list[tuple] = []
+        self._owned: list[list[HistoryTile]] = []
+        self._extra: list[int] = []
         self._index: int = -1
-    def push(self, snapshot: Any):
+        self._spill: Optional[_SpillFile] = None
+
+    def push(self, snapshot: Any, tiles=(), extra_bytes: int = 0, shares_tiles: bool = False):
+        """
+        Add snapshot; tiles are all HistoryTiles it references, extra_bytes any other data
+        it holds. With shares_tiles it references exactly the tiles of the entry before.
+        """
         if self._index < len(self._stack) - 1:
-            self._stack = self._stack[: self._index + 1]
+            for owned in self._owned[self._index + 1:]:
+                for t in owned:
+                    t.release()
+            del self._stack[self._index + 1:], self._refs[self._index + 1:]
+            del self._owned[self._index + 1:], self._extra[self._index + 1:]
+        if shares_tiles and self._refs:
+            # Nothing new to own or to rebalance
+            tiles, owned = self._refs[-1], []
+        else:
+            tiles = tuple(tiles)
+            seen = {id(t) for t in self._refs[-1]} if self._refs else set()
+            owned = []
+            # A snapshot may list one tile many times (see LayerTiles.capture); own it once
+            for t in tiles:
+                if id(t) not in seen and not t.pinned:
+                    seen.add(id(t))
+                    owned.append(t)
         self._stack.append(snapshot)
-        if len(self._stack) > self.limit:
-            self._stack.pop(0)
+        self._refs.append(tiles)
+        self._owned.append(owned)
+        self._extra.append(extra_bytes)
         self._index = len(self._stack) - 1
+        while len(self._stack) > self.limit:
+            self._drop_oldest()
+        if owned or extra_bytes:
+            self._rebalance()
+
     def undo(self) -> Optional[Any]:
         if self._index <= 0:
             return None
         self._index -= 1
         return self._stack[self._index]
+
     def redo(self) -> Optional[Any]:
         if self._index >= len(self._stack) - 1:
             return None
         self._index += 1
         return self._stack[self._index]
+
+    @property
+    def index(self) -> int:
+        return self._index
+
+    def entry(self, index: int) -> Any:
+        return self._stack[index]
+
+    def current(self) -> Optional[Any]:
+        return self._stack[self._index] if self._index >= 0 else None
+
     def clear(self):
         self._stack.clear()
+        self._refs.clear()
+        self._owned.clear()
+        self._extra.clear()
         self._index = -1
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    @property
+    def memory_bytes(self) -> int:
+        return sum(t.nbytes for owned in self._owned for t in owned) + sum(self._extra)
+
+    @property
+    def disk_bytes(self) -> int:
+        return self._spill.size - self._spill.dead if self._spill is not None else 0
+
+    def _drop_oldest(self):
+        # Tiles the next entry still shows become its own
+        still_used = {id(t) for t in self._refs[1]} if len(self._refs) > 1 else set()
+        inherited = {id(t) for t in self._owned[1]} if len(self._owned) > 1 else set()
+        for t in self._owned[0]:
+            if id(t) in still_used:
+                if id(t) not in inherited:
+                    inherited.add(id(t))
+                    self._owned[1].append(t)
+            else:
+                t.release()
+        if self.rebase is not None and len(self._stack) > 1:
+            self._stack[1] = self.rebase(self._stack[0], self._stack[1])
+        del self._stack[0], self._refs[0], self._owned[0], self._extra[0]
+        self._index -= 1
+
+    def _rebalance(self):
+        for owned in self._owned[:max(0, len(self._owned) - self.hot_entries)]:
+            for t in owned:
+                if t.is_raw:
+                    t.pack()
+
+        if self.memory_budget is not None:
+            excess = self.memory_bytes - self.memory_budget
+            for owned in self._owned:
+                for t in owned:
+                    if excess <= 0:
+                        break
+                    if t.is_packed:
+                        if self._spill is None:
+                            self._spill = _SpillFile()
+                        excess -= t.nbytes
+                        t.spill(self._spill)
+
+        if self._spill is None:
+            return
+        if self.disk_budget is not None:
+            # Never drop the entry being shown, nor keep dropping once that frees nothing
+            # (the spilled tiles are still part of the current image)
+            while self._index > 0 and self.disk_bytes > self.disk_budget:
+                before = self.disk_bytes
+                self._drop_oldest()
+                if self.disk_bytes >= before:
+                    break
+        if self._spill.dead > self._spill.size // 2:
+            self._compact_spill()
+
+    def _compact_spill(self):
+        old, self._spill = self._spill, _SpillFile()
+        for owned in self._owned:
+            for t in owned:
+                t.move_spill(self._spill)
+        old.close()
+        if not self._spill.size:
+            self._spill.close()
+            self._spill = None
+
+
+HISTORY_TILE = 64
+
+
+@lru_cache(maxsize=8)
+def tile_grid(size: tuple[int, int], tile: int = HISTORY_TILE) -> tuple:
+    """Row-major boxes of the tile grid covering an image of the given size."""
+    w, h = size
+    return tuple((x, y, min(x + tile, w), min(y + tile, h)) for y in range(0, h, tile) for x in range(0, w, tile))
+
+
+def tiles_touching(size: tuple[int, int], rects, tile: int = HISTORY_TILE):
+    """Indices of grid tiles overlapping any of rects; None (anything changed) stays None."""
+    if rects is None:
+        return None
+    w, h = size
+    cols = (w + tile - 1) // tile
+    out = set()
+    for rect in rects:
+        rect = clip_rect(rect, size)
+        if rect is None:
+            continue
+        x0, y0, x1, y1 = rect
+        for ty in range(y0 // tile, (y1 - 1) // tile + 1):
+            out.update(range(ty * cols + x0 // tile, ty * cols + (x1 - 1) // tile + 1))
+    return out
+
+
+@lru_cache(maxsize=8)
+def _blank_bytes(nbytes: int) -> bytes:
+    return bytes(nbytes)
+
+
+@lru_cache(maxsize=8)
+def _blank_tile(nbytes: int) -> HistoryTile:
+    return HistoryTile(_blank_bytes(nbytes), pinned=True)
+
+
+@dataclass(frozen=True)
+class LayerTiles:
+    """
+    Read-only tiled copy of an RGBA layer for the undo history. Tiles that did not
+    change between two snapshots are the same HistoryTile, so each snapshot only
+    costs the tiles that were actually edited.
+    """
+    size: tuple[int, int]
+    tiles: tuple
+
+    @classmethod
+    def capture(cls, image, previous: Optional["LayerTiles"] = None, changed=None) -> "LayerTiles":
+        """
+        Snapshot image. With previous (the last snapshot of the same layer), only tiles
+        in changed are re-read (all of them when changed is None), and any that turn
+        out to be identical keep sharing previous's tile.
+        """
+        if previous is not None and previous.size != image.size:
+            previous = None
+        tiles = []
+        fresh = {}
+        for i, box in enumerate(tile_grid(image.size)):
+            if previous is not None and changed is not None and i not in changed:
+                tiles.append(previous.tiles[i])
+                continue
+            data = image.crop(box).tobytes()
+            if previous is not None and data == previous.tiles[i].data:
+                tiles.append(previous.tiles[i])
+            elif data == _blank_bytes(len(data)):
+                tiles.append(_blank_tile(len(data)))
+            else:
+                # Flat areas repeat the same tile many times; keep one copy
+                tile = fresh.get(data)
+                if tile is None:
+                    tile = fresh[data] = HistoryTile(data)
+                tiles.append(tile)
+        return cls(image.size, tuple(tiles))
+
+    def to_image(self):
+        image = Image.new("RGBA", self.size)
+        for box, tile in zip(tile_grid(self.size), self.tiles):
+            image.paste(Image.frombytes("RGBA", (box[2] - box[0], box[3] - box[1]), tile.data), box[:2])
+        return image
+
+    def restore_into(self, image, current: "LayerTiles", changed=None):
+        """
+        Turn image, which holds current plus edits inside the changed tiles, back into
+        this snapshot in place. Only differing tiles are written; returns their bbox.
+        """
+        grid = tile_grid(self.size)
+        if current is self:
+            # Identical snapshot: only tiles edited since can differ
+            indices = range(len(grid)) if changed is None else sorted(changed)
+        else:
+            indices = range(len(grid))
+        bbox = None
+        for i in indices:
+            box = grid[i]
+            tile = self.tiles[i]
+            if tile is current.tiles[i]:
+                # Same as current, so only an edit since then can make it stale
+                if changed is not None and i not in changed:
+                    continue
+                if image.crop(box).tobytes() == tile.data:
+                    continue
+            image.paste(Image.frombytes("RGBA", (box[2] - box[0], box[3] - box[1]), tile.data), box[:2])
+            bbox = union_rect(bbox, box)
+        return bbox
+
+
+BRUSH_SHAPES = ("round", "square")
+# Short segments and small dabs are cheaper to stamp one ellipse at a time in C
+SWEEP_MIN_STEPS = 24
+SWEEP_MIN_SIZE = 16
+# Extra mask kept around a stroke's reach, so a stroke grows its mask in few steps
+STROKE_MASK_MARGIN = 128
+
 
-def draw_brush_line(image, p0: tuple[int, int], p1: tuple[int, int], color: tuple[int, int, int, int], brush_size: int):
-    from PIL import ImageDraw
+@lru_cache(maxsize=64)
+def brush_dab(size: int, shape: str = "round", hardness: float = 1.0):
+    """
+    Pre-rendered "L" dab mask for one brush footprint, cached per (size, shape, hardness).
+    A hard round dab is pixel-identical to draw.ellipse((x - half, y - half, x + half, y + half)).
+    """
+    half = max(0, size // 2)
+    d = 2 * half + 1
+    mask = Image.new("L", (d, d), 0)
+    draw = ImageDraw.Draw(mask)
+    if shape == "square":
+        draw.rectangle((0, 0, d - 1, d - 1), fill=255)
+    else:
+        draw.ellipse((0, 0, 2 * half, 2 * half), fill=255)
+    if hardness < 1.0 and d > 2:
+        # Linear falloff from the hard core (radius * hardness) out to the rim
+        core = max(0.0, float(hardness))
+        lut = []
+        for v in range(256):
+            r = v / 255.0
+            lut.append(255 if r <= core else max(0, int(round(255 * (1.0 - r) / (1.0 - core)))))
+        falloff = Image.radial_gradient("L").resize((d, d), Image.BILINEAR).point(lut)
+        mask = ImageChops.multiply(mask, falloff)
+    return mask
+
+
+@lru_cache(maxsize=64)
+def _dab_row_spans(size: int, shape: str):
+    """Per-row (dy, left, right) extents of a hard dab, relative to its centre."""
+    dab = brush_dab(size, shape)
+    half = size // 2
+    d = dab.width
+    data = dab.tobytes()
+    dys, lefts, rights = [], [], []
+    for row in range(d):
+        line = data[row * d:(row + 1) * d]
+        left = line.find(b"\xff")
+        if left == -1:
+            continue
+        dys.append(row - half)
+        lefts.append(left - half)
+        rights.append(line.rfind(b"\xff") - half)
+    return np.array(dys), np.array(lefts), np.array(rights)
+
+
+def _draw(image):
+    # Blend-free RGBA drawing on layers; plain drawing on "L" coverage masks
+    return ImageDraw.Draw(image, "RGBA") if image.mode == "RGBA" else ImageDraw.Draw(image)
+
+
+def _spaced_points(p0: tuple[int, int], p1: tuple[int, int], step: float) -> list[tuple[int, int]]:
+    dist = math.hypot(p1[0] - p0[0], p1[1] - p0[1])
+    points = [tuple(p0)]
+    for i in range(1, int(dist // step) + 1):
+        t = i * step / dist
+        points.append((int(round(p0[0] + (p1[0] - p0[0]) * t)), int(round(p0[1] + (p1[1] - p0[1]) * t))))
+    if points[-1] != tuple(p1):
+        points.append(tuple(p1))
+    return points
+
+
+def _bresenham(p0: tuple[int, int], p1: tuple[int, int]) -> list[tuple[int, int]]:
     x0, y0 = p0
     x1, y1 = p1
-    draw = ImageDraw.Draw(image, "RGBA")
     dx = abs(x1 - x0)
     dy = abs(y1 - y0)
     x, y = x0, y0
     sx = 1 if x0 < x1 else -1
     sy = 1 if y0 < y1 else -1
     err = dx - dy
-    half = brush_size // 2
-    def dot(px, py):
-        if brush_size <= 1:
-            draw.point((px, py), fill=color)
-        else:
-            bbox = (px - half, py - half, px + half, py + half)
-            draw.ellipse(bbox, fill=color)
+    points = []
     while True:
-        dot(x, y)
+        points.append((x, y))
         if x == x1 and y == y1:
             break
         e2 = 2 * err
@@ -71,36 +496,345 @@ def draw_brush_line(image, p0: tuple[int, int], p1: tuple[int, int], color: tupl
         if e2 < dx:
             err += dx
             y += sy
+    return points
+
+
+def _fill_swept_dab(image, points: list[tuple[int, int]], color, size: int, shape: str):
+    """
+    Fill the exact union of a hard convex dab stamped at every point of a monotone path.
+    Every row of that union is one span, so the segment is rasterized as a single capsule:
+    per-row extents are reduced with vector min/max, then each row is a plain fill.
+    """
+    dy, lx, rx = _dab_row_spans(size, shape)
+    pts = np.asarray(points)
+    if pts[-1, 1] < pts[0, 1]:
+        pts = pts[::-1]
+    xs, ys = pts[:, 0], pts[:, 1]
+    # Bresenham visits every row once, in order, so path rows are a contiguous range
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(ys)) + 1))
+    path_left = np.minimum.reduceat(xs, starts)
+    path_right = np.maximum.reduceat(xs, starts)
+
+    n_path, n_dab = len(starts), len(dy)
+    top = int(ys[0] + dy[0])
+    n_rows = n_path + n_dab - 1
+    row_left = np.full(n_rows, np.iinfo(np.int64).max, dtype=np.int64)
+    row_right = np.full(n_rows, np.iinfo(np.int64).min, dtype=np.int64)
+    # Sweep along whichever axis needs fewer vector ops
+    if n_dab <= n_path:
+        for j in range(n_dab):
+            np.minimum(row_left[j:j + n_path], path_left + lx[j], out=row_left[j:j + n_path])
+            np.maximum(row_right[j:j + n_path], path_right + rx[j], out=row_right[j:j + n_path])
+    else:
+        for i in range(n_path):
+            np.minimum(row_left[i:i + n_dab], lx + path_left[i], out=row_left[i:i + n_dab])
+            np.maximum(row_right[i:i + n_dab], rx + path_right[i], out=row_right[i:i + n_dab])
+
+    h = image.height
+    paste = image.paste
+    for i, (left, right) in enumerate(zip(row_left.tolist(), row_right.tolist())):
+        y = top + i
+        if 0 <= y < h:
+            paste(color, (left, y, right + 1, y + 1))
+    return (int(row_left.min()), top, int(row_right.max()) + 1, top + n_rows)
+
+
+def draw_dab(image, p: tuple[int, int], color: tuple[int, int, int, int], brush_size: int, shape: str = "round", hardness: float = 1.0):
+    """Stamp a single brush footprint and return the touched bbox (or None if off-canvas)."""
+    x, y = p
+    if brush_size <= 1:
+        _draw(image).point((x, y), fill=color)
+        return clip_rect((x, y, x + 1, y + 1), image.size)
+    dab = brush_dab(brush_size, shape, hardness)
+    half = brush_size // 2
+    image.paste(color, (x - half, y - half), dab)
+    return clip_rect((x - half, y - half, x - half + dab.width, y - half + dab.height), image.size)
+
+
+def draw_brush_line(
+    image,
+    p0: tuple[int, int],
+    p1: tuple[int, int],
+    color: tuple[int, int, int, int],
+    brush_size: int,
+    shape: str = "round",
+    hardness: float = 1.0,
+    spacing: float = 0.25,
+):
+    """
+    Draw a brush segment from p0 to p1 and return the touched bbox.
+    1px and hard brushes cover exactly the pixels of a dab at every Bresenham step;
+    soft brushes place cached dabs every spacing * brush_size pixels.
+    """
+    if brush_size <= 1:
+        points = _bresenham(p0, p1)
+        _draw(image).point(points, fill=color)
+        xs = [pt[0] for pt in points]
+        ys = [pt[1] for pt in points]
+        return clip_rect((min(xs), min(ys), max(xs) + 1, max(ys) + 1), image.size)
+
+    half = brush_size // 2
+    if hardness >= 1.0:
+        points = _bresenham(p0, p1)
+        if np is not None and len(points) >= SWEEP_MIN_STEPS and brush_size >= SWEEP_MIN_SIZE:
+            return clip_rect(_fill_swept_dab(image, points, color, brush_size, shape), image.size)
+        draw = _draw(image)
+        stamp = draw.rectangle if shape == "square" else draw.ellipse
+        for x, y in points:
+            stamp((x - half, y - half, x + half, y + half), fill=color)
+    else:
+        dab = brush_dab(brush_size, shape, hardness)
+        points = _spaced_points(p0, p1, max(1.0, spacing * brush_size))
+        for x, y in points:
+            image.paste(color, (x - half, y - half), dab)
+
+    xs = [pt[0] for pt in points]
+    ys = [pt[1] for pt in points]
+    return clip_rect((min(xs) - half, min(ys) - half, max(xs) + half + 1, max(ys) + half + 1), image.size)
+
+
+class StrokeBuffer:
+    """
+    Coverage mask for one brush stroke. Dabs combine with max-alpha, so overlapping dabs never
+    build up, and the stroke is blended into its layer once, when it ends. The mask only
+    covers the part of the canvas the stroke has reached (plus STROKE_MASK_MARGIN), with
+    its top-left at origin, and grows as dabs land outside it.
+    """
+
+    def __init__(self, size, color, brush_size: int, shape: str = "round", hardness: float = 1.0,
+                 spacing: float = 0.25, erase: bool = False):
+        self.size = tuple(size)
+        self.mask = None
+        self.origin = (0, 0)
+        self.color = tuple(color)
+        self.brush_size = brush_size
+        self.shape = shape
+        self.hardness = hardness
+        self.spacing = spacing
+        self.erase = erase
+        self.bbox = None
+        a = self.color[3]
+        self._alpha_lut = [v * a // 255 for v in range(256)]
+
+    def _reserve(self, rect):
+        """Make sure the mask covers the canvas part of rect (image space)."""
+        rect = clip_rect(rect, self.size)
+        if rect is None:
+            return
+        ox, oy = self.origin
+        if self.mask is not None:
+            area = (ox, oy, ox + self.mask.width, oy + self.mask.height)
+            if union_rect(area, rect) == area:
+                return
+            rect = union_rect(area, rect)
+        m = STROKE_MASK_MARGIN
+        x0, y0, x1, y1 = clip_rect((rect[0] - m, rect[1] - m, rect[2] + m, rect[3] + m), self.size)
+        mask = Image.new("L", (x1 - x0, y1 - y0), 0)
+        if self.mask is not None:
+            mask.paste(self.mask, (ox - x0, oy - y0))
+        self.mask = mask
+        self.origin = (x0, y0)
+
+    def add_line(self, p0: tuple[int, int], p1: tuple[int, int]):
+        """Accumulate a segment into the coverage mask and return the bbox it touched."""
+        half = self.brush_size // 2 if self.brush_size > 1 else 0
+        self._reserve((min(p0[0], p1[0]) - half, min(p0[1], p1[1]) - half,
+                       max(p0[0], p1[0]) + half + 1, max(p0[1], p1[1]) + half + 1))
+        if self.mask is None:
+            return None
+        ox, oy = self.origin
+        if self.hardness >= 1.0 or self.brush_size <= 1:
+            # Hard dabs are binary, so painting 255 is already max-alpha
+            q0, q1 = (p0[0] - ox, p0[1] - oy), (p1[0] - ox, p1[1] - oy)
+            bbox = draw_brush_line(self.mask, q0, q1, 255, self.brush_size, shape=self.shape)
+        else:
+            dab = brush_dab(self.brush_size, self.shape, self.hardness)
+            bbox = None
+            # Space the dabs in image coordinates: rounding is not shift-invariant
+            for x, y in _spaced_points(p0, p1, max(1.0, self.spacing * self.brush_size)):
+                x, y = x - ox, y - oy
+                box = (x - half, y - half, x - half + dab.width, y - half + dab.height)
+                self.mask.paste(ImageChops.lighter(self.mask.crop(box), dab), box)
+                bbox = union_rect(bbox, box)
+            bbox = clip_rect(bbox, self.mask.size)
+        if bbox is not None:
+            bbox = (bbox[0] + ox, bbox[1] + oy, bbox[2] + ox, bbox[3] + oy)
+        self.bbox = union_rect(self.bbox, bbox)
+        return bbox
+
+    def add_dab(self, p: tuple[int, int]):
+        return self.add_line(p, p)
+
+    def apply(self, region, origin: tuple[int, int]):
+        """Return region (a crop of the target layer taken at origin) with the stroke blended in."""
+        if self.mask is None:
+            return region.copy()
+        x, y = origin[0] - self.origin[0], origin[1] - self.origin[1]
+        cover = self.mask.crop((x, y, x + region.width, y + region.height))
+        if self.erase:
+            out = region.copy()
+            out.putalpha(ImageChops.multiply(region.getchannel("A"), ImageChops.invert(cover)))
+            return out
+        r, g, b, a = self.color
+        paint = Image.new("RGBA", region.size, (r, g, b, 0))
+        paint.putalpha(cover if a == 255 else cover.point(self._alpha_lut))
+        return Image.alpha_composite(region, paint)
+
+    def commit(self, layer):
+        """Blend the finished stroke into layer and return the touched bbox."""
+        if self.bbox is None:
+            return None
+        layer.paste(self.apply(layer.crop(self.bbox), self.bbox[:2]), self.bbox[:2])
+        return self.bbox
+
+
+def color_match_mask(image, target: tuple[int, int, int, int], tolerance: int = 0, exclude_color=None):
+    """
+    Return an "L" mask (255 = match) of pixels whose every RGBA channel is within
+    tolerance of target. Pixels exactly equal to exclude_color are left out.
+    """
+    img = image if image.mode == "RGBA" else image.convert("RGBA")
+    tolerance = max(0, int(tolerance))
+    if np is not None:
+        arr = np.asarray(img)
+        match = np.ones(arr.shape[:2], dtype=bool)
+        for c in range(4):
+            ch = arr[..., c]
+            lo, hi = target[c] - tolerance, target[c] + tolerance
+            if lo > 0:
+                match &= ch >= lo
+            if hi < 255:
+                match &= ch <= hi
+        if exclude_color is not None:
+            same = np.ones(arr.shape[:2], dtype=bool)
+            for c in range(4):
+                same &= arr[..., c] == exclude_color[c]
+            match &= ~same
+        return Image.fromarray(match.view(np.uint8) * 255, "L")
+
+    bands = img.split()
+    match = None
+    for c, band in enumerate(bands):
+        lut = [255 if abs(v - target[c]) <= tolerance else 0 for v in range(256)]
+        m = band.point(lut)
+        match = m if match is None else ImageChops.darker(match, m)
+    if exclude_color is not None:
+        same = None
+        for c, band in enumerate(bands):
+            e = band.point([255 if v == exclude_color[c] else 0 for v in range(256)])
+            same = e if same is None else ImageChops.darker(same, e)
+        match = ImageChops.subtract(match, same)
+    return match
+
+
+def _scanline_region(mask_bytes: bytearray, size: tuple[int, int], seed: tuple[int, int]) -> bytearray:
+    """
+    Span-based 4-connected fill over a row-major byte mask (255 = fillable).
+    Consumes mask_bytes and returns a same-sized buffer with the region set to 255.
+    """
+    w, h = size
+    out = bytearray(w * h)
+    find = mask_bytes.find
+    rfind = mask_bytes.rfind
+    stack = [seed[1] * w + seed[0]]
+    push = stack.append
+    pop = stack.pop
+    while stack:
+        i = pop()
+        if not mask_bytes[i]:
+            continue
+        y = i // w
+        row = y * w
+        left = rfind(b"\x00", row, i)
+        left = row if left == -1 else left + 1
+        right = find(b"\x00", i, row + w)
+        if right == -1:
+            right = row + w
+        span = right - left
+        mask_bytes[left:right] = bytes(span)
+        out[left:right] = b"\xff" * span
+
+        # Seed one pixel per fillable run directly above and below the span
+        for j, end in ((left - w, right - w), (left + w, right + w)):
+            if j < 0 or end > w * h:
+                continue
+            while j < end:
+                j = find(b"\xff", j, end)
+                if j == -1:
+                    break
+                push(j)
+                j = find(b"\x00", j, end)
+                if j == -1:
+                    break
+    return out
+
+
+def _run_count(mask) -> int:
+    """Approximate number of horizontal runs in an "L" mask (wrap-around edges ignored)."""
+    shifted = ImageChops.offset(mask, 1, 0)
+    return ImageChops.difference(mask, shifted).histogram()[255]
+
+
+def flood_fill_mask(image, seed: tuple[int, int], tolerance: int = 0, exclude_color=None):
+    """Return the contiguous region around seed as an "L" mask, or None if seed is outside."""
+    w, h = image.size
+    x, y = seed
+    if x < 0 or y < 0 or x >= w or y >= h:
+        return None
+    target = image.getpixel(seed)
+    return connected_region(color_match_mask(image, target, tolerance, exclude_color), seed)
+
+
+def connected_region(match, seed: tuple[int, int]):
+    """Return the 4-connected part of an "L" 0/255 mask that contains seed."""
+    w, h = match.size
+    x, y = seed
+    # Spans cost one Python step each, so scan along whichever axis gives longer runs
+    transposed = match.transpose(Image.TRANSPOSE)
+    if _run_count(transposed) < _run_count(match):
+        region = _scanline_region(bytearray(transposed.tobytes()), (h, w), (y, x))
+        return Image.frombytes("L", (h, w), bytes(region)).transpose(Image.TRANSPOSE)
+    region = _scanline_region(bytearray(match.tobytes()), (w, h), (x, y))
+    return Image.frombytes("L", (w, h), bytes(region))
+
 
 def flood_fill(image, seed: tuple[int, int], fill_color: tuple[int, int, int, int], tolerance: int = 0):
+    """Fill the contiguous region around seed and return the touched bbox (None if nothing changed)."""
     w, h = image.size
-    px = image.load()
     x, y = seed
     if x < 0 or y < 0 or x >= w or y >= h:
-        return
+        return None
 
-    target = px[seed]
+    target = image.getpixel(seed)
     if target == fill_color:
-        return
+        return None
 
-    def close_enough(c1, c2):
-        return (
-            abs(c1[0] - c2[0]) <= tolerance and
-            abs(c1[1] - c2[1]) <= tolerance and
-            abs(c1[2] - c2[2]) <= tolerance and
-            abs(c1[3] - c2[3]) <= tolerance
-        )
+    # Pixels already holding fill_color stop the spread, exactly like the old per-pixel fill
+    region = flood_fill_mask(image, seed, tolerance, exclude_color=fill_color)
+    bbox = region.getbbox()
+    if bbox is None:
+        return None
+    # A binary mask makes paste replace pixels outright (no blending), alpha included
+    image.paste(fill_color, bbox, region.crop(bbox))
+    return bbox
 
-    stack = [seed]
-    while stack:
-        cx, cy = stack.pop()
-        if cx < 0 or cy < 0 or cx >= w or cy >= h:
-            continue
-            
-        # 1. Check if the current pixel matches our target color group first
-        if close_enough(px[cx, cy], target) and px[cx, cy] != fill_color:
-            # 2. Paint the pixel safely AFTER the verification check passes
-            px[cx, cy] = fill_color
-            
-            # 3. Queue up the neighboring coordinates
-            stack.extend([(cx + 1, cy), (cx - 1, cy), (cx, cy + 1), (cx, cy - 1)])
+
+def select_color_global(image, seed: tuple[int, int], tolerance: int = 0):
+    """Return an "L" mask of every pixel in the layer matching the seed colour, contiguous or not."""
+    w, h = image.size
+    x, y = seed
+    if x < 0 or y < 0 or x >= w or y >= h:
+        return None
+    return color_match_mask(image, image.getpixel(seed), tolerance)
+
+
+def replace_color_global(image, seed: tuple[int, int], fill_color: tuple[int, int, int, int], tolerance: int = 0):
+    """Recolour every pixel matching the seed colour in one masked paste. Returns the touched bbox."""
+    mask = select_color_global(image, seed, tolerance)
+    if mask is None:
+        return None
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+    image.paste(fill_color, bbox, mask.crop(bbox))
+    return bbox
@@ -3,11 +3,73 @@ import tkinter as tk
 from tkinter import ttk, filedialog
 from PIL import Image, ImageTk
 
+from core.project import PROJECT_EXT, PROJECT_MAGIC, ProjectFile
+
 import os
 import ctypes
+import fnmatch
 from ctypes import wintypes
 
-SUPPORTED_INPUTS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp", ".ico", ".exe", ".dll")
+SUPPORTED_INPUTS = (".png", ".jpg", ".jpeg", ".bmp", ".gif", ".tif", ".tiff", ".webp", ".ico", ".icns", ".exe", ".dll", PROJECT_EXT)
+
+# Leading bytes identifying each input format; checked in order against the file head.
+SNIFF_BYTES = 16
+_MAGIC_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"\x00\x00\x01\x00", "ico"),
+    (b"icns", "icns"),
+    (b"BM", "bmp"),
+    (b"MZ", "pe"),
+    (PROJECT_MAGIC, "project"),
+)
+
+
+def sniff_bytes(head: bytes) -> str | None:
+    """Return the format name for a file header, or None if it is not a supported input."""
+    if len(head) >= 12 and head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    for magic, fmt in _MAGIC_SIGNATURES:
+        if head.startswith(magic):
+            return fmt
+    return None
+
+
+def sniff_image_format(path: str | Path) -> str | None:
+    """Read only the first few bytes of a file and classify it by content, not suffix."""
+    try:
+        with open(path, "rb") as f:
+            head = f.read(SNIFF_BYTES)
+    except OSError:
+        return None
+    return sniff_bytes(head)
+
+
+def iter_input_files(root: str | Path, include=("*",), exclude=()):
+    """
+    Walk root recursively and yield files matching any include glob and no exclude glob.
+    Globs are tested against both the file name and the path relative to root.
+    """
+    root = Path(root)
+    include = tuple(include) or ("*",)
+    exclude = tuple(exclude)
+
+    def matches(rel: str, name: str, patterns) -> bool:
+        return any(fnmatch.fnmatch(name, pat) or fnmatch.fnmatch(rel, pat) for pat in patterns)
+
+    for path in sorted(root.rglob("*")):
+        if not path.is_file():
+            continue
+        rel = path.relative_to(root).as_posix()
+        if not matches(rel, path.name, include):
+            continue
+        if exclude and matches(rel, path.name, exclude):
+            continue
+        yield path
 
 def _extract_icon_from_exe_windows(path: str | Path) -> Image.Image:
     """
@@ -310,22 +372,27 @@ def _extract_icon_from_exe_windows(path: str | Path) -> Image.Image:
     
 def load_image_with_alpha(path: str | Path, max_edit_dimension: int | None = None) -> Image.Image:
     """
-    Load an image and convert to RGBA. Supports standard image files, ICO, and
-    Windows EXE/DLL icon extraction. Optionally downscale so max(width, height)
+    Load an image and convert to RGBA. Supports standard image files, ICO/ICNS, and
+    Windows EXE/DLL icon extraction. The format is detected from the file content,
+    so odd or missing extensions are fine. Optionally downscale so max(width, height)
     <= max_edit_dimension for responsive editing with very large source images.
     """
     p = Path(path)
     if not p.exists():
         raise FileNotFoundError(f"File not found: {p}")
-    if p.suffix.lower() not in SUPPORTED_INPUTS:
-        raise ValueError(f"Unsupported format: {p.suffix}")
 
-    suffix = p.suffix.lower()
+    fmt = sniff_image_format(p)
+    if fmt is None:
+        raise ValueError(f"Unsupported format: {p.suffix or p.name}")
 
-    if suffix in (".exe", ".dll"):
+    if fmt == "pe":
         img = _extract_icon_from_exe_windows(p)
         if img is None:
             return None  # Pass the cancellation up the chain
+    elif fmt == "project":
+        project = ProjectFile.open(p)
+        img = project.composite()
+        project.close()
     else:
         img = Image.open(p).convert("RGBA")
 
@@ -348,9 +415,11 @@ def open_image_dialog(parent) -> str | None:
         parent=parent,
         title="Open Image or App Icon",
         filetypes=[
-            ("All supported", "*.png;*.jpg;*.jpeg;*.bmp;*.gif;*.tif;*.tiff;*.webp;*.ico;*.exe;*.dll"),
+            ("All supported", "*.png;*.jpg;*.jpeg;*.bmp;*.gif;*.tif;*.tiff;*.webp;*.ico;*.icns;*.exe;*.dll;*.icproj"),
+            ("Projects", "*.icproj"),
             ("Images", "*.png;*.jpg;*.jpeg;*.bmp;*.gif;*.tif;*.tiff;*.webp"),
             ("Windows Icons", "*.ico"),
+            ("Apple Icons", "*.icns"),
             ("Windows Executables / Libraries", "*.exe;*.dll"),
             ("All files", "*.*"),
         ],
@@ -367,3 +436,14 @@ def save_png_dialog(parent, initialfile: str | None = None) -> str | None:
         filetypes=[("PNG", "*.png")],
     )
     return path or None
+
+
+def save_project_dialog(parent, initialfile: str | None = None) -> str | None:
+    path = filedialog.asksaveasfilename(
+        parent=parent,
+        title="Save Project",
+        defaultextension=PROJECT_EXT,
+        initialfile=initialfile or "image" + PROJECT_EXT,
+        filetypes=[("Icon Editor Project", "*" + PROJECT_EXT)],
+    )
+    return path or None
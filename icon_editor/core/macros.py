@@ -0,0 +1,42 @@
+import json
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from core.document import Document
+
+
+MACRO_VERSION = 1
+# Document methods a macro step may call
+MACRO_OPS = ("invert", "grayscale", "flip_h", "flip_v", "trim", "remove_background")
+
+
+@dataclass
+class Macro:
+    """A recorded sequence of Document edits, stored as JSON steps like {"op": "trim"}."""
+    steps: list = field(default_factory=list)
+
+    def record(self, op: str, **params):
+        if op not in MACRO_OPS:
+            raise ValueError(f"Unknown macro operation: {op}")
+        self.steps.append({"op": op, **params})
+
+    def apply(self, doc: Document) -> Document:
+        for step in self.steps:
+            params = dict(step)
+            getattr(doc, params.pop("op"))(**params)
+        return doc
+
+    def save(self, path):
+        data = {"version": MACRO_VERSION, "steps": self.steps}
+        Path(path).write_text(json.dumps(data, indent=2), encoding="utf-8")
+
+    @classmethod
+    def load(cls, path) -> "Macro":
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        if data.get("version", 0) > MACRO_VERSION:
+            raise ValueError("Macro was recorded by a newer version")
+        macro = cls()
+        for step in data.get("steps", []):
+            params = dict(step)
+            macro.record(params.pop("op", None), **params)
+        return macro
@@ -0,0 +1,209 @@
+import json
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+
+from PIL import Image
+
+from core.editor_tools import HISTORY_TILE, HistoryTile, LayerTiles, tile_grid
+
+
+PROJECT_EXT = ".icproj"
+PROJECT_MAGIC = b"ICPROJ1\n"
+PROJECT_VERSION = 1
+# magic, then offset and length of the index chunk
+_HEADER = struct.Struct("<8sQQ")
+
+
+class ProjectFile:
+    """
+    An open layered project. The container is a fixed header pointing at a
+    zlib-compressed JSON index, plus one independently zlib-compressed chunk per
+    HISTORY_TILE tile of each layer, so any tile can be read with a single seek.
+    Opening only reads the index; tiles are decoded on demand by load_tile().
+
+    Tiles loaded from (or saved to) the file are remembered by identity, so a later
+    write_project() to the same path only appends the tiles that changed since.
+    """
+
+    def __init__(self, path, size, names, visible, active, spans):
+        self.path = Path(path)
+        self.size = tuple(size)
+        self.names = list(names)
+        self.visible = list(visible)
+        self.active = active
+        # Per layer, the (offset, length) of each tile chunk in tile_grid order
+        self.spans = spans
+        self._lock = threading.Lock()
+        self._file = None
+        # (offset, length) -> HistoryTile decoded from or written to that chunk, and
+        # id(tile) -> (tile, span) for the reverse lookup on save
+        self._by_span: dict[tuple[int, int], HistoryTile] = {}
+        self._by_tile: dict[int, tuple[HistoryTile, tuple[int, int]]] = {}
+
+    @classmethod
+    def open(cls, path) -> "ProjectFile":
+        with open(path, "rb") as f:
+            header = f.read(_HEADER.size)
+            if len(header) < _HEADER.size or header[:len(PROJECT_MAGIC)] != PROJECT_MAGIC:
+                raise ValueError("Not an icon editor project")
+            _, offset, length = _HEADER.unpack(header)
+            f.seek(offset)
+            try:
+                index = json.loads(zlib.decompress(f.read(length)).decode("utf-8"))
+            except (zlib.error, UnicodeDecodeError, ValueError) as e:
+                raise ValueError(f"Corrupt project index: {e}") from e
+        if index.get("version", 0) > PROJECT_VERSION or index.get("tile") != HISTORY_TILE:
+            raise ValueError("Unsupported project version")
+        try:
+            layers = index["layers"]
+            project = cls(
+                path,
+                index["size"],
+                [ly["name"] for ly in layers],
+                [ly["visible"] for ly in layers],
+                index.get("active", 0),
+                [[tuple(span) for span in ly["tiles"]] for ly in layers],
+            )
+        except (KeyError, TypeError) as e:
+            raise ValueError(f"Corrupt project index: missing {e}") from e
+        if any(len(row) != len(project.tile_boxes) for row in project.spans):
+            raise ValueError("Corrupt project index: tile count does not match the image size")
+        return project
+
+    @property
+    def tile_boxes(self) -> tuple:
+        return tile_grid(self.size)
+
+    def load_tile(self, layer: int, index: int) -> HistoryTile:
+        """
+        Decode one tile; safe to call from a loader thread. Chunks shared by several tiles
+        decode once. A damaged chunk raises ValueError.
+        """
+        span = self.spans[layer][index]
+        with self._lock:
+            tile = self._by_span.get(span)
+            if tile is not None:
+                if not tile.is_released:
+                    return tile
+                # The undo history dropped it; decode the chunk again
+                del self._by_span[span]
+                self._by_tile.pop(id(tile), None)
+            if self._file is None:
+                self._file = open(self.path, "rb")
+            self._file.seek(span[0])
+            packed = self._file.read(span[1])
+        box = self.tile_boxes[index]
+        try:
+            data = zlib.decompress(packed)
+        except zlib.error as e:
+            raise ValueError(f"Corrupt tile {index} of layer {layer} in {self.path.name}: {e}") from e
+        if len(data) != (box[2] - box[0]) * (box[3] - box[1]) * 4:
+            raise ValueError(f"Corrupt tile {index} of layer {layer} in {self.path.name}: wrong size")
+        tile = HistoryTile(data)
+        with self._lock:
+            # Another thread may have decoded the same chunk meanwhile; keep the first
+            tile = self._by_span.setdefault(span, tile)
+            self._by_tile[id(tile)] = (tile, span)
+        return tile
+
+    def load_layer(self, layer: int) -> Image.Image:
+        cells = tuple(self.load_tile(layer, i) for i in range(len(self.spans[layer])))
+        return LayerTiles(self.size, cells).to_image()
+
+    def composite(self) -> Image.Image:
+        """Flatten the visible layers, bottom first."""
+        out = Image.new("RGBA", self.size, (0, 0, 0, 0))
+        for i, vis in enumerate(self.visible):
+            if vis:
+                out.alpha_composite(self.load_layer(i))
+        return out
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def write_project(path, layers: list[LayerTiles], names, visible, active: int, previous: ProjectFile | None = None) -> ProjectFile:
+    """
+    Write a project and return it opened. When previous is the project last opened from
+    or saved to the same path, tiles it already holds (by identity) keep their chunks,
+    new chunks and the index are appended, and only then is the header repointed, so a
+    crash mid-save leaves the old project intact. Once more than half of the file would
+    be unreferenced chunks it is rewritten from scratch instead.
+    """
+    path = Path(path)
+    size = layers[0].size
+    known = {}
+    if previous is not None and path.exists() and previous.path.exists() and os.path.samefile(previous.path, path):
+        known = previous._by_tile
+    if previous is not None:
+        previous.close()
+
+    reused = {}
+    for ly in layers:
+        for tile in ly.tiles:
+            hit = known.get(id(tile))
+            if hit is not None:
+                reused[id(tile)] = hit[1]
+    live = sum(span[1] for span in set(reused.values()))
+    incremental = bool(reused) and path.stat().st_size - _HEADER.size <= 2 * live
+
+    if incremental:
+        f = open(path, "r+b")
+        f.seek(0, os.SEEK_END)
+        target = path
+    else:
+        reused = {}
+        target = path.with_name(path.name + ".tmp")
+        f = open(target, "wb")
+        f.write(_HEADER.pack(PROJECT_MAGIC, 0, 0))
+
+    by_tile = {}
+    spans = []
+    with f:
+        for ly in layers:
+            row = []
+            for tile in ly.tiles:
+                if id(tile) in by_tile:
+                    span = by_tile[id(tile)][1]
+                else:
+                    span = reused.get(id(tile))
+                if span is None:
+                    data = zlib.compress(tile.data, 1)
+                    span = (f.tell(), len(data))
+                    f.write(data)
+                by_tile[id(tile)] = (tile, span)
+                row.append(span)
+            spans.append(row)
+        index = {
+            "version": PROJECT_VERSION,
+            "size": list(size),
+            "tile": HISTORY_TILE,
+            "active": active,
+            "layers": [
+                {"name": name, "visible": bool(vis), "tiles": [list(s) for s in row]}
+                for name, vis, row in zip(names, visible, spans)
+            ],
+        }
+        packed = zlib.compress(json.dumps(index, separators=(",", ":")).encode("utf-8"), 6)
+        offset = f.tell()
+        f.write(packed)
+        f.flush()
+        os.fsync(f.fileno())
+        f.seek(0)
+        f.write(_HEADER.pack(PROJECT_MAGIC, offset, len(packed)))
+        f.flush()
+        os.fsync(f.fileno())
+    if target != path:
+        os.replace(target, path)
+
+    project = ProjectFile(path, size, names, visible, active, spans)
+    project._by_tile = by_tile
+    project._by_span = {span: tile for tile, span in by_tile.values()}
+    return project
+
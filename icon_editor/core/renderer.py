@@ -0,0 +1,290 @@
+import math
+import time
+
+from PIL import Image
+
+from core.display_cache import DisplayTileCache, MipPyramid, display_tile_size, tiles_in_rect
+from core.transparency import cached_checkerboard
+from utils.helpers import clip_rect, union_rect
+
+# Beyond this many pending rects a render covers their bounding union instead
+MAX_DIRTY_RECTS = 16
+# Display pixels rendered beyond each edge of the view, so small pans need no re-render
+RENDER_MARGIN = 256
+# Integer zooms are magnified either by Pillow or by the caller from a 1x base ("tk",
+# e.g. Tk's "copy -zoom"), whichever has been cheaper per display pixel; every this many
+# window rebuilds the other path is measured again
+ZOOM_PATHS = ("auto", "pillow", "tk")
+ZOOM_PROBE_INTERVAL = 32
+# Rendered display tiles kept for revisiting a zoom or scrolling back, in bytes
+DISPLAY_CACHE_BYTES = 96 * 1024 * 1024
+
+
+def display_pixel(v, zoom):
+    """
+    Display pixel of image coordinate v at zoom. Below 1x, v sits on a mip block
+    boundary except at the right / bottom image edge, whose partial block rounds up.
+    """
+    if zoom >= 1:
+        return int(v * zoom)
+    return -(-int(v) // round(1 / zoom))
+
+
+class Renderer:
+    """
+    Turns a CanvasModel into display bitmaps: the composite over a checkerboard, zoomed,
+    for a window around the viewed part of the image. Windows are assembled from display
+    tiles kept in a DisplayTileCache, and edits reported by the model only re-render the
+    rects they touched. Nothing here depends on Tk.
+    """
+
+    def __init__(self, model, cache_bytes: int = DISPLAY_CACHE_BYTES, zoom_path: str = "pillow"):
+        if zoom_path not in ZOOM_PATHS:
+            raise ValueError(f"Unknown zoom path: {zoom_path}")
+        self.model = model
+        self.profiler = model.profiler
+        self.zoom = 1
+        # Zoom the base and its tiles are rendered at: the view zoom, or 1 when the caller
+        # magnifies the base itself
+        self.base_zoom = 1
+        # Zoomed rendering of only window (an image-space rect around the view)
+        self.base: Image.Image | None = None
+        self.window = None
+        self.cache = DisplayTileCache(cache_bytes)
+        self.mips = MipPyramid()
+        self.zoom_path = zoom_path
+        # Path -> average display update cost in ms per million display pixels
+        self.zoom_cost: dict[str, float | None] = {"pillow": None, "tk": None}
+        self._rebuilds = 0
+        self._key = None
+        self._bg = None
+        self._source: Image.Image | None = None
+        # Rebuild the window on the next render even if it still covers the view
+        self._moved = False
+
+    def to_base(self, v):
+        """Pixel of image coordinate v in the base and its tiles."""
+        return display_pixel(v, self.base_zoom)
+
+    def covers(self, view) -> bool:
+        """Whether the current window contains the image-space rect view."""
+        win = self.window
+        if win is None or view is None:
+            return False
+        return view[0] >= win[0] and view[1] >= win[1] and view[2] <= win[2] and view[3] <= win[3]
+
+    def render(self, view, zoom):
+        """
+        Bring the base up to date for the image-space rect view (None for the whole image)
+        at zoom. Returns (image, rects) where rects are the image-space regions that
+        changed, or None when the whole window was rebuilt; (None, None) without layers.
+
+        The window is rebuilt when the view leaves it or the zoom changes, so scrolling
+        back or returning to a zoom only re-renders tiles the document changed since.
+        """
+        model = self.model
+        if not model.layers:
+            return None, None
+        comp = model.live_composite()
+        size = comp.size
+        self._source = comp
+        damage = model.take_render_damage()
+        full = damage is None
+        damage = damage or []
+
+        # 1. Fetch the shared checkerboard for this size. NEAREST upscaling commutes with
+        # compositing, so blending at image resolution gives the same pixels for z^2 less work
+        bg = cached_checkerboard(size, 8)
+        if bg is not self._bg:
+            self._bg = bg
+            full = True
+
+        cache = self.cache
+        if full or (self._key is not None and self._key[1] != size):
+            cache.clear()
+            self.mips.clear()
+        else:
+            for r in damage:
+                self.mips.invalidate(r)
+
+        # 2. Rebuild the whole window from tiles, or re-render only the damaged rects in it.
+        # A rebuild is also when the zoom path may change
+        view = view or (0, 0, *size)
+        key = (zoom, size)
+        self.zoom = zoom
+        if full or self._moved or self.base is None or self._key != key or not self.covers(view):
+            for r in damage:
+                r = clip_rect(r, size)
+                if r is not None:
+                    cache.invalidate(r)
+            self.base_zoom = z = self._choose_base_zoom()
+            win = self._render_window(view)
+            self.window = win
+            b = self.to_base
+            self.base = Image.new("RGBA", (b(win[2]) - b(win[0]), b(win[3]) - b(win[1])))
+            self._key = key
+            for tx, ty in tiles_in_rect(win, z):
+                tr = self._tile_rect(tx, ty)
+                self._paste_display(self._cached_tile(tx, ty), tr[0], tr[1])
+            rects = None
+        else:
+            z = self.base_zoom
+            dirty = []
+            for r in damage:
+                r = clip_rect(r, size)
+                if r is None:
+                    continue
+                # Tiles at other zooms are dropped. Of those at this zoom only the ones in the
+                # window get patched; the rest are dropped too
+                cache.invalidate(r, keep_zoom=z)
+                for tx, ty in tiles_in_rect(r, z):
+                    if self.clip_to_window(self._tile_rect(tx, ty)) is None:
+                        cache.discard((tx, ty, z))
+                r = self.clip_to_window(self.align_rect(r))
+                if r is not None:
+                    dirty.append(r)
+            if len(dirty) > MAX_DIRTY_RECTS:
+                merged = None
+                for r in dirty:
+                    merged = union_rect(merged, r)
+                dirty = [merged]
+            for r in dirty:
+                self._render_region(r)
+            rects = dirty
+
+        self._moved = False
+        return self.base, rects
+
+    def _render_image(self, rect):
+        """Render one image-space rect of the composite over the checkerboard at the base zoom."""
+        z = self.base_zoom
+        if z < 1:
+            # rect is on mip block boundaries: crop the level and lay it on a checkerboard
+            # of the level's size, so squares keep their on-screen size
+            with self.profiler.span("scale"):
+                level = self.mips.level(self._source, round(1 / z))
+                box = tuple(self.to_base(v) for v in rect)
+                part = level.crop(box).convert("RGBA")
+            with self.profiler.span("checkerboard"):
+                return Image.alpha_composite(cached_checkerboard(level.size, 8).crop(box), part)
+
+        with self.profiler.span("checkerboard"):
+            region = Image.alpha_composite(self._bg.crop(rect), self._source.crop(rect))
+        if z != 1:
+            with self.profiler.span("scale"):
+                region = region.resize((region.width * z, region.height * z), Image.NEAREST)
+        return region
+
+    def _tile_rect(self, tx, ty):
+        t = display_tile_size(self.base_zoom)
+        return clip_rect((tx * t, ty * t, (tx + 1) * t, (ty + 1) * t), self._source.size)
+
+    def _cached_tile(self, tx, ty):
+        """The display tile (tx, ty) at the base zoom, rendered and cached on a miss."""
+        key = (tx, ty, self.base_zoom)
+        tile = self.cache.get(key)
+        if tile is None:
+            tile = self._render_image(self._tile_rect(tx, ty))
+            self.cache.put(key, tile)
+        return tile
+
+    def _paste_display(self, image, x, y):
+        """Paste a base-resolution image whose top-left is image pixel (x, y) into the base."""
+        wx0, wy0 = self.window[:2]
+        b = self.to_base
+        self.base.paste(image, (b(x) - b(wx0), b(y) - b(wy0)))
+
+    def _render_region(self, rect):
+        """Re-render one image-space rect of the window and patch the cached tiles under it."""
+        region = self._render_image(rect)
+        self._paste_display(region, rect[0], rect[1])
+        z = self.base_zoom
+        b = self.to_base
+        for tx, ty in tiles_in_rect(rect, z):
+            tile = self.cache.peek((tx, ty, z))
+            if tile is not None:
+                tr = self._tile_rect(tx, ty)
+                tile.paste(region, (b(rect[0]) - b(tr[0]), b(rect[1]) - b(tr[1])))
+
+    def _render_window(self, view):
+        """
+        Image-space rect to render: view plus RENDER_MARGIN display pixels, grown to whole
+        display tiles and clipped to the image.
+        """
+        size = self._source.size
+        m = math.ceil(RENDER_MARGIN / self.zoom)
+        t = display_tile_size(self.base_zoom)
+        x0, y0 = (view[0] - m) // t * t, (view[1] - m) // t * t
+        x1, y1 = -(-(view[2] + m) // t) * t, -(-(view[3] + m) // t) * t
+        return clip_rect((x0, y0, x1, y1), size)
+
+    def _choose_base_zoom(self):
+        """The base zoom for a window rebuild: 1 when the caller should magnify, else the view zoom."""
+        z = self.zoom
+        if z <= 1 or z != int(z):
+            return z
+        path = self.zoom_path
+        if path == "auto":
+            costs = self.zoom_cost
+            self._rebuilds += 1
+            unmeasured = [p for p in ("tk", "pillow") if costs[p] is None]
+            if unmeasured:
+                path = unmeasured[0]
+            else:
+                path = min(costs, key=costs.get)
+                if self._rebuilds % ZOOM_PROBE_INTERVAL == 0:
+                    path = "pillow" if path == "tk" else "tk"
+        return 1 if path == "tk" else z
+
+    def current_path(self) -> str:
+        """How the last render is magnified: "pillow", "tk", or "mip" below 1x."""
+        return "mip" if self.zoom < 1 else "tk" if self.base_zoom != self.zoom else "pillow"
+
+    def record_cost(self, start, pixels):
+        """Fold a frame's display update time into the average of the zoom path that drew it."""
+        if self.zoom <= 1 or not pixels:
+            return
+        path = self.current_path()
+        cost = (time.perf_counter() - start) * 1000 * 1_000_000 / pixels
+        prev = self.zoom_cost[path]
+        self.zoom_cost[path] = cost if prev is None else prev + (cost - prev) * 0.2
+
+    def set_zoom_path(self, path: str):
+        """Magnify integer zooms with "pillow", leave it to the caller ("tk"), or pick by measured cost ("auto")."""
+        if path not in ZOOM_PATHS:
+            raise ValueError(f"Unknown zoom path: {path}")
+        self.zoom_path = path
+        self._moved = True
+
+    def align_rect(self, rect):
+        """Below 1x, grow an image-space rect to whole mip blocks; the window is always aligned."""
+        if self.zoom >= 1:
+            return rect
+        f = round(1 / self.zoom)
+        x0, y0, x1, y1 = rect
+        return clip_rect((x0 // f * f, y0 // f * f, -(-x1 // f) * f, -(-y1 // f) * f), self._source.size)
+
+    def clip_to_window(self, rect):
+        win = self.window
+        if rect is None or win is None:
+            return None
+        x0, y0 = max(rect[0], win[0]), max(rect[1], win[1])
+        x1, y1 = min(rect[2], win[2]), min(rect[3], win[3])
+        if x0 >= x1 or y0 >= y1:
+            return None
+        return (int(x0), int(y0), int(x1), int(y1))
+
+    def stats(self) -> dict:
+        """Display tile cache counters, the zoom path in use and the measured cost of each."""
+        stats = self.cache.stats()
+        stats["zoom_path"] = self.current_path()
+        stats["zoom_cost"] = dict(self.zoom_cost)
+        return stats
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the base, the checkerboard and the mip levels (the tile cache aside)."""
+        def nbytes(im):
+            return im.width * im.height * len(im.getbands()) if im is not None else 0
+
+        return nbytes(self.base) + nbytes(self._bg) + self.mips.nbytes
@@ -1,16 +1,80 @@
-from PIL import Image
-
-
-def create_checkerboard(size: tuple[int, int], square_size: int = 8) -> Image.Image:
-    w, h = size
-    bg = Image.new("RGB", (w, h), (192, 192, 192))
-    px = bg.load()
-    c1 = (220, 220, 220)
-    c2 = (180, 180, 180)
-    for y in range(h):
-        for x in range(w):
-            if ((x // square_size) + (y // square_size)) % 2 == 0:
-                px[x, y] = c1
-            else:
-                px[x, y] = c2
+from functools import lru_cache
+from PIL import Image, ImageChops, ImageFilter
+from core.editor_tools import color_match_mask, connected_region
+
+
+CHECKER_LIGHT = (220, 220, 220)
+CHECKER_DARK = (180, 180, 180)
+
+
+def create_checkerboard(size: tuple[int, int], square_size: int = 8, zoom: int = 1) -> Image.Image:
+    """
+    Return an RGB checkerboard of size * zoom pixels with squares of square_size * zoom,
+    i.e. the image-resolution board already scaled to display resolution.
+    """
+    sq = max(1, square_size * zoom)
+    w, h = size[0] * zoom, size[1] * zoom
+    # One light/dark pair, repeated across a strip, repeated down the board
+    tile = Image.new("RGB", (2 * sq, 2 * sq), CHECKER_DARK)
+    tile.paste(CHECKER_LIGHT, (0, 0, sq, sq))
+    tile.paste(CHECKER_LIGHT, (sq, sq, 2 * sq, 2 * sq))
+    strip = Image.new("RGB", (w, 2 * sq))
+    for x in range(0, w, 2 * sq):
+        strip.paste(tile, (x, 0))
+    bg = Image.new("RGB", (w, h))
+    for y in range(0, h, 2 * sq):
+        bg.paste(strip, (0, y))
     return bg
+
+
+@lru_cache(maxsize=2)
+def cached_checkerboard(size: tuple[int, int], square_size: int = 8, zoom: int = 1) -> Image.Image:
+    """RGBA create_checkerboard shared between callers; treat the result as read-only."""
+    return create_checkerboard(size, square_size, zoom).convert("RGBA")
+
+
+def corner_color(image: Image.Image) -> tuple[int, int, int, int]:
+    """The most common of the four corner pixels, taken as the background colour."""
+    img = image if image.mode == "RGBA" else image.convert("RGBA")
+    w, h = img.size
+    samples = [img.getpixel(c) for c in ((0, 0), (w - 1, 0), (0, h - 1), (w - 1, h - 1))]
+    return max(set(samples), key=samples.count)
+
+
+def background_mask(image: Image.Image, tolerance: int = 0, contiguous: bool = False, target=None) -> Image.Image:
+    """
+    Return an "L" mask (255 = background) of pixels whose RGB is within tolerance of
+    target (default: the corner colour). With contiguous, only matches connected to
+    the image border are kept, so enclosed areas of the same colour survive.
+    """
+    if target is None:
+        target = corner_color(image)
+    # Alpha is ignored when matching, as the old exact-match removal did
+    match = color_match_mask(image.convert("RGB"), (*target[:3], 255), tolerance)
+    if not contiguous:
+        return match
+
+    # A 1px matching frame joins every border run into one region reachable from (0, 0)
+    w, h = image.size
+    framed = Image.new("L", (w + 2, h + 2), 255)
+    framed.paste(match, (1, 1))
+    return connected_region(framed, (0, 0)).crop((1, 1, w + 1, h + 1))
+
+
+def remove_background(image: Image.Image, tolerance: int = 0, contiguous: bool = False, feather: float = 0, target=None):
+    """
+    Make the background of an RGBA image transparent in place and return the touched
+    bbox (None if nothing matched). feather fades alpha over roughly that many pixels
+    into the foreground instead of leaving a hard cut-out edge.
+    """
+    mask = background_mask(image, tolerance, contiguous, target)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return None
+    if feather > 0:
+        # Only ever lower alpha: background stays fully clear, the foreground edge fades
+        mask = ImageChops.lighter(mask, mask.filter(ImageFilter.GaussianBlur(feather)))
+        bbox = mask.getbbox()
+    alpha = image.getchannel("A")
+    image.putalpha(ImageChops.multiply(alpha, ImageChops.invert(mask)))
+    return bbox
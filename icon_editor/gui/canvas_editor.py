@@ -1,12 +1,31 @@
+import time
 import tkinter as tk
 from tkinter import ttk, simpledialog, messagebox
-from PIL import Image, ImageTk, ImageDraw, ImageOps, ImageChops, ImageFont
-from core.editor_tools import ToolType, UndoRedoStack, flood_fill, draw_brush_line
-from core.transparency import create_checkerboard
-from utils.helpers import clamp
+from PIL import Image, ImageTk
+from core.canvas_model import CanvasModel
+from core.display_cache import grid_overlay
+from core.editor_tools import ToolType
+from core.renderer import Renderer, display_pixel
+from utils.helpers import clamp, clip_rect
+from utils.profiler import DEFAULT_LOG, profiled
+
+# Zoom-out levels below 1x, each shown from a 2x box-filtered reduction of the one above
+ZOOM_OUT_LEVELS = (0.5, 0.25, 0.125)
+# Renders are coalesced into at most this many frames per second
+TARGET_FPS = 60
+# The performance HUD is redrawn at most this often, in ms
+HUD_INTERVAL_MS = 500
+# Lazy project loading: tiles decoded in the background are pasted every LOAD_POLL_MS
+LOAD_POLL_MS = 15
 
 
 class CanvasEditor(ttk.Frame):
+    """
+    Tk view and controller over a CanvasModel: it turns mouse and keyboard events into
+    tool calls at image coordinates, and shows what a Renderer draws for the scrolled
+    viewport, with the selection, shape preview, pixel grid and HUD as canvas items.
+    """
+
     def __init__(
         self,
         parent,
@@ -16,157 +35,68 @@ class CanvasEditor(ttk.Frame):
         on_zoom_change=None,
         on_layers_changed=None,
         on_color_ui=None,
+        on_history_change=None,
     ):
         super().__init__(parent)
         self.parent = parent
         self.on_status = on_status or (lambda text: None)
         self.on_cursor = on_cursor or (lambda x, y: None)
-        self.on_size_change = on_size_change or (lambda w, h: None)
         self.on_zoom_change = on_zoom_change or (lambda z: None)
-        self.on_layers_changed = on_layers_changed or (lambda: None)
-        self.on_color_ui = on_color_ui or (lambda rgba: None)
-
-        self._bg_cache = None
-
-        self.layers: list[Image.Image] = []
-        self.layer_visible: list[bool] = []
-        self.layer_names: list[str] = []
-        self.active_layer = 0
-
-        self._composite_cache: Image.Image | None = None
-        self._composite_dirty = True
 
+        self.model = CanvasModel(
+            on_change=self._request_frame,
+            on_status=self.on_status,
+            on_size_change=on_size_change,
+            on_layers_changed=on_layers_changed,
+            on_color=on_color_ui,
+            on_history_change=on_history_change,
+        )
+        # Per-frame stage timings, tool event and history costs, for the performance HUD
+        self.profiler = self.model.profiler
+        # Integer zooms are magnified by Pillow or by Tk ("copy -zoom"), whichever is cheaper
+        self.renderer = Renderer(self.model, zoom_path="auto")
+
+        self._refresh_ms = 0.0
+        self._refresh_ms_avg = 0.0
+        # Frame scheduler: edits only request a frame; one after() tick renders them all
+        self._frame_interval_ms = 1000 / TARGET_FPS
+        self._frame_after = None
+        self._last_frame = 0.0
+        self._view_check_pending = False
+        self._hud_item = None
+        self._hud_bg = None
+        self._hud_shown_at = 0.0
+        self._idle_from = 0.0
+        # Selection marquee, floating selection and shape preview are canvas items of their
+        # own above the display image: name -> [item, source image, key, photo]
+        self._marquee_item = None
+        self._overlays: dict[str, list] = {}
+
+        # One photo per display window, reallocated only when the window size changes, plus
+        # a scratch photo that dirty regions are staged in before Tk copies them into place
         self._display_image = None
+        self._scratch_image = None
+        self._transfer_ms = 0.0
+        self._transfer_bytes = 0
         self._canvas_image_id = None
         self.zoom = 4
         self.show_grid = False
+        # Pixel grid drawn as a viewport-sized overlay item above the display image
+        self._grid_item = None
+        self._grid_photo = None
+        self._grid_key = None
 
         self._space_pan_active = False
 
-        self.tool = ToolType.PENCIL
-        self.brush_size = 5
-        self.color = (0, 0, 0, 255)
-        self.alpha = 255
-        self.fill_tolerance = 0
-        self.shape_fill = False
-
-        # Selection / move
-        self.sel_active = False
-        self.sel_start = None
-        self.sel_rect = None
-        self.sel_floating = None
-        self.sel_offset = (0, 0)
-
-        # Gestures
-        self.is_drawing = False
-        self.last_pos = None
-
-        # Shapes
-        self.shape_start = None
-        self.preview_image = None
-        self.clipboard_image = None
-        
-        self.history = UndoRedoStack(limit=50)
-        self.is_unsaved = False
-        
         self._build_ui()
         # NOTE: Do not call new_blank here; main_window triggers it after widget exists.
 
     # ---------- Size helpers ----------
-
     def width(self):
-        return self.layers[0].width if self.layers else 0
+        return self.model.width()
 
     def height(self):
-        return self.layers[0].height if self.layers else 0
-
-    # ---------- Composite ----------
-    def _mark_dirty(self):
-        self._composite_dirty = True
-        self.is_unsaved = True
-
-    def get_composite(self):
-        if not self.layers:
-            return None
-        if self._composite_dirty or self._composite_cache is None:
-            base = Image.new("RGBA", (self.width(), self.height()), (0, 0, 0, 0))
-            for ly, vis in zip(self.layers, self.layer_visible):
-                if vis:
-                    base.alpha_composite(ly)
-            self._composite_cache = base
-            self._composite_dirty = False
-        return self._composite_cache.copy()
-
-    def _get_composite_with_preview(self):
-        comp = self.get_composite()
-        if comp is None:
-            return None
-        comp = comp.copy()
-        if self.sel_floating is not None:
-            comp.alpha_composite(self.sel_floating, self.sel_offset)
-        if self.preview_image is not None:
-            comp.alpha_composite(self.preview_image)
-        return comp
-
-    # ---------- Layer controls ----------
-    def active_layer_index(self):
-        return self.active_layer
-
-    def get_layer_list(self):
-        return [(self.layer_names[i], self.layer_visible[i]) for i in range(len(self.layers))]
-
-    def set_active_layer(self, idx: int):
-        if 0 <= idx < len(self.layers):
-            self.active_layer = idx
-            self.on_status(f"Active layer: {self.layer_names[idx]}")
-
-    def layer_add(self):
-        if not self.layers:
-            return
-        self._push_state()
-        new_layer = Image.new("RGBA", (self.width(), self.height()), (0, 0, 0, 0))
-        self.layers.insert(self.active_layer + 1, new_layer)
-        self.layer_visible.insert(self.active_layer + 1, True)
-        self.layer_names.insert(self.active_layer + 1, f"Layer {len(self.layers)}")
-        self.active_layer += 1
-        self._mark_dirty()
-        self._refresh_display()
-        self.on_layers_changed()
-
-    def layer_delete(self):
-        if len(self.layers) <= 1:
-            messagebox.showinfo("Cannot delete", "At least one layer is required.")
-            return
-        self._push_state()
-        del self.layers[self.active_layer]
-        del self.layer_visible[self.active_layer]
-        del self.layer_names[self.active_layer]
-        self.active_layer = max(0, self.active_layer - 1)
-        self._mark_dirty()
-        self._refresh_display()
-        self.on_layers_changed()
-
-    def layer_move(self, direction: int):
-        i = self.active_layer
-        j = i + direction
-        if 0 <= i < len(self.layers) and 0 <= j < len(self.layers):
-            self._push_state()
-            self.layers[i], self.layers[j] = self.layers[j], self.layers[i]
-            self.layer_visible[i], self.layer_visible[j] = self.layer_visible[j], self.layer_visible[i]
-            self.layer_names[i], self.layer_names[j] = self.layer_names[j], self.layer_names[i]
-            self.active_layer = j
-            self._mark_dirty()
-            self._refresh_display()
-            self.on_layers_changed()
-
-    def layer_toggle_visibility(self):
-        if not self.layers:
-            return
-        self._push_state()
-        self.layer_visible[self.active_layer] = not self.layer_visible[self.active_layer]
-        self._mark_dirty()
-        self._refresh_display()
-        self.on_layers_changed()
+        return self.model.height()
 
     # ---------- UI ----------
     def _build_ui(self):
@@ -181,8 +111,8 @@ class CanvasEditor(ttk.Frame):
         # Restore the missing scrollbars
         self.hbar = ttk.Scrollbar(self, orient="horizontal", command=self.canvas.xview)
         self.vbar = ttk.Scrollbar(self, orient="vertical", command=self.canvas.yview)
-        self.canvas.configure(xscrollcommand=self.hbar.set, yscrollcommand=self.vbar.set)
-        
+        self.canvas.configure(xscrollcommand=self._on_xscroll, yscrollcommand=self._on_yscroll)
+
         self.hbar.grid(row=1, column=0, sticky="ew")
         self.vbar.grid(row=0, column=1, sticky="ns")
 
@@ -198,9 +128,9 @@ class CanvasEditor(ttk.Frame):
 
         self.canvas.bind("<Motion>", self._on_mouse_move)
         self.canvas.bind("<Leave>", lambda e: self.on_cursor(None, None))
-        self.canvas.bind("<ButtonPress-1>", self._on_mouse_down)
-        self.canvas.bind("<B1-Motion>", self._on_mouse_drag)
-        self.canvas.bind("<ButtonRelease-1>", self._on_mouse_up)
+        self.canvas.bind("<ButtonPress-1>", lambda e: self._tool_event(self._on_mouse_down, e))
+        self.canvas.bind("<B1-Motion>", lambda e: self._tool_event(self._on_mouse_drag, e))
+        self.canvas.bind("<ButtonRelease-1>", lambda e: self._tool_event(self._on_mouse_up, e))
 
         self.canvas.bind("<MouseWheel>", self._on_mouse_wheel)
         self.canvas.bind("<Shift-MouseWheel>", self._on_mouse_wheel)
@@ -208,7 +138,7 @@ class CanvasEditor(ttk.Frame):
         self.canvas.bind("<Button-5>", self._on_mouse_wheel)
         self.canvas.bind("<Shift-Button-4>", self._on_mouse_wheel)
         self.canvas.bind("<Shift-Button-5>", self._on_mouse_wheel)
-        
+
         # Safely bind Linux horizontal scroll buttons (Windows will ignore this without crashing)
         try:
             self.canvas.bind("<Button-6>", self._on_mouse_wheel)
@@ -220,81 +150,125 @@ class CanvasEditor(ttk.Frame):
         self.canvas.bind("<Configure>", self._on_canvas_configure, add="+")
 
     def _on_canvas_configure(self, event):
-        if not self._first_fit_done and self.layers:
+        if not self._first_fit_done and self.model.layers:
             self.fit_to_window()
             self._first_fit_done = True
+        else:
+            self._schedule_view_check()
+
+    def _on_xscroll(self, first, last):
+        self.hbar.set(first, last)
+        self._schedule_view_check()
+
+    def _on_yscroll(self, first, last):
+        self.vbar.set(first, last)
+        self._schedule_view_check()
+
+    def _schedule_view_check(self):
+        # Scrolling reports both axes, often several times per event; check once when idle
+        if not self._view_check_pending:
+            self._view_check_pending = True
+            self.after_idle(self._check_view)
+
+    def _check_view(self):
+        """Re-render once the viewport has moved past the rendered margin."""
+        self._view_check_pending = False
+        view = self._viewport_image_rect()
+        if view is None or self.renderer.window is None:
+            return
+        self._place_grid()
+        self._place_hud()
+        if not self.renderer.covers(view):
+            self._request_frame()
 
     # ---------- Lifecycle ----------
     def new_blank(self, size):
-        w, h = size
-        self.layers = [Image.new("RGBA", (w, h), (0, 0, 0, 0))]
-        self.layer_visible = [True]
-        self.layer_names = ["Layer 1"]
-        self.active_layer = 0
-        self._reset_selection()
-        self.history.clear()
-        self._push_state()
-        self._mark_dirty()
+        self.model.new_blank(size)
         self.fit_to_window()
-        self.on_status(f"New {w}x{h} canvas")
-        self.on_size_change(w, h)
-        self.on_layers_changed()
-        self.is_unsaved = False
 
     def load_image(self, image):
-        img = image.convert("RGBA")
-        self.layers = [img]
-        self.layer_visible = [True]
-        self.layer_names = ["Background"]
-        self.active_layer = 0
-        self._reset_selection()
-        self.history.clear()
-        self._push_state()
-        self._mark_dirty()
+        self.model.load_image(image)
+        self.fit_to_window()
+
+    def load_layers(self, layers, names, visible, active=0):
+        """Replace the document with ready-made RGBA layers, e.g. a recovered session."""
+        self.model.load_layers(layers, names, visible, active)
         self.fit_to_window()
-        self.on_status("Image loaded")
-        self.on_size_change(img.width, img.height)
-        self.on_layers_changed()
-        self.is_unsaved = False
-
-    def _reset_selection(self):
-        self.sel_active = False
-        self.sel_start = None
-        self.sel_rect = None
-        self.sel_floating = None
-        self.sel_offset = (0, 0)
-        self.preview_image = None
+
+    def load_project(self, project):
+        """
+        Open a ProjectFile lazily: tiles under the viewport are decoded right away and the
+        rest on a background thread, pasted in as they arrive.
+        """
+        self.model.open_project(project)
+        self.fit_to_window()
+        token = self.model.start_loading(self._viewport_image_rect())
+        if token is not None:
+            self.after(LOAD_POLL_MS, self._poll_loading, token)
+
+    def _poll_loading(self, token):
+        try:
+            more = self.model.drain_loading(token)
+        except ValueError as e:
+            messagebox.showerror("Error", f"Failed to open project:\n{e}")
+            return
+        if more:
+            self.after(LOAD_POLL_MS, self._poll_loading, token)
+
+    def layer_delete(self):
+        if not self.model.layer_delete():
+            messagebox.showinfo("Cannot delete", "At least one layer is required.")
 
     # ---------- View ----------
-    def set_zoom(self, zoom: int):
-        zoom = clamp(zoom, 1, 16)
+    def set_zoom(self, zoom, focus=None):
+        """
+        Change zoom: a whole 1..16, or one of ZOOM_OUT_LEVELS. focus, a widget (x, y),
+        keeps the image pixel under it in place.
+        """
+        if zoom >= 1:
+            zoom = clamp(zoom, 1, 16)
+        else:
+            zoom = min(ZOOM_OUT_LEVELS, key=lambda level: abs(level - zoom))
         if self.zoom != zoom:
+            if focus is not None:
+                fx, fy = focus
+                cx, cy = self.canvas.canvasx(fx), self.canvas.canvasy(fy)
+            scale = zoom / self.zoom
             self.zoom = zoom
-            self._refresh_display()
+            sr_w, sr_h = self._update_scrollregion()
+            if focus is not None:
+                # Scroll before rendering, so only the new viewport gets rendered
+                self.canvas.xview_moveto(max(0.0, cx * scale - fx) / sr_w)
+                self.canvas.yview_moveto(max(0.0, cy * scale - fy) / sr_h)
+            self._request_frame()
             self.on_status(f"Zoom: {self.zoom}x")
             self.on_zoom_change(self.zoom)
 
     def fit_to_window(self):
-        if not self.layers:
+        if not self.model.layers:
             return
         cw = max(1, self.canvas.winfo_width())
         ch = max(1, self.canvas.winfo_height())
         zw = cw // max(1, self.width())
         zh = ch // max(1, self.height())
-        z = max(1, min(zw, zh))
-        self.zoom = clamp(z, 1, 16)
-        self._refresh_display()
+        z = min(zw, zh)
+        if z >= 1:
+            self.zoom = clamp(z, 1, 16)
+        else:
+            # The largest zoom-out level that fits, or the smallest there is
+            fits = [level for level in ZOOM_OUT_LEVELS if self.width() * level <= cw and self.height() * level <= ch]
+            self.zoom = fits[0] if fits else ZOOM_OUT_LEVELS[-1]
+        self._update_scrollregion()
+        self._request_frame()
         self.reset_scroll()
         self.on_zoom_change(self.zoom)
 
     def reset_scroll(self):
-        bbox = self.canvas.bbox("all")
-        if not bbox:
+        if not self.model.layers:
             return
 
-        x0, y0, x1, y1 = bbox
-        w = x1 - x0
-        h = y1 - y0
+        w = self.width() * self.zoom
+        h = self.height() * self.zoom
         cw = self.canvas.winfo_width()
         ch = self.canvas.winfo_height()
 
@@ -311,152 +285,25 @@ class CanvasEditor(ttk.Frame):
 
     def set_grid(self, show: bool):
         self.show_grid = show
-        self._refresh_display()
-
-    # ---------- Tool settings ----------
-    def set_tool(self, tool: ToolType):
-        if self.tool == ToolType.MOVE and self.sel_floating is not None and tool != ToolType.MOVE:
-            self._commit_floating_selection()
-        self.tool = tool
-        self.on_status(f"Tool: {tool.value}")
-
-    def set_brush_size(self, size: int):
-        size = clamp(size, 1, 128)
-        self.brush_size = size
-        self.on_status(f"Brush size: {self.brush_size}")
-
-    def set_alpha(self, alpha: int):
-        self.alpha = clamp(alpha, 0, 255)
-        r, g, b, _ = self.color
-        self.set_color((r, g, b, self.alpha))
-
-    def set_color(self, rgba):
-        # Force the color tuple to use the current live canvas alpha variable 
-        # instead of letting the color dialog override it with 255
-        self.color = (
-            clamp(int(rgba[0]), 0, 255),
-            clamp(int(rgba[1]), 0, 255),
-            clamp(int(rgba[2]), 0, 255),
-            self.alpha  # <--- Retain your slider's value here
-        )
-        try:
-            self.on_color_ui(self.color)
-        except Exception:
-            pass
-        self.on_status(f"Color: RGBA{self.color}")
-
-    def set_shape_fill(self, filled: bool):
-        self.shape_fill = bool(filled)
-        self.on_status(f"Shape fill: {'On' if self.shape_fill else 'Off'}")
-
-    def set_fill_tolerance(self, tolerance: int):
-        self.fill_tolerance = clamp(tolerance, 0, 255)
-        self.on_status(f"Fill tolerance: {self.fill_tolerance}")
-
-    # ---------- Quick Actions ----------
-    def quick_invert(self):
-        if not self.layers:
-            return
-        ly = self.layers[self.active_layer]
-        self._push_state()
-        r, g, b, a = ly.split()
-        r, g, b = ImageChops.invert(r), ImageChops.invert(g), ImageChops.invert(b)
-        self.layers[self.active_layer] = Image.merge("RGBA", (r, g, b, a))
-        self._mark_dirty()
-        self._refresh_display()
-        self.on_status("Inverted colors")
-
-    def quick_grayscale(self):
-        if not self.layers:
-            return
-        self._push_state()
-        self.layers[self.active_layer] = ImageOps.grayscale(self.layers[self.active_layer]).convert("RGBA")
-        self._mark_dirty()
-        self._refresh_display()
-        self.on_status("Grayscale applied")
-
-    def quick_flip_h(self):
-        if not self.layers:
-            return
-        self._push_state()
-        self.layers[self.active_layer] = self.layers[self.active_layer].transpose(Image.FLIP_LEFT_RIGHT)
-        self._mark_dirty()
-        self._refresh_display()
-        self.on_status("Flipped horizontally")
-
-    def quick_flip_v(self):
-        if not self.layers:
-            return
-        self._push_state()
-        self.layers[self.active_layer] = self.layers[self.active_layer].transpose(Image.FLIP_TOP_BOTTOM)
-        self._mark_dirty()
-        self._refresh_display()
-        self.on_status("Flipped vertically")
-
-    def quick_trim_transparent(self):
-        comp = self.get_composite()
-        if comp is None:
-            return
-        bbox = comp.split()[3].getbbox()
-        if not bbox:
-            self.on_status("Nothing to trim (no opaque pixels)")
-            return
-        self._push_state()
-        for i in range(len(self.layers)):
-            self.layers[i] = self.layers[i].crop(bbox)
-        self._mark_dirty()
-        self._refresh_display()
-        self.on_size_change(self.width(), self.height())
-        self.on_layers_changed()
-        self.on_status("Trimmed transparent borders")
-
-    # ---------- Selection ----------
-    
-    def select_all(self):
-        if not self.layers:
-            return False
-            
-        # If we are dragging a floating selection, commit it to the canvas first
-        if self.sel_floating is not None:
-            self._commit_floating_selection()
-            
-        # Set the selection rectangle to the full dimensions of the canvas
-        self.sel_active = True
-        self.sel_start = (0, 0)
-        self.sel_rect = (0, 0, self.width(), self.height())
-        
-        self._refresh_display()
-        self.on_status("Selected all")
-        return True
-    
-    def clear_selection(self):
-        if self.sel_floating is not None:
-            self._commit_floating_selection()
-        self.sel_active = False
-        self.sel_start = None
-        self.sel_rect = None
-        self.preview_image = None
-        self._refresh_display()
-        self.on_status("Selection cleared")
-
-    def delete_selection(self):
-        """Fills the currently selected bounding box area with full transparency."""
-        if not self.layers or not self.sel_active or not self.sel_rect:
-            return
-            
-        self._push_state()
-        x0, y0, x1, y1 = self._norm_rect(self.sel_rect)
-        
-        # Draw a transparent rectangle. 
-        # By using x1 and y1 directly (exclusive boundary), 
-        # Pillow will cover the range from x0 to x1-1 (which includes the last pixel).
-        draw = ImageDraw.Draw(self.layers[self.active_layer], "RGBA")
-        draw.rectangle([x0, y0, x1, y1], fill=(0, 0, 0, 0))
-        
-        self._mark_dirty()
-        self._refresh_display()
-        self.on_status("Selection cleared to transparency")
+        self._place_grid()
+
+    def set_perf_hud(self, show: bool, log_path=DEFAULT_LOG):
+        """
+        Show the performance HUD over the canvas. While it is shown, every frame's timings
+        are appended to log_path as JSON lines (pass None for no log).
+        """
+        self.profiler.close_log()
+        self.profiler.reset()
+        self.profiler.enabled = show
+        if show and log_path is not None:
+            try:
+                self.profiler.open_log(log_path)
+            except OSError:
+                self.on_status("Performance log could not be opened")
+        self._update_hud()
+        self._request_frame()
 
+    # ---------- Clipboard ----------
     def _copy_to_os_clipboard(self, image: Image.Image):
         """Helper to push PIL images to the Windows OS clipboard in DIB and PNG formats."""
         import os
@@ -527,67 +374,33 @@ class CanvasEditor(ttk.Frame):
                 pass
 
     def copy_selection(self):
-        if not self.layers:
-            return False
-            
-        if self.sel_floating is not None:
-            self.clipboard_image = self.sel_floating.copy()
-            self._copy_to_os_clipboard(self.clipboard_image)  # <-- Push to Windows
-            self.on_status("Selection copied to system clipboard")
-            return True
-        elif self.sel_active and self.sel_rect is not None:
-            x0, y0, x1, y1 = self._norm_rect(self.sel_rect)
-            self.clipboard_image = self.layers[self.active_layer].crop((x0, y0, x1, y1))
-            self._copy_to_os_clipboard(self.clipboard_image)  # <-- Push to Windows
-            self.on_status("Selection copied to system clipboard")
-            return True
-        else:
-            self.on_status("Nothing selected to copy")
+        if not self.model.copy_selection():
             return False
+        self._copy_to_os_clipboard(self.model.clipboard_image)  # <-- Push to Windows
+        self.on_status("Selection copied to system clipboard")
+        return True
 
     def paste_selection(self):
+        self.model.ensure_loaded()
         # Try to intercept pixel data directly from the Windows OS clipboard first
         from PIL import ImageGrab
         try:
             os_clip = ImageGrab.grabclipboard()
             if isinstance(os_clip, Image.Image):
-                self.clipboard_image = os_clip.convert("RGBA")
+                self.model.clipboard_image = os_clip.convert("RGBA")
             # Bonus: If the user copied an image file from Windows Explorer, intercept the file path and open it
             elif isinstance(os_clip, list) and len(os_clip) > 0 and isinstance(os_clip[0], str):
                 try:
-                    self.clipboard_image = Image.open(os_clip[0]).convert("RGBA")
+                    self.model.clipboard_image = Image.open(os_clip[0]).convert("RGBA")
                 except Exception:
                     pass
         except Exception:
             pass
 
-        if not getattr(self, "clipboard_image", None):
-            self.on_status("Clipboard is empty")
+        # Paste it near the top-left of the user's current scroll view
+        at = (int(self.canvas.canvasx(0) / self.zoom), int(self.canvas.canvasy(0) / self.zoom))
+        if not self.model.paste(at):
             return False
-            
-        # If we are already dragging something else, commit it to the canvas first
-        if self.sel_floating is not None:
-            self._commit_floating_selection()
-            
-        self._push_state()
-        
-        # Load the clipboard image as a new floating selection
-        self.sel_floating = self.clipboard_image.copy()
-        
-        # Calculate coordinates to paste it near the top-left of the user's current scroll view
-        x0 = int(self.canvas.canvasx(0) / self.zoom)
-        y0 = int(self.canvas.canvasy(0) / self.zoom)
-        
-        self.sel_offset = (x0, y0)
-        x1 = x0 + self.sel_floating.width
-        y1 = y0 + self.sel_floating.height
-        
-        self.sel_rect = (x0, y0, x1, y1)
-        self.sel_active = True
-        self.tool = ToolType.MOVE
-        
-        self._mark_dirty()
-        self._refresh_display()
         self.on_status("Pasted selection from system clipboard")
         return True
 
@@ -613,7 +426,26 @@ class CanvasEditor(ttk.Frame):
     def _image_to_canvas(self, x, y):
         return (x * self.zoom), (y * self.zoom)
 
+    def _viewport_image_rect(self):
+        """Image-space rect currently scrolled into view, or None if nothing is."""
+        z = self.zoom
+        x0 = self.canvas.canvasx(0)
+        y0 = self.canvas.canvasy(0)
+        x1 = x0 + self.canvas.winfo_width()
+        y1 = y0 + self.canvas.winfo_height()
+        return clip_rect((x0 // z, y0 // z, -(-x1 // z), -(-y1 // z)), (self.width(), self.height()))
+
+    def _to_display(self, v, zoom=None):
+        """Display pixel of image coordinate v at zoom (the view zoom by default)."""
+        return display_pixel(v, self.zoom if zoom is None else zoom)
+
+    def _tool_event(self, handler, event):
+        """Run a left-button handler, timed per tool for the performance HUD."""
+        with self.profiler.span(f"tool:{self.model.tool.value}"):
+            return handler(event)
+
     def _canvas_to_image(self, cx, cy):
+        # Zoom-out levels are powers of two, so floor division by them stays exact
         x0 = self.canvas.canvasx(0)
         y0 = self.canvas.canvasy(0)
         ix = int((cx + x0) // self.zoom)
@@ -628,7 +460,9 @@ class CanvasEditor(ttk.Frame):
             self.on_cursor(None, None)
 
     def _on_mouse_down(self, event):
-        if not self.layers:
+        model = self.model
+        model.ensure_loaded()
+        if not model.layers:
             return
 
         if self._space_pan_active:
@@ -636,122 +470,26 @@ class CanvasEditor(ttk.Frame):
             return
 
         ix, iy = self._canvas_to_image(event.x, event.y)
-        if not (0 <= ix < self.width() and 0 <= iy < self.height()):
-            return
-
-        # REMOVED self._push_state() from here
-        
-        # Track that a drawing action has started (excluding tools that don't draw)
-        if self.tool not in (ToolType.TEXT, ToolType.EYEDROPPER):
-            self.is_drawing = True
-
-        if self.tool == ToolType.PENCIL:
-            self._draw_point(ix, iy, self.color)
-        elif self.tool == ToolType.ERASER:
-            self._draw_point(ix, iy, (0, 0, 0, 0))
-        elif self.tool == ToolType.EYEDROPPER:
-            comp = self._get_composite_with_preview() or self.get_composite()
-            if comp:
-                try:
-                    # Explicitly lock the coordinates to target pixel integers
-                    cx = max(0, min(int(ix), comp.width - 1))
-                    cy = max(0, min(int(iy), comp.height - 1))
-                    r, g, b, a = comp.getpixel((cx, cy))
-                    self.set_color((r, g, b, a))
-                except Exception as e:
-                    print(f"Eyedropper sample failed: {e}")
-        elif self.tool == ToolType.FILL:
-            flood_fill(self.layers[self.active_layer], (ix, iy), self.color, tolerance=self.fill_tolerance)
-        elif self.tool == ToolType.MAGIC_ERASER:
-            r, g, b, a = self.layers[self.active_layer].getpixel((ix, iy))
-            flood_fill(self.layers[self.active_layer], (ix, iy), (r, g, b, 0), tolerance=self.fill_tolerance)
-        elif self.tool == ToolType.SELECTION:
-            # Deselect if clicking on a new area without dragging
-            self.sel_active = True
-            self.sel_start = (ix, iy)
-            self.sel_rect = None  # Don't create a 1x1 box yet; wait for drag
-        elif self.tool == ToolType.MOVE:
-            if self.sel_floating is None and self.sel_rect and self._point_in_rect((ix, iy), self.sel_rect):
-                x0, y0, x1, y1 = self._norm_rect(self.sel_rect)
-                box = (x0, y0, x1, y1)
-                self.sel_floating = self.layers[self.active_layer].crop(box)
-                draw = ImageDraw.Draw(self.layers[self.active_layer], "RGBA")
-                draw.rectangle([x0, y0, x1, y1], fill=(0, 0, 0, 0))
-                self.sel_offset = (x0, y0)
-                self.sel_rect = (x0, y0, x1, y1)
-        elif self.tool in (ToolType.SHAPE_LINE, ToolType.SHAPE_RECT, ToolType.SHAPE_ELLIPSE):
-            self.shape_start = (ix, iy)
-            self.preview_image = Image.new("RGBA", (self.width(), self.height()), (0, 0, 0, 0))
-        elif self.tool == ToolType.TEXT:
+        model.press(ix, iy, global_mode=self._global_mode(event))
+        if model.tool == ToolType.TEXT and 0 <= ix < self.width() and 0 <= iy < self.height():
             txt = simpledialog.askstring("Text", "Enter text:")
             if txt:
                 try:
                     sz = simpledialog.askinteger("Text size", "Font size (px):", initialvalue=16, minvalue=6, maxvalue=512)
                 except Exception:
                     sz = 16
-                self._draw_text(ix, iy, txt, sz)
-
-        self.last_pos = (ix, iy)
-        self._mark_dirty()
-        self._refresh_display()
+                model.draw_text(ix, iy, txt, sz)
 
     def _on_mouse_drag(self, event):
-        if not self.layers:
+        if not self.model.layers:
             return
         if self._space_pan_active:
             self.canvas.scan_dragto(event.x, event.y, gain=1)
             return
-
-        ix, iy = self._canvas_to_image(event.x, event.y)
-        ix = clamp(ix, 0, max(1, self.width()) - 1)
-        iy = clamp(iy, 0, max(1, self.height()) - 1)
-
-        if self.tool == ToolType.PENCIL:
-            draw_brush_line(self.layers[self.active_layer], self.last_pos, (ix, iy), self.color, self.brush_size)
-        elif self.tool == ToolType.ERASER:
-            draw_brush_line(self.layers[self.active_layer], self.last_pos, (ix, iy), (0, 0, 0, 0), self.brush_size)
-        elif self.tool == ToolType.SELECTION and self.sel_active:
-            # Only start the rectangle once the mouse has moved from the start point
-            if self.sel_start:
-                x0, y0 = self.sel_start
-                self.sel_rect = (x0, y0, ix, iy)
-        elif self.tool == ToolType.MOVE and self.sel_floating is not None:
-            dx = ix - self.last_pos[0]
-            dy = iy - self.last_pos[1]
-            self.sel_offset = (self.sel_offset[0] + dx, self.sel_offset[1] + dy)
-
-            # Keep the visible selection box aligned with the floating selection
-            x0, y0 = self.sel_offset
-            x1 = x0 + self.sel_floating.width
-            y1 = y0 + self.sel_floating.height
-            self.sel_rect = (x0, y0, x1, y1)
-        elif self.tool in (ToolType.SHAPE_LINE, ToolType.SHAPE_RECT, ToolType.SHAPE_ELLIPSE) and self.shape_start:
-            self._update_shape_preview(self.shape_start, (ix, iy))
-
-        self.last_pos = (ix, iy)
-        self._mark_dirty()
-        self._refresh_display()
+        self.model.drag(*self._canvas_to_image(event.x, event.y))
 
     def _on_mouse_up(self, event):
-        if not self.layers:
-            return
-        
-        # If we clicked but never dragged (sel_rect is still None), clear selection
-        if self.tool == ToolType.SELECTION and self.sel_active and self.sel_rect is None:
-            self.clear_selection()
-            
-        if self.tool in (ToolType.SHAPE_LINE, ToolType.SHAPE_RECT, ToolType.SHAPE_ELLIPSE) and self.shape_start:
-            self._commit_shape(self.shape_start, self.last_pos)
-            self.shape_start = None
-            self.preview_image = None
-            
-        # ADD THIS BLOCK to save the state AFTER the stroke is finished
-        if getattr(self, "is_drawing", False):
-            self._push_state()
-            self.is_drawing = False
-            
-        self._mark_dirty()
-        self._refresh_display()
+        self.model.release()
 
     def _on_mouse_wheel(self, event):
         ctrl = (event.state & 0x4) != 0
@@ -778,7 +516,7 @@ class CanvasEditor(ttk.Frame):
                     elif getattr(event, "num", 0) == 5:
                         self.canvas.yview_scroll(1, "units")
             return
-            
+
         delta = 0
         if hasattr(event, "delta") and event.delta != 0:
             delta = 1 if event.delta > 0 else -1
@@ -787,271 +525,342 @@ class CanvasEditor(ttk.Frame):
                 delta = 1
             elif getattr(event, "num", 0) == 5:
                 delta = -1
-                
-        if delta != 0:
-            new_zoom = clamp(self.zoom + delta, 1, 16)
-            if new_zoom != self.zoom:
-                cx = self.canvas.canvasx(event.x)
-                cy = self.canvas.canvasy(event.y)
-                old_zoom = self.zoom
-                
-                self.set_zoom(new_zoom)
-                
-                scale = new_zoom / old_zoom
-                new_cx = cx * scale
-                new_cy = cy * scale
-                
-                # Run the view adjustment 1ms later so Tkinter has time to process the new boundaries smoothly
-                def adjust_view():
-                    sr = self.canvas.bbox("all")
-                    if sr:
-                        sr_w = max(1, sr[2] - sr[0])
-                        sr_h = max(1, sr[3] - sr[1])
-                        cw = self.canvas.winfo_width()
-                        ch = self.canvas.winfo_height()
-                        
-                        if sr_w > cw:
-                            self.canvas.xview_moveto((new_cx - event.x) / sr_w)
-                        if sr_h > ch:
-                            self.canvas.yview_moveto((new_cy - event.y) / sr_h)
-                            
-                self.canvas.after(1, adjust_view)
-
-    # ---------- Drawing helpers ----------
-    def _draw_point(self, x, y, color):
-        if not (0 <= x < self.width() and 0 <= y < self.height()):
-            return
-        draw = ImageDraw.Draw(self.layers[self.active_layer], "RGBA")
-        half = self.brush_size // 2
-        
-        if self.brush_size <= 1:
-            draw.point((x, y), fill=color)
-        else:
-            # Strict integer pixel bounding box configuration
-            bbox = [x - half, y - half, x + half, y + half]
-            draw.ellipse(bbox, fill=color)
-
-    def _draw_text(self, x, y, text, size_px):
-        self._push_state()
-        draw = ImageDraw.Draw(self.layers[self.active_layer], "RGBA")
-        
-        font = None
-        # Check common cross-platform font fallbacks
-        for font_name in ["arial.ttf", "calibri.ttf", "Helvetica.ttf", "DejaVuSans.ttf"]:
-            try:
-                font = ImageFont.truetype(font_name, size_px)
-                break
-            except IOError:
-                continue
-                
-        if font is None:
-            font = ImageFont.load_default()
-            
-        draw.text((x, y), text, fill=self.color, font=font)
-        self._mark_dirty()
-        self._refresh_display()
-        self.on_status("Text added")
-
-    def _point_in_rect(self, pt, rect):
-        x0, y0, x1, y1 = self._norm_rect(rect)
-        x, y = pt
-        return x0 <= x < x1 and y0 <= y < y1
-
-    def _norm_rect(self, rect):
-        x0, y0, x1, y1 = rect
-        if x0 > x1:
-            x0, x1 = x1, x0
-        if y0 > y1:
-            y0, y1 = y1, y0
-        return x0, y0, x1, y1
-
-    def _commit_floating_selection(self):
-        if self.sel_floating is None:
-            return
-        self.layers[self.active_layer].alpha_composite(self.sel_floating, self.sel_offset)
-        self.sel_floating = None
-        self.sel_rect = None
-        self.sel_active = False
-        self._mark_dirty()
-        self._refresh_display()
-        self.on_status("Selection moved")
-
-    def _update_shape_preview(self, start, end):
-        self.preview_image = Image.new("RGBA", (self.width(), self.height()), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(self.preview_image, "RGBA")
 
-        # Normalize the coordinates instantly to allow multi-directional drawing
-        x0, y0, x1, y1 = self._norm_rect((start[0], start[1], end[0], end[1]))
-
-        if self.tool == ToolType.SHAPE_LINE:
-            # Lines don't require sorting, use original track points
-            draw.line([start[0], start[1], end[0], end[1]], fill=self.color, width=self.brush_size)
-        elif self.tool == ToolType.SHAPE_RECT:
-            if self.shape_fill:
-                draw.rectangle([x0, y0, x1, y1], fill=self.color, outline=self.color, width=self.brush_size)
-            else:
-                draw.rectangle([x0, y0, x1, y1], outline=self.color, width=self.brush_size)
-        elif self.tool == ToolType.SHAPE_ELLIPSE:
-            if self.shape_fill:
-                draw.ellipse([x0, y0, x1, y1], fill=self.color, outline=self.color, width=self.brush_size)
+        if delta != 0:
+            # Whole steps above 1x, halving / doubling below it
+            z = self.zoom
+            if z > 1 or (z == 1 and delta > 0):
+                z += delta
             else:
-                draw.ellipse([x0, y0, x1, y1], outline=self.color, width=self.brush_size)
+                z = z * 2 if delta > 0 else z / 2
+            self.set_zoom(z, focus=(event.x, event.y))
 
-    def _commit_shape(self, start, end):
-        draw = ImageDraw.Draw(self.layers[self.active_layer], "RGBA")
+    def _global_mode(self, event) -> bool:
+        # Holding Shift toggles the global colour mode for a single click
+        shift = event is not None and (getattr(event, "state", 0) & 0x1) != 0
+        return self.model.global_select != shift
 
-        # Normalize coordinates before final commitment to the layer
-        x0, y0, x1, y1 = self._norm_rect((start[0], start[1], end[0], end[1]))
-
-        if self.tool == ToolType.SHAPE_LINE:
-            draw.line([start[0], start[1], end[0], end[1]], fill=self.color, width=self.brush_size)
-            self.on_status("Line drawn")
-        elif self.tool == ToolType.SHAPE_RECT:
-            if self.shape_fill:
-                draw.rectangle([x0, y0, x1, y1], fill=self.color, outline=self.color, width=self.brush_size)
-                self.on_status("Filled rectangle drawn")
-            else:
-                draw.rectangle([x0, y0, x1, y1], outline=self.color, width=self.brush_size)
-                self.on_status("Rectangle drawn")
-        elif self.tool == ToolType.SHAPE_ELLIPSE:
-            if self.shape_fill:
-                draw.ellipse([x0, y0, x1, y1], fill=self.color, outline=self.color, width=self.brush_size)
-                self.on_status("Filled ellipse drawn")
-            else:
-                draw.ellipse([x0, y0, x1, y1], outline=self.color, width=self.brush_size)
-                self.on_status("Ellipse drawn")
-        self._mark_dirty()
-
-    # ---------- Undo / Redo ----------
-    def _push_state(self):
-        snapshot = {
-            "layers": [ly.copy() for ly in self.layers],
-            "visible": list(self.layer_visible),
-            "names": list(self.layer_names),
-            "active": self.active_layer,
-            "selection": (self.sel_active, self.sel_rect, self.sel_floating.copy() if self.sel_floating else None, self.sel_offset),
-        }
-        self.history.push(snapshot)
-
-    def _restore_state(self, snapshot):
-        self.layers = [ly.copy() for ly in snapshot["layers"]]
-        self.layer_visible = list(snapshot["visible"])
-        self.layer_names = list(snapshot["names"])
-        self.active_layer = snapshot["active"]
-        s_active, s_rect, s_float, s_off = snapshot["selection"]
-        self.sel_active = s_active
-        self.sel_rect = s_rect
-        self.sel_floating = s_float.copy() if s_float else None
-        self.sel_offset = s_off
-        self._mark_dirty()
-        self._refresh_display()
-        self.on_layers_changed()
-        self.on_size_change(self.width(), self.height())
-
-    def undo(self):
-        snap = self.history.undo()
-        if snap is not None:
-            self._restore_state(snap)
-            self.on_status("Undo")
-
-    def redo(self):
-        snap = self.history.redo()
-        if snap is not None:
-            self._restore_state(snap)
-            self.on_status("Redo")
-
-    # ---------- BG transparency ----------
-    def make_background_transparent(self):
-        if not self.layers:
+    # ---------- Rendering ----------
+    def set_zoom_path(self, path: str):
+        """Magnify integer zooms with "pillow", with "tk", or pick by measured cost ("auto")."""
+        self.renderer.set_zoom_path(path)
+        self._request_frame()
+
+    def _update_scrollregion(self):
+        """Size the scrollregion to the whole zoomed image, however little of it is rendered."""
+        w = max(self._to_display(self.width()), self.canvas.winfo_width(), 1)
+        h = max(self._to_display(self.height()), self.canvas.winfo_height(), 1)
+        self.canvas.config(scrollregion=(0, 0, w, h))
+        return w, h
+
+    def _blit(self, region, x, y, zoom=1):
+        # PhotoImage.paste always writes at (0, 0), so stage the region in the scratch photo
+        # (grown as needed, never shrunk) and let Tk copy it into place inside the display,
+        # magnifying it by an integer zoom on the way
+        start = time.perf_counter()
+        w, h = region.size
+        scratch = self._scratch_image
+        if scratch is None or scratch.width() < w or scratch.height() < h:
+            if scratch is not None:
+                w, h = max(w, scratch.width()), max(h, scratch.height())
+            scratch = self._scratch_image = ImageTk.PhotoImage("RGBA", (w, h))
+        scratch.paste(region)
+        args = ("-zoom", zoom, zoom) if zoom > 1 else ()
+        self._display_image.tk.call(
+            str(self._display_image), "copy", str(scratch),
+            "-from", 0, 0, region.width, region.height, "-to", x, y, *args, "-compositingrule", "set",
+        )
+        self._count_transfer(start, region)
+
+    def _count_transfer(self, start, image):
+        ms = (time.perf_counter() - start) * 1000
+        self._transfer_ms += ms
+        self._transfer_bytes += image.width * image.height * 4
+        self.profiler.record("photo", ms)
+
+    def display_stats(self) -> dict:
+        """
+        Display tile cache counters, the last and average refresh latency in ms, the
+        wall time and pixel bytes of the last frame's PhotoImage paste and copy calls
+        (transfer_ms, transfer_bytes), and the zoom path in use ("pillow", "tk", or "mip"
+        below 1x) with the measured cost of the first two (ms per million display pixels).
+        """
+        stats = self.renderer.stats()
+        stats["refresh_ms"] = self._refresh_ms
+        stats["refresh_ms_avg"] = self._refresh_ms_avg
+        stats["transfer_ms"] = self._transfer_ms
+        stats["transfer_bytes"] = self._transfer_bytes
+        return stats
+
+    def memory_stats(self) -> dict:
+        """Bytes held by the layers, the undo history (in RAM and spilled to disk) and the render caches."""
+        stats = self.model.memory_stats()
+        stats["display_tiles"] = self.renderer.cache.nbytes
+        stats["render"] = stats.pop("composite") + self.renderer.nbytes
+        return stats
+
+    def set_frame_rate(self, fps: float):
+        """Cap display refreshes at fps frames per second."""
+        self._frame_interval_ms = 1000 / max(1, fps)
+
+    def _request_frame(self):
+        """
+        Ask for the display to be redrawn. The model calls this on every change, so a burst
+        of motion events between two frames costs a single render of all their dirty rects.
+        """
+        if self._frame_after is not None:
             return
-        img = self.layers[self.active_layer]
-        corners = [(0, 0), (img.width - 1, 0), (0, img.height - 1), (img.width - 1, img.height - 1)]
-        samples = [img.getpixel(c) for c in corners]
-        target = max(set(samples), key=samples.count)
-        px = img.load()
-        self._push_state()
-        for y in range(img.height):
-            for x in range(img.width):
-                if px[x, y][:3] == target[:3]:
-                    px[x, y] = (px[x, y][0], px[x, y][1], px[x, y][2], 0)
-        self._mark_dirty()
-        self._refresh_display()
-        self.on_status("Background made transparent")
+        elapsed = (time.perf_counter() - self._last_frame) * 1000
+        delay = max(0, int(self._frame_interval_ms - elapsed))
+        self._frame_after = self.after(delay, self._frame_tick)
 
-    # ---------- Rendering ----------
-    def _compose_display_image(self):
-        if not self.layers:
-            return None
-        comp = self._get_composite_with_preview()
-        if comp is None:
-            return None
-
-        # 1. Handle or initialize the background checkerboard cache
-        if self._bg_cache is None or self._bg_cache.size != comp.size:
-            self._bg_cache = create_checkerboard((comp.width, comp.height), square_size=8).convert("RGBA")
-            
-        composed = Image.alpha_composite(self._bg_cache, comp)
-        
-        # 2. Scale the canvas layer via Nearest Neighbor
-        if self.zoom != 1:
-            composed = composed.resize((comp.width * self.zoom, comp.height * self.zoom), Image.NEAREST)
-            
-        # 3. Apply the Selection Marquee on top of the scaled output
-        if self.sel_active:
-            draw = ImageDraw.Draw(composed)
-
-            if self.sel_floating is not None:
-                x0, y0 = self.sel_offset
-                x1 = x0 + self.sel_floating.width
-                y1 = y0 + self.sel_floating.height
-            elif self.sel_rect:
-                x0, y0, x1, y1 = self._norm_rect(self.sel_rect)
-            else:
-                x0 = y0 = x1 = y1 = None
-
-            if x0 is not None:
-                draw.rectangle(
-                    [x0 * self.zoom, y0 * self.zoom, (x1 + 1) * self.zoom, (y1 + 1) * self.zoom],
-                    outline=(0, 200, 255, 255),
-                    width=1
-                )
-
-        # 4. Lay down the guide grid lines safely
-        if self.show_grid and self.zoom >= 4:
-            draw = ImageDraw.Draw(composed)
-            w, h = composed.size
-            for x in range(0, w, self.zoom):
-                draw.line([(x, 0), (x, h)], fill=(0, 0, 0, 40))
-            for y in range(0, h, self.zoom):
-                draw.line([(0, y), (w, y)], fill=(0, 0, 0, 40))
-                
-        return composed
+    def _frame_tick(self):
+        self._frame_after = None
+        self._refresh_display()
 
     def _refresh_display(self):
-        composed = self._compose_display_image()
+        """Render now, satisfying any pending frame request."""
+        if self._frame_after is not None:
+            self.after_cancel(self._frame_after)
+            self._frame_after = None
+        start = time.perf_counter()
+        self._last_frame = start
+        self._transfer_ms = 0.0
+        self._transfer_bytes = 0
+        try:
+            self._draw_display()
+        finally:
+            self._refresh_ms = (time.perf_counter() - start) * 1000
+            self._refresh_ms_avg += (self._refresh_ms - self._refresh_ms_avg) * 0.1
+            if self.profiler.enabled:
+                self.profiler.end_frame(self._refresh_ms, zoom=self.zoom, zoom_path=self.renderer.current_path())
+                if (time.perf_counter() - self._hud_shown_at) * 1000 >= HUD_INTERVAL_MS:
+                    self._update_hud()
+                # Tk redraws the changed items in idle time, ahead of this callback
+                self._idle_from = time.perf_counter()
+                self.after_idle(self._frame_idle)
+
+    def _frame_idle(self):
+        self.profiler.amend("tk_idle", (time.perf_counter() - self._idle_from) * 1000)
+
+    def _draw_display(self):
+        if not self.model.layers:
+            return
+        # Compositing costs the same on either zoom path, so keep it out of their timing
+        self.model.live_composite()
+        start = time.perf_counter()
+        renderer = self.renderer
+        composed, rects = renderer.render(self._viewport_image_rect(), self.zoom)
         if composed is None:
             return
 
-        self._display_image = ImageTk.PhotoImage(composed)
+        # The base is k times smaller than the display when Tk does the magnifying
+        k = int(self.zoom // renderer.base_zoom) if renderer.base_zoom != self.zoom else 1
+        b = renderer.to_base
+        bx0, by0 = b(renderer.window[0]), b(renderer.window[1])
+        wx0, wy0 = bx0 * k, by0 * k
+        if rects is not None and self._display_image is not None:
+            pixels = 0
+            for x0, y0, x1, y1 in rects:
+                box = (b(x0) - bx0, b(y0) - by0, b(x1) - bx0, b(y1) - by0)
+                self._blit(composed.crop(box), box[0] * k, box[1] * k, k)
+                pixels += (box[2] - box[0]) * (box[3] - box[1]) * k * k
+            renderer.record_cost(start, pixels)
+            self._update_overlays()
+            return
+
+        # Refill the existing photo in place; only a new window size needs a new one
+        size = (composed.width * k, composed.height * k)
+        photo = self._display_image
+        if k > 1:
+            if photo is None or (photo.width(), photo.height()) != size:
+                self._display_image = ImageTk.PhotoImage("RGBA", size)
+            self._blit(composed, 0, 0, k)
+        else:
+            transfer = time.perf_counter()
+            if photo is None or (photo.width(), photo.height()) != size:
+                self._display_image = ImageTk.PhotoImage(composed)
+            else:
+                photo.paste(composed)
+            self._count_transfer(transfer, composed)
+        renderer.record_cost(start, size[0] * size[1])
 
         # DO NOT call self.canvas.delete("all") here
         # DO NOT call self.canvas.update_idletasks() here
 
-        cw = max(1, self.canvas.winfo_width())
-        ch = max(1, self.canvas.winfo_height())
-
-        sr_w = max(composed.width, cw)
-        sr_h = max(composed.height, ch)
-
-        self.canvas.config(scrollregion=(0, 0, sr_w, sr_h))
+        sr_w, sr_h = self._update_scrollregion()
 
         # Re-use the existing canvas image instead of destroying it
         if getattr(self, "_canvas_image_id", None) is None:
-            self._canvas_image_id = self.canvas.create_image(0, 0, image=self._display_image, anchor="nw")
+            self._canvas_image_id = self.canvas.create_image(wx0, wy0, image=self._display_image, anchor="nw")
         else:
-            self.canvas.itemconfig(self._canvas_image_id, image=self._display_image)
+            if self._display_image is not photo:
+                self.canvas.itemconfig(self._canvas_image_id, image=self._display_image)
+            self.canvas.coords(self._canvas_image_id, wx0, wy0)
 
-        if composed.width <= cw:
+        d = self._to_display
+        cw = max(1, self.canvas.winfo_width())
+        ch = max(1, self.canvas.winfo_height())
+        if d(self.width()) <= cw:
             self.canvas.xview_moveto(0)
-        if composed.height <= ch:
+        if d(self.height()) <= ch:
             self.canvas.yview_moveto(0)
+        self._place_grid()
+        self._update_overlays()
+
+    @profiled("grid")
+    def _place_grid(self):
+        """
+        Lay the pixel grid over the viewport as its own canvas image. The overlay only
+        depends on the zoom and the viewport size, so scrolling just moves it, and the
+        display tiles never contain the grid.
+        """
+        z = self.zoom
+        if not self.show_grid or z < 4 or not self.model.layers or self._canvas_image_id is None:
+            if self._grid_item is not None:
+                self.canvas.itemconfig(self._grid_item, state="hidden")
+            return
+        # Start on a cell boundary and span one cell more than the viewport, within the image
+        x0 = int(self.canvas.canvasx(0)) // z * z
+        y0 = int(self.canvas.canvasy(0)) // z * z
+        x1 = min(x0 + (self.canvas.winfo_width() // z + 2) * z, self.width() * z)
+        y1 = min(y0 + (self.canvas.winfo_height() // z + 2) * z, self.height() * z)
+        x0, y0 = max(0, x0), max(0, y0)
+        if x0 >= x1 or y0 >= y1:
+            return
+        key = (z, x1 - x0, y1 - y0)
+        if key != self._grid_key:
+            self._grid_photo = ImageTk.PhotoImage(grid_overlay(z, key[1:]))
+            self._grid_key = key
+        if self._grid_item is None:
+            self._grid_item = self.canvas.create_image(x0, y0, image=self._grid_photo, anchor="nw")
+        else:
+            self.canvas.itemconfig(self._grid_item, image=self._grid_photo, state="normal")
+            self.canvas.coords(self._grid_item, x0, y0)
+        self._stack_overlays()
+
+    # ---------- Overlays ----------
+    def _update_overlays(self):
+        """Sync the marquee, floating selection and shape preview items with the editor state."""
+        model = self.model
+        self._sync_overlay("floating", model.sel_floating, model.sel_offset)
+        self._sync_overlay("preview", model.preview_image, model.preview_rect[:2] if model.preview_rect else None)
+
+        with self.profiler.span("marquee"):
+            marquee = model.marquee_rect() if model.layers else None
+            if marquee is None:
+                if self._marquee_item is not None:
+                    self.canvas.itemconfig(self._marquee_item, state="hidden")
+            else:
+                # The outline sits on the far side of x1 / y1, and never past the image edge
+                z = self.zoom
+                x0, y0, x1, y1 = marquee
+                coords = (x0 * z, y0 * z, min(x1 + 1, self.width()) * z, min(y1 + 1, self.height()) * z)
+                if self._marquee_item is None:
+                    self._marquee_item = self.canvas.create_rectangle(*coords, outline="#00c8ff", width=1)
+                else:
+                    self.canvas.coords(self._marquee_item, *coords)
+                    self.canvas.itemconfig(self._marquee_item, state="normal")
+        self._stack_overlays()
+
+    @profiled("overlays")
+    def _sync_overlay(self, name: str, image, origin):
+        """
+        Show image, whose top-left is image pixel origin, as a zoomed canvas image above
+        the display. Only the part inside the display window is converted, and only when
+        the image, zoom or that part changed; otherwise the item is just moved.
+        """
+        entry = self._overlays.setdefault(name, [None, None, None, None])
+        item = entry[0]
+        vis = None
+        if image is not None and origin is not None:
+            ox, oy = origin
+            vis = self.renderer.clip_to_window((ox, oy, ox + image.width, oy + image.height))
+        if vis is None:
+            if item is not None:
+                self.canvas.itemconfig(item, state="hidden")
+            # Drop the bitmap, but not the item
+            entry[1:] = [None, None, None]
+            return
+
+        z = self.zoom
+        box = (vis[0] - ox, vis[1] - oy, vis[2] - ox, vis[3] - oy)
+        key = (z, box)
+        if entry[1] is not image or entry[2] != key:
+            part = image.crop(box)
+            if z > 1:
+                part = part.resize((part.width * z, part.height * z), Image.NEAREST)
+            elif z < 1:
+                part = part.resize((max(1, round(part.width * z)), max(1, round(part.height * z))), Image.BOX)
+            entry[1:] = [image, key, ImageTk.PhotoImage(part)]
+        x, y = int(vis[0] * z), int(vis[1] * z)
+        if item is None:
+            entry[0] = self.canvas.create_image(x, y, image=entry[3], anchor="nw")
+        else:
+            self.canvas.itemconfig(item, image=entry[3], state="normal")
+            self.canvas.coords(item, x, y)
+
+    def _stack_overlays(self):
+        # Bottom to top above the display image: floating selection, shape preview, grid,
+        # marquee, performance HUD
+        items = [self._overlays[name][0] for name in ("floating", "preview") if name in self._overlays]
+        for item in items + [self._grid_item, self._marquee_item, self._hud_bg, self._hud_item]:
+            if item is not None:
+                self.canvas.tag_raise(item)
+
+    # ---------- Performance HUD ----------
+    def _hud_text(self) -> str:
+        avg = self.profiler.averages()
+        stats = self.display_stats()
+
+        def ms(name):
+            return avg.get(name, 0.0)
+
+        lines = [
+            f"frame {ms('total'):6.2f} ms   last {self._refresh_ms:6.2f}   cap {1000 / self._frame_interval_ms:.0f} fps",
+            f"composite {ms('composite'):5.2f}  preview {ms('preview'):5.2f}  checker {ms('checkerboard'):5.2f}",
+            f"scale     {ms('scale'):5.2f}  grid    {ms('grid'):5.2f}  marquee {ms('marquee'):5.2f}",
+            f"overlays  {ms('overlays'):5.2f}  photo   {ms('photo'):5.2f}  tk idle {ms('tk_idle'):5.2f}",
+            f"zoom {self.zoom}x via {stats['zoom_path']}   tiles {stats['tiles']} ({stats['hit_rate']:.0%} hits)",
+        ]
+        for name, (n, total, peak) in sorted(self.profiler.calls.items()):
+            if name.startswith("tool:") or name in ("history_push", "undo", "redo"):
+                label = name[5:] if name.startswith("tool:") else name.replace("_", " ")
+                lines.append(f"{label:<13} {total / n:6.2f} ms avg  {peak:6.2f} max  x{n}")
+        mem = self.memory_stats()
+        lines.append(
+            f"memory  layers {mem['layers'] / 1048576:.1f}M  history {mem['history'] / 1048576:.1f}M"
+            f" (+{mem['history_disk'] / 1048576:.1f}M disk)"
+        )
+        lines.append(f"        tiles {mem['display_tiles'] / 1048576:.1f}M  render {mem['render'] / 1048576:.1f}M")
+        return "\n".join(lines)
+
+    def _update_hud(self):
+        """Redraw the HUD text (or hide it), and log the tool, history and memory totals behind it."""
+        if not self.profiler.enabled:
+            for item in (self._hud_bg, self._hud_item):
+                if item is not None:
+                    self.canvas.itemconfig(item, state="hidden")
+            return
+        self._hud_shown_at = time.perf_counter()
+        text = self._hud_text()
+        if self._hud_item is None:
+            self._hud_bg = self.canvas.create_rectangle(0, 0, 0, 0, fill="#1e1e1e", outline="#5a5a5a")
+            self._hud_item = self.canvas.create_text(0, 0, text=text, anchor="nw", fill="#d8f0d8", font="TkFixedFont")
+        else:
+            self.canvas.itemconfig(self._hud_item, text=text, state="normal")
+            self.canvas.itemconfig(self._hud_bg, state="normal")
+        self._place_hud()
+        self.profiler.log({"calls": self.profiler.calls, "memory": self.memory_stats()})
+
+    def _place_hud(self):
+        """Keep the HUD in the top-left corner of the viewport, above everything else."""
+        if self._hud_item is None or not self.profiler.enabled:
+            return
+        x, y = self.canvas.canvasx(0) + 8, self.canvas.canvasy(0) + 8
+        self.canvas.coords(self._hud_item, x, y)
+        bbox = self.canvas.bbox(self._hud_item)
+        if bbox:
+            self.canvas.coords(self._hud_bg, bbox[0] - 4, bbox[1] - 3, bbox[2] + 4, bbox[3] + 3)
+        self.canvas.tag_raise(self._hud_bg)
+        self.canvas.tag_raise(self._hud_item)
@@ -9,12 +9,18 @@ from core.image_handler import (
     save_png,
     open_image_dialog,
     save_png_dialog,
+    save_project_dialog,
+    sniff_image_format,
 )
+from core.project import PROJECT_EXT, ProjectFile
 from core.icon_generator import export_ico_dialog, export_icns_dialog
 from core.editor_tools import ToolType
+from core.autosave import AutosaveJournal, find_recoverable, read_journal
+from core.macros import Macro
 from gui.canvas_editor import CanvasEditor
 from utils.helpers import human_readable_size
 from utils.config import AppConfig
+from utils.profiler import DEFAULT_LOG
 
 try:
     from PIL import Image, ImageDraw, ImageTk
@@ -249,7 +255,9 @@ class MainWindow(tk.Tk):
         self.tool_buttons: dict[tk.Button, ToolType] = {}
         self.current_color = (0, 0, 0, 255)
         self.shape_fill_var = tk.BooleanVar(value=False)
+        self.global_select_var = tk.BooleanVar(value=False)
         self.grid_var = tk.BooleanVar(value=False)
+        self.perf_hud_var = tk.BooleanVar(value=False)
 
         self._build_menu()
         self._build_statusbar()
@@ -261,12 +269,45 @@ class MainWindow(tk.Tk):
 
         self._apply_widget_theme()
 
-        self.after_idle(lambda: self.canvas_editor.new_blank((256, 256)))
+        self.journal = None
+        self.after_idle(self._start_session)
         self._update_status("Ready")
 
         self._bind_shortcuts()
         self.protocol("WM_DELETE_WINDOW", self._on_exit)
 
+    def _start_session(self):
+        """Offer to recover a crashed session, then start journaling this one."""
+        recovered = None
+        stale = find_recoverable() if self.config_mgr.autosave else []
+        if stale and messagebox.askyesno(
+            "Recover Session",
+            "The editor did not shut down cleanly last time.\nDo you want to recover the unsaved session?",
+        ):
+            recovered = read_journal(stale[0])
+            if recovered is None:
+                messagebox.showwarning("Recover Session", "Nothing could be recovered from the autosave journal.")
+        for p in stale:
+            try:
+                p.unlink()
+            except OSError:
+                pass
+
+        if recovered is not None:
+            self.canvas_editor.load_layers(recovered.layers, recovered.names, recovered.visible, recovered.active)
+            self.canvas_editor.model.is_unsaved = True
+            self._update_status("Recovered unsaved session")
+        else:
+            self.canvas_editor.new_blank((256, 256))
+
+        if self.config_mgr.autosave:
+            try:
+                self.journal = AutosaveJournal()
+            except OSError as e:
+                print(f"Autosave disabled: {e}")
+                return
+            self.canvas_editor.model.attach_journal(self.journal)
+
     def _set_app_icon(self):
         if hasattr(sys, "_MEIPASS"):
             base_path = Path(sys._MEIPASS)
@@ -802,6 +843,8 @@ class MainWindow(tk.Tk):
                 *self._get_recent_menu_items(),
                 "---",
                 {"label": "Save PNG... (Ctrl+S)", "command": self.save_png},
+                {"label": "Save Project (Ctrl+Shift+S)", "command": self.save_project},
+                {"label": "Save Project As...", "command": self.save_project_as},
                 {"label": "Export ICO... (Ctrl+E)", "command": self.export_ico},
                 {"label": "Export ICNS... (macOS)", "command": self.export_icns},
                 "---",
@@ -821,6 +864,13 @@ class MainWindow(tk.Tk):
                 {"label": "Flip Horizontal", "command": self._quick_flip_h},
                 {"label": "Flip Vertical", "command": self._quick_flip_v},
                 {"label": "Trim Transparent", "command": self._quick_trim},
+                {"label": "Remove Background...", "command": self.make_bg_transparent},
+                "---",
+                {
+                    "label": "Stop Recording Macro..." if self.canvas_editor.model.macro is not None else "Record Macro",
+                    "command": self._toggle_macro_recording,
+                },
+                {"label": "Play Macro...", "command": self._play_macro},
                 "---",
                 {"label": "Select All (Ctrl+A)", "command": self.select_all},
                 {"label": "Deselect (Esc)", "command": self._deselect},
@@ -829,6 +879,7 @@ class MainWindow(tk.Tk):
         if menu_name == "View":
             return [
                 {"label": "Show Grid", "command": self._toggle_grid, "checked": bool(self.grid_var.get())},
+                {"label": "Performance HUD", "command": self._toggle_perf_hud, "checked": bool(self.perf_hud_var.get())},
                 "---",
                 {"label": "Theme: Light", "command": lambda: self._set_theme("Light")},
                 {"label": "Theme: Dark", "command": lambda: self._set_theme("Dark")},
@@ -1023,6 +1074,9 @@ class MainWindow(tk.Tk):
         self.dim_label.grid(row=0, column=2, sticky="e", padx=8)
         self.zoom_label = ttk.Label(self.statusbar, text="Zoom: 4x", width=12, anchor="e")
         self.zoom_label.grid(row=0, column=3, sticky="e", padx=8)
+        self.history_label = ttk.Label(self.statusbar, text="History: 0 B", width=26, anchor="e")
+        self.history_label.grid(row=0, column=4, sticky="e", padx=8)
+        Tooltip(self.history_label, "Undo history size in memory (+ spilled to disk)")
         if self._pending_zoom is not None:
             self.zoom_label.config(text=f"Zoom: {self._pending_zoom}x")
             self._pending_zoom = None
@@ -1042,7 +1096,12 @@ class MainWindow(tk.Tk):
             on_size_change=lambda w, h: self.after_idle(lambda: self._update_image_info(w, h)),
             on_zoom_change=lambda z: self.after_idle(lambda: self._update_zoom_info(z)),
             on_layers_changed=lambda: self.after_idle(self._refresh_layers_ui),
-            on_color_ui=lambda rgba: self.after_idle(lambda: self._set_ui_color(rgba))
+            on_color_ui=lambda rgba: self.after_idle(lambda: self._set_ui_color(rgba)),
+            on_history_change=lambda mem, disk: self.after_idle(lambda: self._update_history_info(mem, disk))
+        )
+        self.canvas_editor.model.set_history_budget(
+            self.config_mgr.history_memory_mb * 1024 * 1024,
+            self.config_mgr.history_disk_mb * 1024 * 1024,
         )
         self.canvas_editor.grid(row=0, column=0, sticky="nsew", padx=8, pady=8)
 
@@ -1160,6 +1219,19 @@ class MainWindow(tk.Tk):
         make_slider_snapable(size_scale) 
         self._scales.append(size_scale)
         Tooltip(size_scale, "Brush Size")
+        ttk.Label(size_grp, text="Hard").pack(side="left", padx=(10, 4))
+        hardness_scale = ttk.Scale(
+            size_grp,
+            from_=0,
+            to=100,
+            orient="horizontal",
+            command=lambda v: self.canvas_editor.model.set_brush_hardness(float(v) / 100.0)
+        )
+        hardness_scale.set(100)
+        hardness_scale.pack(side="left", fill="x", expand=True, padx=2)
+        make_slider_snapable(hardness_scale)
+        self._scales.append(hardness_scale)
+        Tooltip(hardness_scale, "Brush Hardness (0 = soft edge, 100 = hard edge)")
 
         ttk.Separator(self.toolbar, orient="vertical").pack(side="left", padx=6, fill="y")
 
@@ -1199,13 +1271,21 @@ class MainWindow(tk.Tk):
             from_=0,
             to=100,
             orient="horizontal",
-            command=lambda v: self.canvas_editor.set_fill_tolerance(int(float(v)))
+            command=lambda v: self.canvas_editor.model.set_fill_tolerance(int(float(v)))
         )
         tol_scale.set(0)
         tol_scale.pack(side="left", fill="x", expand=True, padx=2)
         make_slider_snapable(tol_scale) 
         self._scales.append(tol_scale)
         Tooltip(tol_scale, "Fill Tolerance")
+        global_chk = ttk.Checkbutton(
+            color_grp,
+            text="Global",
+            variable=self.global_select_var,
+            command=self._on_global_select_toggle
+        )
+        global_chk.pack(side="left", padx=(6, 0))
+        Tooltip(global_chk, "Fill, Magic Eraser and Select affect every matching pixel (or hold Shift)")
 
         ttk.Separator(self.toolbar, orient="vertical").pack(side="left", padx=6, fill="y")
 
@@ -1245,15 +1325,6 @@ class MainWindow(tk.Tk):
 
     def _update_image_info(self, w, h):
         self.dim_label.config(text=f"Canvas: {w}x{h}")
-        comp = None
-        try:
-            if hasattr(self, "canvas_editor") and self.canvas_editor is not None:
-                comp = self.canvas_editor.get_composite()
-        except Exception:
-            comp = None
-        if comp is not None:
-            sz = comp.width * comp.height * 4
-            _ = human_readable_size(sz)
 
     def _update_zoom_info(self, zoom):
         if hasattr(self, "zoom_label"):
@@ -1261,8 +1332,15 @@ class MainWindow(tk.Tk):
         else:
             self._pending_zoom = zoom
         if hasattr(self, "zoom_var"):
-            self.zoom_var.set(zoom)
+            # The slider only covers 1x-16x; zoom-out levels come from the wheel or Fit
+            self.zoom_var.set(max(1, int(zoom)))
             
+    def _update_history_info(self, memory_bytes, disk_bytes):
+        text = f"History: {human_readable_size(memory_bytes)}"
+        if disk_bytes:
+            text += f" + {human_readable_size(disk_bytes)} disk"
+        self.history_label.config(text=text)
+
     def _set_ui_color(self, rgba):
         self.current_color = tuple(rgba)
         r, g, b, _ = self.current_color
@@ -1272,7 +1350,7 @@ class MainWindow(tk.Tk):
         self.current_tool = tool
         self._update_tool_visuals()
         if hasattr(self, "canvas_editor"):
-            self.canvas_editor.set_tool(tool)
+            self.canvas_editor.model.set_tool(tool)
 
     def _pick_color(self, event=None):
         color = colorchooser.askcolor(
@@ -1283,19 +1361,22 @@ class MainWindow(tk.Tk):
             current_alpha = int(self.alpha_var.get())
             self.current_color = (r, g, b, current_alpha)
             self.color_display.config(bg=f"#{r:02x}{g:02x}{b:02x}")
-            self.canvas_editor.set_color(self.current_color)
+            self.canvas_editor.model.set_color(self.current_color)
 
     def _on_alpha_change(self, alpha: int):
         r, g, b, _ = self.current_color
         self.current_color = (r, g, b, alpha)
-        self.canvas_editor.set_alpha(alpha)
-        self.canvas_editor.set_color(self.current_color)
+        self.canvas_editor.model.set_alpha(alpha)
+        self.canvas_editor.model.set_color(self.current_color)
 
     def _on_brush_size_change(self, size: int):
-        self.canvas_editor.set_brush_size(int(size))
+        self.canvas_editor.model.set_brush_size(int(size))
 
     def _on_shape_fill_toggle(self):
-        self.canvas_editor.set_shape_fill(self.shape_fill_var.get())
+        self.canvas_editor.model.set_shape_fill(self.shape_fill_var.get())
+
+    def _on_global_select_toggle(self):
+        self.canvas_editor.model.set_global_select(self.global_select_var.get())
 
     def _toggle_grid(self, event=None):
         new_state = not self.canvas_editor.show_grid
@@ -1309,6 +1390,16 @@ class MainWindow(tk.Tk):
         else:
             self._update_status("Grid disabled")
 
+    def _toggle_perf_hud(self):
+        new_state = not self.perf_hud_var.get()
+        self.canvas_editor.set_perf_hud(new_state)
+        self.perf_hud_var.set(new_state)
+
+        if new_state:
+            self._update_status(f"Performance HUD enabled (logging frames to {DEFAULT_LOG})")
+        else:
+            self._update_status("Performance HUD disabled")
+
     def _about(self):
         messagebox.showinfo(
             "About",
@@ -1340,7 +1431,7 @@ class MainWindow(tk.Tk):
         self.config_mgr.save()
 
     def _on_exit(self):
-        if getattr(self, "canvas_editor", None) and getattr(self.canvas_editor, "is_unsaved", False):
+        if getattr(self, "canvas_editor", None) and self.canvas_editor.model.is_unsaved:
             resp = messagebox.askyesnocancel(
                 "Unsaved Changes",
                 "You have unsaved changes. Do you want to save before exiting?"
@@ -1348,7 +1439,7 @@ class MainWindow(tk.Tk):
             if resp is True:
                 self.save_png()
                 # If they cancelled the save dialog, abort the exit
-                if self.canvas_editor.is_unsaved:
+                if self.canvas_editor.model.is_unsaved:
                     return
             elif resp is None:
                 return
@@ -1356,6 +1447,10 @@ class MainWindow(tk.Tk):
         self.config_mgr.recent_files = self.recent_files[:5]
         self.config_mgr.theme = self.theme
         self.config_mgr.save()
+        if self.journal is not None:
+            # Clean exit: nothing to recover next time
+            self.journal.close(discard=True)
+        self.canvas_editor.profiler.close_log()
         self.destroy()
 
     def _refresh_recent_menu(self):
@@ -1380,7 +1475,7 @@ class MainWindow(tk.Tk):
 
     def new_canvas(self):
         # Check for unsaved changes before opening the dialog
-        if getattr(self, "canvas_editor", None) and getattr(self.canvas_editor, "is_unsaved", False):
+        if getattr(self, "canvas_editor", None) and self.canvas_editor.model.is_unsaved:
             resp = messagebox.askyesnocancel(
                 "Unsaved Changes",
                 "You have unsaved changes. Do you want to save before creating a new canvas?"
@@ -1388,7 +1483,7 @@ class MainWindow(tk.Tk):
             if resp is True:
                 self.save_png()
                 # If they cancelled the save dialog, abort
-                if getattr(self.canvas_editor, "is_unsaved", False):
+                if self.canvas_editor.model.is_unsaved:
                     return
             elif resp is None:
                 return
@@ -1418,7 +1513,7 @@ class MainWindow(tk.Tk):
 
     def _open_path(self, p: Path):
         # Check for unsaved changes before loading a new image
-        if getattr(self, "canvas_editor", None) and getattr(self.canvas_editor, "is_unsaved", False):
+        if getattr(self, "canvas_editor", None) and self.canvas_editor.model.is_unsaved:
             resp = messagebox.askyesnocancel(
                 "Unsaved Changes",
                 "You have unsaved changes. Do you want to save before opening another file?"
@@ -1426,11 +1521,22 @@ class MainWindow(tk.Tk):
             if resp is True:
                 self.save_png()
                 # If they cancelled the save dialog, abort
-                if getattr(self.canvas_editor, "is_unsaved", False):
+                if self.canvas_editor.model.is_unsaved:
                     return
             elif resp is None:
                 return
 
+        if sniff_image_format(p) == "project":
+            try:
+                project = ProjectFile.open(p)
+            except Exception as e:
+                messagebox.showerror("Error", f"Failed to open project:\n{e}")
+                return
+            self.canvas_editor.load_project(project)
+            self.current_file = p
+            self._add_recent(p)
+            return
+
         try:
             img = load_image_with_alpha(p, max_edit_dimension=3072)
             # FIX: If img is None, the user hit 'X' on the icon popup. Silently abort.
@@ -1452,7 +1558,7 @@ class MainWindow(tk.Tk):
         self._open_path(Path(path))
 
     def save_png(self):
-        comp = self.canvas_editor.get_composite()
+        comp = self.canvas_editor.model.get_composite()
         if comp is None:
             messagebox.showinfo("No image", "Create or open an image first.")
             return
@@ -1461,13 +1567,38 @@ class MainWindow(tk.Tk):
             return
         try:
             save_png(comp, out)
-            self.canvas_editor.is_unsaved = False            
+            self.canvas_editor.model.is_unsaved = False            
             self._update_status(f"Saved PNG: {Path(out).name}")
         except Exception as e:
             messagebox.showerror("Error", f"Failed to save PNG:\n{e}")
 
+    def save_project(self):
+        project = self.canvas_editor.model.project
+        if project is None:
+            self.save_project_as()
+            return
+        self._write_project(project.path)
+
+    def save_project_as(self):
+        if not self.canvas_editor.model.layers:
+            messagebox.showinfo("No image", "Create or open an image first.")
+            return
+        out = save_project_dialog(self, initialfile=(self.current_file.stem + PROJECT_EXT) if self.current_file else None)
+        if out:
+            self._write_project(Path(out))
+
+    def _write_project(self, path: Path):
+        try:
+            self.canvas_editor.model.save_project(path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save project:\n{e}")
+            return
+        self.current_file = path
+        self._add_recent(path)
+        self._update_status(f"Saved project: {path.name}")
+
     def export_ico(self):
-        comp = self.canvas_editor.get_composite()
+        comp = self.canvas_editor.model.get_composite()
         if comp is None:
             messagebox.showinfo("No image", "Create or open an image first.")
             return
@@ -1484,7 +1615,7 @@ class MainWindow(tk.Tk):
             messagebox.showerror("Export Error", f"Failed to export ICO:\n{e}")
 
     def export_icns(self):
-        comp = self.canvas_editor.get_composite()
+        comp = self.canvas_editor.model.get_composite()
         if comp is None:
             messagebox.showinfo("No image", "Create or open an image first.")
             return
@@ -1495,10 +1626,10 @@ class MainWindow(tk.Tk):
             messagebox.showerror("Export Error", f"Failed to export ICNS:\n{e}")
 
     def undo(self):
-        self.canvas_editor.undo()
+        self.canvas_editor.model.undo()
 
     def redo(self):
-        self.canvas_editor.redo()
+        self.canvas_editor.model.redo()
 
     def copy_selection(self):
         self.canvas_editor.copy_selection()
@@ -1509,14 +1640,50 @@ class MainWindow(tk.Tk):
             self._select_tool(ToolType.MOVE)
 
     def select_all(self):
-        if self.canvas_editor.select_all():
+        if self.canvas_editor.model.select_all():
             self._select_tool(ToolType.SELECTION)
 
     def _deselect(self):
-        self.canvas_editor.clear_selection()
+        self.canvas_editor.model.clear_selection()
 
     def make_bg_transparent(self):
-        self.canvas_editor.make_background_transparent()
+        if not self.canvas_editor.model.layers:
+            return
+        dialog = tk.Toplevel(self)
+        dialog.title("Remove Background")
+        dialog.transient(self)
+        dialog.resizable(False, False)
+        tol_var = tk.IntVar(value=self.canvas_editor.model.fill_tolerance)
+        feather_var = tk.IntVar(value=0)
+        contiguous_var = tk.BooleanVar(value=False)
+
+        ttk.Label(dialog, text="Tolerance:").grid(row=0, column=0, padx=10, pady=8, sticky="e")
+        tol_scale = ttk.Scale(dialog, from_=0, to=255, orient="horizontal", length=180,
+                              command=lambda v: tol_var.set(int(float(v))))
+        tol_scale.set(tol_var.get())
+        tol_scale.grid(row=0, column=1, padx=10, pady=8)
+        ttk.Label(dialog, textvariable=tol_var, width=4).grid(row=0, column=2, padx=(0, 10))
+
+        ttk.Label(dialog, text="Feather:").grid(row=1, column=0, padx=10, pady=8, sticky="e")
+        feather_scale = ttk.Scale(dialog, from_=0, to=10, orient="horizontal", length=180,
+                                  command=lambda v: feather_var.set(int(float(v))))
+        feather_scale.grid(row=1, column=1, padx=10, pady=8)
+        ttk.Label(dialog, textvariable=feather_var, width=4).grid(row=1, column=2, padx=(0, 10))
+
+        ttk.Checkbutton(dialog, text="Only areas connected to the edge", variable=contiguous_var).grid(
+            row=2, column=0, columnspan=3, padx=10, pady=4, sticky="w")
+
+        def ok():
+            self.canvas_editor.model.make_background_transparent(
+                tolerance=tol_var.get(),
+                contiguous=contiguous_var.get(),
+                feather=feather_var.get(),
+            )
+            dialog.destroy()
+
+        ttk.Button(dialog, text="Apply", command=ok).grid(row=3, column=0, columnspan=3, pady=10)
+        dialog.grab_set()
+        self.wait_window(dialog)
 
     def _fit_to_window(self):
         self.canvas_editor.fit_to_window()
@@ -1528,19 +1695,53 @@ class MainWindow(tk.Tk):
         self.canvas_editor.set_zoom(v)
 
     def _quick_invert(self):
-        self.canvas_editor.quick_invert()
+        self.canvas_editor.model.quick_invert()
 
     def _quick_grayscale(self):
-        self.canvas_editor.quick_grayscale()
+        self.canvas_editor.model.quick_grayscale()
 
     def _quick_flip_h(self):
-        self.canvas_editor.quick_flip_h()
+        self.canvas_editor.model.quick_flip_h()
 
     def _quick_flip_v(self):
-        self.canvas_editor.quick_flip_v()
+        self.canvas_editor.model.quick_flip_v()
 
     def _quick_trim(self):
-        self.canvas_editor.quick_trim_transparent()
+        self.canvas_editor.model.quick_trim_transparent()
+
+    def _toggle_macro_recording(self):
+        if self.canvas_editor.model.macro is None:
+            self.canvas_editor.model.start_macro()
+            return
+        macro = self.canvas_editor.model.stop_macro()
+        if not macro.steps:
+            self._update_status("Macro recording stopped (nothing recorded)")
+            return
+        out = filedialog.asksaveasfilename(
+            parent=self,
+            title="Save Macro",
+            defaultextension=".json",
+            initialfile="macro.json",
+            filetypes=[("Macro", "*.json")],
+        )
+        if not out:
+            return
+        try:
+            macro.save(out)
+            self._update_status(f"Saved macro: {Path(out).name} ({len(macro.steps)} steps)")
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to save macro:\n{e}")
+
+    def _play_macro(self):
+        path = filedialog.askopenfilename(parent=self, title="Play Macro", filetypes=[("Macro", "*.json"), ("All files", "*.*")])
+        if not path:
+            return
+        try:
+            macro = Macro.load(path)
+        except Exception as e:
+            messagebox.showerror("Error", f"Failed to load macro:\n{e}")
+            return
+        self.canvas_editor.model.play_macro(macro)
 
     def _refresh_layers_ui(self):
         pass
@@ -1549,6 +1750,7 @@ class MainWindow(tk.Tk):
         self.bind("<Control-n>", lambda event: self.new_canvas() or "break")
         self.bind("<Control-o>", lambda event: self.open_image() or "break")
         self.bind("<Control-s>", lambda event: self.save_png() or "break")
+        self.bind("<Control-S>", lambda event: self.save_project() or "break")
         self.bind("<Control-e>", lambda event: self.export_ico() or "break")
 
         self.bind("<Control-z>", lambda event: self.undo() or "break")
@@ -1559,7 +1761,7 @@ class MainWindow(tk.Tk):
         
         self.bind("<Control-a>", lambda event: self.select_all() or "break")
         self.bind("<Escape>", lambda event: self._deselect())
-        self.bind("<Delete>", lambda event: self.canvas_editor.delete_selection())
+        self.bind("<Delete>", lambda event: self.canvas_editor.model.delete_selection())
 
         self.bind("<f>", lambda event: self._fit_to_window())
         self.bind("<F>", lambda event: self._fit_to_window())
@@ -1,6 +1,8 @@
 import sys
 import os
 import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 # Ensure local package import
@@ -8,11 +10,34 @@ CURRENT_DIR = Path(__file__).resolve().parent
 if str(CURRENT_DIR) not in sys.path:
     sys.path.insert(0, str(CURRENT_DIR))
 
-from gui.main_window import run_app
-from core.image_handler import load_image_with_alpha
+from core.image_handler import load_image_with_alpha, iter_input_files, sniff_image_format
+from core.document import Document
+from core.macros import Macro
+from core.transparency import remove_background
 from core.icon_generator import prepare_image_for_size, save_ico_from_images
 from utils.helpers import parse_sizes_list
 
+# Drag events per synthetic stroke in --bench-events
+BENCH_STROKE_DRAGS = 16
+
+
+def preprocess_image(img, args, macro: Macro | None = None):
+    if args.remove_bg:
+        remove_background(img, tolerance=args.bg_tolerance, contiguous=args.bg_contiguous, feather=args.bg_feather)
+    if macro is not None:
+        img = macro.apply(Document.from_image(img)).composite()
+    return img
+
+
+def load_macro(args) -> Macro | None:
+    if not args.macro:
+        return None
+    try:
+        return Macro.load(args.macro)
+    except Exception as e:
+        print(f"Error: Failed to load macro: {e}")
+        sys.exit(1)
+
 
 def run_cli_single(args):
     input_path = Path(args.input)
@@ -25,6 +50,11 @@ def run_cli_single(args):
     except Exception as e:
         print(f"Error: Failed to load image: {e}")
         sys.exit(1)
+    if img is None:
+        # The icon picker for an EXE/DLL was cancelled
+        print("Error: No icon selected.")
+        sys.exit(1)
+    img = preprocess_image(img, args, load_macro(args))
 
     sizes = parse_sizes_list(args.sizes) if args.sizes else [16, 24, 32, 48, 64, 128, 256]
     if not sizes:
@@ -57,10 +87,49 @@ def run_cli_single(args):
     print(f"Exported ICO: {output_path}")
 
 
+def export_batch_file(path: Path, args, sizes, out_dir: Path, macro: Macro | None):
+    """
+    Load, preprocess and export one batch input; returns (status, log line) with status
+    "ok", "reject" or "fail". Runs in worker processes.
+    """
+    try:
+        img = load_image_with_alpha(path, max_edit_dimension=args.max_dim)
+    except Exception as e:
+        return "fail", f"[SKIP] {path.name}: {e}"
+    if img is None:
+        # The icon picker for an EXE/DLL was cancelled
+        return "reject", f"[REJECT] {path.name}: no icon selected"
+    try:
+        img = preprocess_image(img, args, macro)
+    except Exception as e:
+        return "fail", f"[FAIL] {path.name}: {e}"
+
+    prepared = []
+    for s in sorted(set(sizes), reverse=True):
+        prepared.append((s, prepare_image_for_size(
+            img, s, args.resample or "lanczos",
+            maintain_aspect=(not args.no_aspect),
+            pad_to_square=True
+        )))
+
+    out_ico = out_dir / f"{path.stem}.ico"
+    try:
+        save_ico_from_images(prepared, out_ico)
+        if args.export_pngs:
+            png_dir = out_dir / f"{path.stem}_png"
+            png_dir.mkdir(parents=True, exist_ok=True)
+            for sz, im in prepared:
+                (png_dir / f"{path.stem}_{sz}.png").write_bytes(pil_to_png_bytes(im))
+        return "ok", f"[OK] {path.name} -> {out_ico.name}"
+    except Exception as e:
+        return "fail", f"[FAIL] {path.name}: {e}"
+
+
 def run_cli_batch(args):
     in_dir = Path(args.input_dir)
     out_dir = Path(args.out_dir) if args.out_dir else in_dir / "ico_output"
-    pattern = args.pattern or "*.png"
+    include = args.pattern or ["*"]
+    exclude = list(args.exclude or [])
     if not in_dir.exists():
         print(f"Error: Input directory not found: {in_dir}")
         sys.exit(1)
@@ -70,39 +139,94 @@ def run_cli_batch(args):
     if not sizes:
         print("Error: No sizes specified.")
         sys.exit(1)
-    resample_name = args.resample or "lanczos"
+    macro = load_macro(args)
 
-    count = 0
-    for path in in_dir.rglob(pattern):
-        if not path.is_file():
-            continue
-        try:
-            img = load_image_with_alpha(path, max_edit_dimension=args.max_dim)
-        except Exception as e:
-            print(f"[SKIP] {path.name}: {e}")
+    # Never re-ingest our own output when it lives inside the input tree
+    try:
+        exclude.append(out_dir.resolve().relative_to(in_dir.resolve()).as_posix() + "/*")
+    except ValueError:
+        pass
+
+    format_counts: dict[str, int] = {}
+    rejected = 0
+    paths = []
+    for path in iter_input_files(in_dir, include, exclude):
+        # Classify from the file head so non-images are rejected before any decode
+        fmt = sniff_image_format(path)
+        if fmt is None or (fmt == "pe" and os.name != "nt"):
+            rejected += 1
+            print(f"[REJECT] {path.name}: {'not a supported image' if fmt is None else 'EXE/DLL extraction requires Windows'}")
             continue
+        format_counts[fmt] = format_counts.get(fmt, 0) + 1
+        paths.append(path)
 
-        prepared = []
-        for s in sorted(set(sizes), reverse=True):
-            prepared.append((s, prepare_image_for_size(
-                img, s, resample_name,
-                maintain_aspect=(not args.no_aspect),
-                pad_to_square=True
-            )))
-
-        out_ico = out_dir / f"{path.stem}.ico"
-        try:
-            save_ico_from_images(prepared, out_ico)
-            if args.export_pngs:
-                png_dir = out_dir / f"{path.stem}_png"
-                png_dir.mkdir(parents=True, exist_ok=True)
-                for sz, im in prepared:
-                    (png_dir / f"{path.stem}_{sz}.png").write_bytes(pil_to_png_bytes(im))
-            print(f"[OK] {path.name} -> {out_ico.name}")
-            count += 1
-        except Exception as e:
-            print(f"[FAIL] {path.name}: {e}")
+    jobs = max(1, args.jobs or os.cpu_count() or 1)
+    work = [(p, args, sizes, out_dir, macro) for p in paths]
+    if jobs == 1 or len(paths) < 2:
+        results = (export_batch_file(*w) for w in work)
+        statuses = _report(results)
+    else:
+        # Each file is independent and nothing here touches Tk, so plain worker processes do
+        with ProcessPoolExecutor(max_workers=min(jobs, len(paths))) as pool:
+            statuses = _report(pool.map(export_batch_file, *zip(*work)))
+    count = statuses.get("ok", 0)
+    rejected += statuses.get("reject", 0)
     print(f"Batch complete. {count} icons exported to {out_dir}")
+    summary = ", ".join(f"{fmt}={n}" for fmt, n in sorted(format_counts.items())) or "none"
+    print(f"Formats: {summary}; rejected: {rejected}")
+
+
+def bench_events(events: int, size: int, seed: int):
+    """Drive synthetic pencil strokes through a headless CanvasModel and Renderer; returns (events, seconds)."""
+    import random
+    import time
+    from core.canvas_model import CanvasModel
+    from core.renderer import Renderer
+
+    rng = random.Random(seed)
+    model = CanvasModel()
+    renderer = Renderer(model)
+    model.new_blank((size, size))
+    view = (0, 0, size, size)
+    done = 0
+    start = time.perf_counter()
+    while done < events:
+        model.set_color((rng.randrange(256), rng.randrange(256), rng.randrange(256), 255))
+        x, y = rng.randrange(size), rng.randrange(size)
+        model.press(x, y)
+        for _ in range(BENCH_STROKE_DRAGS):
+            # Mouse-like motion: a few pixels per event
+            x, y = x + rng.randint(-8, 8), y + rng.randint(-8, 8)
+            model.drag(x, y)
+        model.release()
+        # One display frame per stroke
+        renderer.render(view, 1)
+        done += BENCH_STROKE_DRAGS + 2
+    return done, time.perf_counter() - start
+
+
+def run_cli_bench(args):
+    jobs = max(1, args.jobs or os.cpu_count() or 1)
+    per_job = -(-args.bench_events // jobs)
+    if jobs == 1:
+        results = [bench_events(per_job, args.bench_size, 0)]
+    else:
+        # Every worker edits its own document, so they scale like batch exports
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(bench_events, [per_job] * jobs, [args.bench_size] * jobs, range(jobs)))
+    events = sum(n for n, _ in results)
+    seconds = max(t for _, t in results)
+    print(f"Bench: {events} tool events on {jobs} worker(s), {args.bench_size}x{args.bench_size} canvas")
+    print(f"{seconds:.2f} s, {events / seconds:,.0f} events/s")
+
+
+def _report(results) -> dict[str, int]:
+    """Print each (status, log line) as it arrives; returns how many files ended in each status."""
+    counts: dict[str, int] = {}
+    for status, line in results:
+        print(line)
+        counts[status] = counts.get(status, 0) + 1
+    return counts
 
 
 def pil_to_png_bytes(im):
@@ -124,15 +248,36 @@ def main():
     parser.add_argument("--no-aspect", action="store_true", help="Do not maintain aspect ratio (stretches)")
     parser.add_argument("--export-pngs", action="store_true", help="Also export PNG set for each size")
     parser.add_argument("--max-dim", type=int, default=3072, help="Max dimension to downscale large images for editing (CLI)")
+    parser.add_argument("--remove-bg", action="store_true", help="Make the corner-colour background transparent before export")
+    parser.add_argument("--bg-tolerance", type=int, default=0, help="Per-channel colour tolerance for --remove-bg (0-255)")
+    bg_scope = parser.add_mutually_exclusive_group()
+    bg_scope.add_argument("--bg-contiguous", dest="bg_contiguous", action="store_true",
+                          help="With --remove-bg, clear only matching areas connected to the image edge")
+    bg_scope.add_argument("--bg-global", dest="bg_contiguous", action="store_false",
+                          help="With --remove-bg, clear every matching pixel (the default)")
+    parser.set_defaults(bg_contiguous=False)
+    parser.add_argument("--bg-feather", type=float, default=0, help="With --remove-bg, soften the cut-out edge over N pixels")
+    parser.add_argument("--macro", type=str, help="Apply a macro recorded in the editor (.json) before export")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Worker processes for batch mode and --bench-events (default: 1; 0 = one per CPU core)")
+    parser.add_argument("--bench-events", type=int, default=0,
+                        help="Benchmark: apply N synthetic pencil events to a headless canvas and report events/s")
+    parser.add_argument("--bench-size", type=int, default=512, help="Canvas size for --bench-events")
 
     # Batch mode
     parser.add_argument("--input-dir", type=str, help="Input directory for batch")
-    parser.add_argument("--pattern", type=str, help="Glob pattern for input (e.g., '*.png')")
+    parser.add_argument("--pattern", type=str, action="append",
+                        help="Include glob for batch input (repeatable, default: all files, detected by content)")
+    parser.add_argument("--exclude", type=str, action="append",
+                        help="Exclude glob for batch input (repeatable, e.g. 'backup/*')")
     parser.add_argument("--out-dir", type=str, help="Output directory for batch output")
 
     args = parser.parse_args()
 
     if args.cli:
+        if args.bench_events:
+            run_cli_bench(args)
+            return
         if args.input_dir:
             run_cli_batch(args)
             return
@@ -151,8 +296,12 @@ def main():
                 pass
     except Exception:
         pass
+    # Imported here so CLI runs and their worker processes never load the GUI
+    from gui.main_window import run_app
     run_app()
 
 
 if __name__ == "__main__":
+    # Frozen builds start every worker process through this entry point
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,116 @@
+import json
+import os
+import random
+import time
+
+from PIL import Image
+
+from core import autosave
+from core.autosave import AutosaveJournal, find_recoverable, read_journal, session_journal_name
+from core.editor_tools import LayerTiles
+
+SIZE = (150, 100)
+
+
+def layer(seed):
+    rng = random.Random(seed)
+    image = Image.new("RGBA", SIZE, (0, 0, 0, 0))
+    for _ in range(6):
+        x, y = rng.randrange(SIZE[0]), rng.randrange(SIZE[1])
+        image.paste((rng.randrange(256), rng.randrange(256), 0, 255), (x, y, x + 30, y + 20))
+    return image
+
+
+def write_states(path, seeds):
+    """Journal one state per seed (a single layer named after it); returns the images."""
+    journal = AutosaveJournal(path, bandwidth=1 << 40)
+    images = []
+    previous = None
+    for seed in seeds:
+        image = layer(seed)
+        previous = LayerTiles.capture(image, previous)
+        journal.record([previous], [True], [f"layer {seed}"], 0)
+        images.append(image)
+        # Let the writer catch up, so every state gets a record of its own
+        deadline = time.monotonic() + 10
+        while last_state_name(path) != f"layer {seed}":
+            assert time.monotonic() < deadline
+            time.sleep(0.001)
+    journal.close()
+    return images
+
+
+def state_count(path):
+    data = path.read_bytes()
+    return sum(kind == autosave._STATE for kind, _, _ in autosave._iter_records(data))
+
+
+def last_state_name(path):
+    names = [json.loads(payload)["layers"][0]["name"]
+             for kind, payload, _ in autosave._iter_records(path.read_bytes()) if kind == autosave._STATE]
+    return names[-1] if names else None
+
+
+def assert_state(state, image, seed):
+    assert state is not None
+    assert state.size == SIZE
+    assert state.layers[0].tobytes() == image.tobytes()
+    assert state.names == [f"layer {seed}"]
+
+
+def record_offsets(path):
+    data = path.read_bytes()
+    return data, [offset for _, _, offset in autosave._iter_records(data)]
+
+
+def test_reads_last_state(tmp_path):
+    path = tmp_path / "session-1.journal"
+    images = write_states(path, [1, 2, 3])
+    assert_state(read_journal(path), images[-1], 3)
+
+
+def test_truncated_record_falls_back_to_previous_state(tmp_path):
+    path = tmp_path / "session-1.journal"
+    images = write_states(path, [1, 2])
+    data, offsets = record_offsets(path)
+    # Cut the last record (the newest state) short at several points
+    for cut in (offsets[-1] + 3, offsets[-1] + autosave._RECORD.size + 5, len(data) - 1):
+        path.write_bytes(data[:cut])
+        assert_state(read_journal(path), images[0], 1)
+
+
+def test_crc_mismatch_falls_back_to_previous_state(tmp_path):
+    path = tmp_path / "session-1.journal"
+    images = write_states(path, [1, 2])
+    data, offsets = record_offsets(path)
+    damaged = bytearray(data)
+    damaged[-2] ^= 0xFF
+    path.write_bytes(bytes(damaged))
+    assert_state(read_journal(path), images[0], 1)
+
+
+def test_recovery_after_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(autosave, "COMPACT_MIN_BYTES", 0)
+    path = tmp_path / "session-1.journal"
+    images = write_states(path, range(12))
+    # Rewritten down to the live tiles and the newest state at least once
+    assert state_count(path) < 12
+    assert_state(read_journal(path), images[-1], 11)
+
+
+def test_find_recoverable_tells_reused_pids_apart(tmp_path):
+    pid = os.getpid()
+    mine = tmp_path / session_journal_name()
+    legacy = tmp_path / f"session-{pid}.journal"
+    dead = next(p for p in range(4_000_000, 4_100_000) if not autosave._pid_alive(p))
+    gone = tmp_path / f"session-{dead}.journal"
+    for p in (mine, legacy, gone):
+        p.write_bytes(b"ICJ1")
+    expected = {gone}
+    start = autosave._process_start(pid)
+    if start is not None:
+        # Same PID, different start time: an earlier editor whose PID this process reused
+        reused = tmp_path / f"session-{pid}-{start + 1}.journal"
+        reused.write_bytes(b"ICJ1")
+        expected.add(reused)
+    assert set(find_recoverable(tmp_path)) == expected
@@ -0,0 +1,71 @@
+import random
+
+import pytest
+from PIL import Image, ImageChops, ImageDraw
+
+from core.editor_tools import SWEEP_MIN_SIZE, SWEEP_MIN_STEPS, _bresenham, draw_brush_line, draw_dab
+
+BLUE = (40, 60, 220, 255)
+SIZE = (97, 71)
+
+
+def reference_line(image, p0, p1, color, brush_size, shape="round"):
+    """The original line drawing: one ellipse (or square) per Bresenham step."""
+    draw = ImageDraw.Draw(image, "RGBA")
+    half = brush_size // 2
+    for x, y in _bresenham(p0, p1):
+        if brush_size <= 1:
+            draw.point((x, y), fill=color)
+        elif shape == "square":
+            draw.rectangle((x - half, y - half, x + half, y + half), fill=color)
+        else:
+            draw.ellipse((x - half, y - half, x + half, y + half), fill=color)
+
+
+def check(p0, p1, brush_size, shape):
+    base = Image.new("RGBA", SIZE, (250, 250, 250, 255))
+    expected = base.copy()
+    reference_line(expected, p0, p1, BLUE, brush_size, shape)
+    actual = base.copy()
+    bbox = draw_brush_line(actual, p0, p1, BLUE, brush_size, shape=shape)
+    assert actual.tobytes() == expected.tobytes()
+    changed = ImageChops.difference(actual, base).getbbox()
+    if changed is not None:
+        assert bbox[0] <= changed[0] and bbox[1] <= changed[1] and bbox[2] >= changed[2] and bbox[3] >= changed[3]
+
+
+@pytest.mark.parametrize("shape", ["round", "square"])
+@pytest.mark.parametrize("brush_size", [1, 2, 3, 8, SWEEP_MIN_SIZE, 25])
+def test_hard_lines_match_reference(shape, brush_size):
+    rng = random.Random(brush_size)
+    for _ in range(25):
+        p0 = (rng.randrange(SIZE[0]), rng.randrange(SIZE[1]))
+        # Short segments stamp per step; long ones take the swept path
+        reach = rng.choice([3, SWEEP_MIN_STEPS + 10])
+        p1 = (p0[0] + rng.randint(-reach, reach), p0[1] + rng.randint(-reach, reach))
+        check(p0, p1, brush_size, shape)
+
+
+@pytest.mark.parametrize("shape", ["round", "square"])
+@pytest.mark.parametrize("brush_size", [1, 5, SWEEP_MIN_SIZE, 31])
+def test_zero_length_segments(shape, brush_size):
+    for p in [(0, 0), (48, 35), (96, 70), (-3, 10)]:
+        check(p, p, brush_size, shape)
+
+
+@pytest.mark.parametrize("shape", ["round", "square"])
+@pytest.mark.parametrize("brush_size", [1, 6, SWEEP_MIN_SIZE, 40])
+def test_segments_clipped_at_canvas_edge(shape, brush_size):
+    w, h = SIZE
+    for p0, p1 in [((-20, 10), (50, 10)), ((10, -30), (12, h + 30)), ((w - 2, 5), (w + 40, h - 5)),
+                   ((-10, -10), (w + 10, h + 10)), ((5, h - 1), (w - 5, h - 1))]:
+        check(p0, p1, brush_size, shape)
+
+
+def test_dab_matches_single_ellipse():
+    for brush_size in (2, 7, 16, 33):
+        expected = Image.new("RGBA", SIZE)
+        reference_line(expected, (40, 30), (40, 30), BLUE, brush_size)
+        actual = Image.new("RGBA", SIZE)
+        draw_dab(actual, (40, 30), BLUE, brush_size)
+        assert actual.tobytes() == expected.tobytes()
@@ -0,0 +1,52 @@
+import time
+
+from PIL import Image, ImageDraw
+
+from core.canvas_model import CanvasModel, ToolType
+from core.project import ProjectFile
+
+
+def make_project(path):
+    model = CanvasModel()
+    image = Image.new("RGBA", (300, 200), (0, 0, 0, 0))
+    ImageDraw.Draw(image).ellipse((20, 20, 280, 180), fill=(30, 120, 220, 255))
+    model.load_image(image)
+    model.save_project(path)
+    return ProjectFile.open(path)
+
+
+def test_ensure_loaded_keeps_document_saved(tmp_path):
+    model = CanvasModel()
+    model.open_project(make_project(tmp_path / "doc.icproj"))
+    assert model.start_loading((0, 0, 64, 64)) is not None
+    model.ensure_loaded()
+    assert not model.is_unsaved
+    assert model.get_composite().getpixel((150, 100)) == (30, 120, 220, 255)
+
+
+def test_drained_tiles_keep_document_saved(tmp_path):
+    model = CanvasModel()
+    model.open_project(make_project(tmp_path / "doc.icproj"))
+    token = model.start_loading((0, 0, 64, 64))
+    deadline = time.monotonic() + 10
+    while model.drain_loading(token) and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert not model.is_unsaved
+
+
+def test_eyedropper_failure_goes_to_status(capsys):
+    messages = []
+    model = CanvasModel(on_status=messages.append)
+    model.new_blank((16, 16))
+    model.set_tool(ToolType.EYEDROPPER)
+    color = model.color
+
+    def broken(x, y):
+        raise RuntimeError("no composite")
+
+    model._sample_composite = broken
+    model.press(4, 4)
+    model.release()
+    assert messages[-1] == "Eyedropper sample failed: no composite"
+    assert model.color == color
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,100 @@
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+from PIL import Image
+
+APP_DIR = Path(__file__).resolve().parent.parent
+
+# Start workers the way Windows (and the frozen exe) does: a fresh interpreter that
+# re-imports the entry script, which must not run main() again
+SPAWN_MAIN = (
+    "import multiprocessing, runpy, sys\n"
+    "multiprocessing.set_start_method('spawn')\n"
+    "sys.argv = ['main.py'] + sys.argv[1:]\n"
+    "runpy.run_path(sys.argv[0], run_name='__main__')\n"
+)
+
+
+def run_main(*args):
+    return subprocess.run(
+        [sys.executable, "-c", SPAWN_MAIN, *args], cwd=APP_DIR, capture_output=True, text=True, timeout=120
+    )
+
+
+def test_bench_workers_start_through_entry_point():
+    result = run_main("--cli", "--bench-events", "72", "--bench-size", "32", "--jobs", "2")
+    assert result.returncode == 0, result.stderr
+    assert "on 2 worker(s)" in result.stdout
+
+
+def test_batch_workers_start_through_entry_point(tmp_path):
+    for name in ("a", "b", "c"):
+        Image.new("RGBA", (20, 20), (200, 0, 0, 255)).save(tmp_path / f"{name}.png")
+    out = tmp_path / "out"
+    result = run_main("--cli", "--input-dir", str(tmp_path), "--out-dir", str(out), "--sizes", "16", "--jobs", "2")
+    assert result.returncode == 0, result.stderr
+    assert sorted(p.name for p in out.glob("*.ico")) == ["a.ico", "b.ico", "c.ico"]
+
+
+def cli_args(**overrides):
+    args = dict(
+        remove_bg=False, bg_tolerance=0, bg_contiguous=False, bg_feather=0, macro=None, max_dim=3072,
+        sizes="16", resample="lanczos", no_aspect=False, export_pngs=False, jobs=1,
+        input_dir=None, out_dir=None, pattern=None, exclude=None,
+    )
+    args.update(overrides)
+    return argparse.Namespace(**args)
+
+
+def test_preprocess_runs_a_macro_headless():
+    import main
+    from core.macros import Macro
+
+    image = Image.new("RGBA", (40, 30), (255, 255, 255, 255))
+    image.paste((200, 0, 0, 255), (5, 5, 15, 25))
+    macro = Macro()
+    macro.record("remove_background", tolerance=0, contiguous=False, feather=0)
+    macro.record("trim")
+    macro.record("flip_h")
+    macro.record("invert")
+    out = main.preprocess_image(image, cli_args(), macro)
+    # Background cleared and trimmed away, leaving the red block mirrored and inverted
+    assert out.size == (10, 20)
+    assert out.getpixel((0, 0)) == (55, 255, 255, 255)
+
+
+def test_cancelled_icon_pick_is_rejected(tmp_path, monkeypatch, capsys):
+    import main
+
+    for name in ("a", "b"):
+        Image.new("RGBA", (20, 20), (200, 0, 0, 255)).save(tmp_path / f"{name}.png")
+    real_load = main.load_image_with_alpha
+    # Stand-in for the EXE/DLL icon picker being closed without a choice
+    monkeypatch.setattr(main, "load_image_with_alpha",
+                        lambda path, **kw: None if path.stem == "a" else real_load(path, **kw))
+    out = tmp_path / "out"
+    main.run_cli_batch(cli_args(input_dir=str(tmp_path), out_dir=str(out)))
+    printed = capsys.readouterr().out
+    assert "[REJECT] a.png: no icon selected" in printed
+    assert "1 icons exported" in printed
+    assert "rejected: 1" in printed
+    assert [p.name for p in out.glob("*.ico")] == ["b.ico"]
+
+
+def test_batch_sniffs_inputs_and_honours_exclude(tmp_path, capsys):
+    import main
+
+    (tmp_path / "fake.png").write_text("not really a picture")
+    (tmp_path / "notes.txt").write_text("hello")
+    Image.new("RGB", (20, 20), (0, 90, 200)).save(tmp_path / "photo", format="JPEG")
+    (tmp_path / "backup").mkdir()
+    Image.new("RGBA", (20, 20), (200, 0, 0, 255)).save(tmp_path / "backup" / "old.png")
+    out = tmp_path / "out"
+    main.run_cli_batch(cli_args(input_dir=str(tmp_path), out_dir=str(out), exclude=["backup/*"]))
+    printed = capsys.readouterr().out
+    assert "[REJECT] fake.png: not a supported image" in printed
+    assert "[REJECT] notes.txt: not a supported image" in printed
+    assert "Formats: jpeg=1; rejected: 2" in printed
+    assert [p.name for p in out.glob("*.ico")] == ["photo.ico"]
@@ -0,0 +1,84 @@
+import random
+
+import pytest
+from PIL import Image
+
+from core.canvas_model import CanvasModel, ToolType
+from core.display_cache import MipPyramid
+from core.renderer import Renderer, display_pixel
+from core.transparency import cached_checkerboard
+
+# Odd sizes leave partial mip blocks at the right and bottom edges of every level
+SIZES = [(101, 67), (7, 7), (33, 97), (250, 131)]
+
+
+def noise(size, seed):
+    rng = random.Random(seed)
+    # Random alpha too, including fully transparent pixels, to exercise premultiplication
+    data = bytes(rng.randrange(256) for _ in range(size[0] * size[1] * 4))
+    return Image.frombytes("RGBA", size, data)
+
+
+def reference(source, factor):
+    return source.convert("RGBa").reduce(factor)
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_levels_match_direct_reduce(size):
+    source = noise(size, 1)
+    mips = MipPyramid()
+    for factor in (8, 2, 4):
+        level = mips.level(source, factor)
+        assert level.tobytes() == reference(source, factor).tobytes()
+        # display_pixel maps the image edge to the level's edge
+        assert level.size == (display_pixel(size[0], 1 / factor), display_pixel(size[1], 1 / factor))
+
+
+@pytest.mark.parametrize("size", SIZES)
+def test_incremental_updates_match_direct_reduce(size):
+    rng = random.Random(size[0])
+    source = noise(size, 2)
+    mips = MipPyramid()
+    for factor in (2, 4, 8):
+        mips.level(source, factor)
+    for step in range(30):
+        w, h = size
+        x0, y0 = rng.randrange(w), rng.randrange(h)
+        # Unaligned rects, many of them touching the right or bottom edge
+        rect = (x0, y0, min(w, x0 + rng.randrange(1, 20)), min(h, y0 + rng.randrange(1, 20)))
+        if step % 3 == 0:
+            rect = (x0, y0, w, h)
+        source.paste(noise((rect[2] - rect[0], rect[3] - rect[1]), step), rect[:2])
+        mips.invalidate(rect)
+        # Read levels in varying order, sometimes skipping one so its rects pile up
+        for factor in rng.sample((2, 4, 8), rng.randrange(1, 4)):
+            assert mips.level(source, factor).tobytes() == reference(source, factor).tobytes()
+    for factor in (2, 4, 8):
+        assert mips.level(source, factor).tobytes() == reference(source, factor).tobytes()
+
+
+def expected_display(source, factor):
+    level = reference(source, factor).convert("RGBA")
+    return Image.alpha_composite(cached_checkerboard(level.size, 8), level)
+
+
+@pytest.mark.parametrize("factor", (2, 4, 8))
+def test_renderer_zoomed_out_after_edits(factor):
+    model = CanvasModel()
+    model.load_image(noise((203, 151), 3))
+    renderer = Renderer(model)
+    image, _ = renderer.render(None, 1 / factor)
+    assert renderer.window == (0, 0, 203, 151)
+    assert image.tobytes() == expected_display(model.get_composite(), factor).tobytes()
+
+    model.set_tool(ToolType.PENCIL)
+    model.set_color((250, 20, 40, 255))
+    model.set_brush_size(3)
+    for start, end in (((1, 1), (60, 40)), ((200, 10), (202, 150)), ((5, 149), (190, 148))):
+        model.press(*start)
+        model.drag(*end)
+        model.release()
+        image, rects = renderer.render(None, 1 / factor)
+        # Patched in place, not rebuilt
+        assert rects is not None
+        assert image.tobytes() == expected_display(model.get_composite(), factor).tobytes()
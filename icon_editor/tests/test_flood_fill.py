@@ -0,0 +1,88 @@
+import random
+from collections import deque
+
+import pytest
+from PIL import Image
+
+from core import editor_tools
+from core.editor_tools import flood_fill
+
+PALETTE = [(0, 0, 0, 0), (200, 30, 30, 255), (205, 34, 28, 255), (30, 30, 200, 255), (200, 30, 30, 128)]
+
+
+@pytest.fixture(params=["numpy", "pillow"])
+def backend(request, monkeypatch):
+    if request.param == "pillow":
+        monkeypatch.setattr(editor_tools, "np", None)
+    elif editor_tools.np is None:
+        pytest.skip("NumPy is not installed")
+
+
+def reference_fill(image, seed, fill_color, tolerance=0):
+    """The original per-pixel 4-connected fill."""
+    w, h = image.size
+    px = image.load()
+    target = px[seed]
+    if target == fill_color:
+        return
+    seen = {seed}
+    queue = deque([seed])
+    while queue:
+        x, y = queue.popleft()
+        c = px[x, y]
+        if c == fill_color or any(abs(c[i] - target[i]) > tolerance for i in range(4)):
+            continue
+        px[x, y] = fill_color
+        for n in ((x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)):
+            if 0 <= n[0] < w and 0 <= n[1] < h and n not in seen:
+                seen.add(n)
+                queue.append(n)
+
+
+def random_image(rng, size):
+    image = Image.new("RGBA", size)
+    px = image.load()
+    colors = rng.sample(PALETTE, rng.randint(2, len(PALETTE)))
+    for y in range(size[1]):
+        for x in range(size[0]):
+            # Mostly repeat a neighbour, so regions have real shapes
+            if x and rng.random() < 0.6:
+                px[x, y] = px[x - 1, y]
+            elif y and rng.random() < 0.5:
+                px[x, y] = px[x, y - 1]
+            else:
+                px[x, y] = rng.choice(colors)
+    return image
+
+
+def check(image, seed, fill_color, tolerance):
+    expected = image.copy()
+    reference_fill(expected, seed, fill_color, tolerance)
+    actual = image.copy()
+    flood_fill(actual, seed, fill_color, tolerance)
+    assert actual.tobytes() == expected.tobytes()
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_matches_reference_fill(backend, seed):
+    rng = random.Random(seed)
+    size = (rng.randint(1, 37), rng.randint(1, 29))
+    image = random_image(rng, size)
+    point = (rng.randrange(size[0]), rng.randrange(size[1]))
+    check(image, point, rng.choice(PALETTE + [(9, 250, 9, 255)]), rng.choice([0, 0, 5, 40, 255]))
+
+
+@pytest.mark.parametrize("tolerance", [0, 6])
+def test_seed_on_border(backend, tolerance):
+    rng = random.Random(7)
+    image = random_image(rng, (31, 23))
+    for seed in [(0, 0), (30, 0), (0, 22), (30, 22), (15, 0), (0, 11), (30, 11), (15, 22)]:
+        check(image, seed, (9, 250, 9, 255), tolerance)
+
+
+def test_fully_transparent_region(backend):
+    image = Image.new("RGBA", (40, 30), (0, 0, 0, 0))
+    image.paste((30, 30, 200, 255), (10, 8, 30, 22))
+    image.paste((0, 0, 0, 0), (14, 12, 26, 18))
+    check(image, (2, 2), (200, 30, 30, 255), 0)
+    check(image, (20, 15), (200, 30, 30, 255), 0)
@@ -0,0 +1,178 @@
+import random
+
+from PIL import Image
+
+from core.canvas_model import CanvasModel
+from core.editor_tools import HISTORY_TILE, LayerTiles, ToolType, UndoRedoStack
+
+TILE_BYTES = HISTORY_TILE * HISTORY_TILE * 4
+
+
+def flat_layer(color, size=(2048, 2048)):
+    return Image.new("RGBA", size, color)
+
+
+def test_shared_tile_is_counted_once():
+    stack = UndoRedoStack()
+    snap = LayerTiles.capture(flat_layer((200, 40, 40, 255)))
+    stack.push(snap, snap.tiles)
+    assert stack.memory_bytes == TILE_BYTES
+
+
+def test_shared_tile_is_spilled_once():
+    stack = UndoRedoStack(limit=3, memory_budget=0, hot_entries=1)
+    previous = None
+    for i in range(12):
+        snap = LayerTiles.capture(flat_layer((i * 20, 40, 40, 255)), previous)
+        stack.push(snap, snap.tiles)
+        previous = snap
+        # At most one packed flat tile per entry is ever on disk, compaction included
+        assert stack._spill is None or stack._spill.size < 3 * 1024
+    assert stack.memory_bytes <= TILE_BYTES
+    assert stack.current().to_image().getpixel((2047, 2047)) == (220, 40, 40, 255)
+
+
+def model_state(model):
+    return (
+        tuple(ly.tobytes() for ly in model.layers),
+        tuple(model.layer_visible),
+        tuple(model.layer_names),
+        model.active_layer,
+    )
+
+
+def stroke(model, rng):
+    model.set_tool(ToolType.PENCIL)
+    model.set_color((rng.randrange(256), rng.randrange(256), rng.randrange(256), 255))
+    model.set_brush_size(rng.choice([1, 3, 9]))
+    x, y = rng.randrange(model.width()), rng.randrange(model.height())
+    model.press(x, y)
+    for _ in range(4):
+        x, y = x + rng.randint(-12, 12), y + rng.randint(-12, 12)
+        model.drag(x, y)
+    model.release()
+
+
+def walk_history(model, states):
+    """Undo through states (the last len(states) entries) and redo back, checking every step."""
+    for expected in reversed(states[:-1]):
+        model.undo()
+        assert model_state(model) == expected
+    for expected in states[1:]:
+        model.redo()
+        assert model_state(model) == expected
+
+
+def test_undo_redo_exact_across_shared_tiles():
+    rng = random.Random(3)
+    model = CanvasModel()
+    # Not a multiple of the tile size, so edge tiles are partial
+    model.new_blank((150, 130))
+    states = [model_state(model)]
+    for step in range(16):
+        if step in (5, 11):
+            model.layer_add()
+        else:
+            before = model.history.memory_bytes
+            stroke(model, rng)
+            # A stroke only adds the tiles it touched; the rest are shared with the entry before
+            assert model.history.memory_bytes - before < 150 * 130 * 4
+        states.append(model_state(model))
+    assert model.history.index == len(states) - 1
+    walk_history(model, states)
+
+
+def test_layer_commands_round_trip():
+    rng = random.Random(5)
+    model = CanvasModel()
+    model.new_blank((90, 70))
+    stroke(model, rng)
+    model.layer_add()
+    stroke(model, rng)
+    states = [model_state(model)]
+    memory = model.history.memory_bytes
+    for op in ("toggle", "rename", "move", "toggle", "move", "rename", "toggle"):
+        if op == "toggle":
+            model.layer_toggle_visibility()
+        elif op == "rename":
+            model.layer_rename(f"renamed {len(states)}")
+        else:
+            model.layer_move(-1 if model.active_layer else 1)
+        states.append(model_state(model))
+    # Commands hold no pixels
+    assert model.history.memory_bytes == memory
+    walk_history(model, states)
+
+
+def test_command_folded_into_dropped_entry():
+    rng = random.Random(9)
+    model = CanvasModel()
+    model.history.limit = 4
+    model.new_blank((80, 60))
+    model.layer_add()
+    states = [model_state(model)]
+    model.layer_toggle_visibility()
+    states.append(model_state(model))
+    model.layer_move(-1)
+    states.append(model_state(model))
+    model.layer_rename("top")
+    states.append(model_state(model))
+    for _ in range(3):
+        # Each push drops the oldest entry; the commands after it are folded into a snapshot
+        stroke(model, rng)
+        states.append(model_state(model))
+        assert isinstance(model.history.entry(0), dict)
+    kept = states[-model.history.limit:]
+    walk_history(model, kept)
+    # The folded entry is now the oldest: nothing is left to undo past it
+    for _ in kept:
+        model.undo()
+    assert model.history.index == 0
+    assert model_state(model) == kept[0]
+
+
+def noise_snapshot(rng, size=(256, 128)):
+    image = Image.frombytes("RGBA", size, rng.randbytes(size[0] * size[1] * 4))
+    return LayerTiles.capture(image), image.tobytes()
+
+
+def test_byte_budget_packs_spills_and_drops():
+    rng = random.Random(11)
+    raw_entry = 256 * 128 * 4
+    stack = UndoRedoStack(limit=50, memory_budget=3 * raw_entry, disk_budget=6 * raw_entry, hot_entries=2)
+    pushed = []
+    for _ in range(14):
+        snap, data = noise_snapshot(rng)
+        stack.push(snap, snap.tiles)
+        pushed.append(data)
+        assert stack.memory_bytes <= stack.memory_budget
+        assert stack.disk_bytes <= stack.disk_budget
+        # Only the newest hot_entries keep raw tiles
+        for i in range(stack.index + 1):
+            assert all(t.is_raw for t in stack.entry(i).tiles) == (i > stack.index - stack.hot_entries)
+    assert stack._spill is not None and stack.disk_bytes > 0
+    # Past the disk budget the oldest entries went; every kept one still reads back exactly
+    kept = stack.index + 1
+    assert kept < len(pushed)
+    for i in range(kept):
+        assert stack.entry(i).to_image().tobytes() == pushed[len(pushed) - kept + i]
+
+
+def test_released_project_tile_is_decoded_again(tmp_path):
+    from core.project import ProjectFile, write_project
+
+    rng = random.Random(13)
+    snap, data = noise_snapshot(rng)
+    project = write_project(tmp_path / "noise.icproj", [snap], ["Layer 1"], [True], 0)
+    model = CanvasModel()
+    model.history.limit = 2
+    model.history.hot_entries = 1
+    model.set_history_budget(0, None)
+    model.open_project(project)
+    model.start_loading()
+    model.ensure_loaded()
+    # Replace every tile twice: the loaded tiles are spilled, then released with their entry
+    model.quick_invert()
+    model.quick_invert()
+    assert model.layers[0].tobytes() == data
+    assert project.load_layer(0).tobytes() == data
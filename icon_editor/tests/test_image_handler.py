@@ -0,0 +1,78 @@
+import io
+
+import pytest
+from PIL import Image
+
+from core.image_handler import iter_input_files, load_image_with_alpha, sniff_bytes, sniff_image_format
+
+
+def encoded(fmt, size=(12, 8)):
+    buf = io.BytesIO()
+    Image.new("RGB", size, (30, 120, 200)).save(buf, format=fmt)
+    return buf.getvalue()
+
+
+@pytest.mark.parametrize("fmt, name", [
+    ("PNG", "png"), ("JPEG", "jpeg"), ("GIF", "gif"), ("TIFF", "tiff"),
+    ("BMP", "bmp"), ("WEBP", "webp"), ("ICO", "ico"),
+])
+def test_sniff_bytes_recognises_encoded_images(fmt, name):
+    assert sniff_bytes(encoded(fmt)) == name
+
+
+@pytest.mark.parametrize("head", [b"", b"hello, world\n", b"RIFF\x00\x00\x00\x00WAVE", b"\x89PN"])
+def test_sniff_bytes_rejects_other_content(head):
+    assert sniff_bytes(head) is None
+
+
+def test_sniff_image_format_goes_by_content_not_suffix(tmp_path):
+    fake_png = tmp_path / "fake.png"
+    fake_png.write_text("not really a picture")
+    text = tmp_path / "notes.txt"
+    text.write_text("hello")
+    jpeg = tmp_path / "photo"
+    jpeg.write_bytes(encoded("JPEG"))
+
+    assert sniff_image_format(fake_png) is None
+    assert sniff_image_format(text) is None
+    assert sniff_image_format(jpeg) == "jpeg"
+    assert sniff_image_format(tmp_path / "missing.png") is None
+    # An extensionless JPEG loads like any other
+    assert load_image_with_alpha(jpeg).size == (12, 8)
+    with pytest.raises(ValueError):
+        load_image_with_alpha(fake_png)
+
+
+def make_tree(root):
+    for rel in ("a.png", "b.txt", "photo", "sub/c.png", "backup/d.png", "backup/deep/e.png", "sub/backup/f.png"):
+        path = root / rel
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x")
+
+
+def listed(root, **kw):
+    return [p.relative_to(root).as_posix() for p in iter_input_files(root, **kw)]
+
+
+def test_iter_input_files_walks_recursively_in_order(tmp_path):
+    make_tree(tmp_path)
+    assert listed(tmp_path) == [
+        "a.png", "b.txt", "backup/d.png", "backup/deep/e.png", "photo", "sub/backup/f.png", "sub/c.png",
+    ]
+
+
+def test_iter_input_files_include_matches_name_or_relative_path(tmp_path):
+    make_tree(tmp_path)
+    assert listed(tmp_path, include=["*.png"]) == [
+        "a.png", "backup/d.png", "backup/deep/e.png", "sub/backup/f.png", "sub/c.png",
+    ]
+    assert listed(tmp_path, include=["sub/*"]) == ["sub/backup/f.png", "sub/c.png"]
+    # An empty include list means everything
+    assert len(listed(tmp_path, include=[])) == 7
+
+
+def test_iter_input_files_excludes_backup_dir(tmp_path):
+    make_tree(tmp_path)
+    # Only the top-level backup/ directory is relative to root; sub/backup/ stays
+    assert listed(tmp_path, exclude=["backup/*"]) == ["a.png", "b.txt", "photo", "sub/backup/f.png", "sub/c.png"]
+    assert listed(tmp_path, include=["*.png"], exclude=["backup/*", "*.txt"]) == ["a.png", "sub/backup/f.png", "sub/c.png"]
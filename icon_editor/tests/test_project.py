@@ -0,0 +1,123 @@
+import random
+import time
+
+import pytest
+from PIL import Image, ImageDraw
+
+from core.canvas_model import CanvasModel
+from core.editor_tools import ToolType
+from core.project import ProjectFile
+
+SIZE = (300, 200)
+
+
+def make_model():
+    model = CanvasModel()
+    image = Image.new("RGBA", SIZE, (0, 0, 0, 0))
+    ImageDraw.Draw(image).ellipse((20, 20, 280, 180), fill=(30, 120, 220, 255))
+    model.load_image(image)
+    model.layer_add()
+    model.set_tool(ToolType.PENCIL)
+    model.set_color((220, 40, 40, 255))
+    model.set_brush_size(5)
+    model.press(10, 10)
+    model.drag(290, 190)
+    model.release()
+    model.layer_rename("ink")
+    model.layer_toggle_visibility()
+    return model
+
+
+def document(model):
+    return [ly.tobytes() for ly in model.layers], model.layer_names, model.layer_visible, model.active_layer
+
+
+def project_document(project):
+    layers = [project.load_layer(i).tobytes() for i in range(len(project.names))]
+    return layers, project.names, project.visible, project.active
+
+
+def drain(model, token):
+    deadline = time.monotonic() + 10
+    while model.drain_loading(token):
+        assert time.monotonic() < deadline
+        time.sleep(0.001)
+
+
+def test_lazy_load_incremental_save_and_reopen(tmp_path):
+    path = tmp_path / "doc.icproj"
+    source = make_model()
+    source.save_project(path)
+    full_size = path.stat().st_size
+
+    model = CanvasModel()
+    model.open_project(ProjectFile.open(path))
+    token = model.start_loading((0, 0, 64, 64))
+    # Only the tiles under the view are decoded up front
+    assert token is not None
+    assert not model.is_unsaved
+    drain(model, token)
+    assert not model.is_unsaved
+    assert document(model) == document(source)
+
+    model.set_tool(ToolType.PENCIL)
+    model.set_color((10, 200, 10, 255))
+    model.press(150, 100)
+    model.release()
+    assert model.is_unsaved
+    model.save_project(path)
+    assert not model.is_unsaved
+    # Unchanged tiles keep their chunks; the save appends a few tiles and a new index
+    assert path.stat().st_size - full_size < full_size // 2
+
+    reopened = ProjectFile.open(path)
+    assert project_document(reopened) == document(model)
+    reopened.close()
+
+
+def test_bad_header(tmp_path):
+    path = tmp_path / "bad.icproj"
+    path.write_bytes(b"GIF89a" + bytes(40))
+    with pytest.raises(ValueError, match="Not an icon editor project"):
+        ProjectFile.open(path)
+    path.write_bytes(b"ICPR")
+    with pytest.raises(ValueError, match="Not an icon editor project"):
+        ProjectFile.open(path)
+
+
+def test_corrupt_index(tmp_path):
+    path = tmp_path / "doc.icproj"
+    make_model().save_project(path)
+    data = bytearray(path.read_bytes())
+    # Point the header at the first tile chunk instead of the index
+    data[8:16] = (24).to_bytes(8, "little")
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError, match="Corrupt project index"):
+        ProjectFile.open(path)
+
+
+def test_corrupt_chunk(tmp_path):
+    path = tmp_path / "doc.icproj"
+    make_model().save_project(path)
+    project = ProjectFile.open(path)
+    last = len(project.spans[0]) - 1
+    offset, length = project.spans[0][last]
+    data = bytearray(path.read_bytes())
+    data[offset:offset + length] = random.Random(1).randbytes(length)
+    path.write_bytes(bytes(data))
+
+    with pytest.raises(ValueError, match="Corrupt tile"):
+        project.load_tile(0, last)
+    project.close()
+
+    model = CanvasModel()
+    model.open_project(ProjectFile.open(path))
+    token = model.start_loading((0, 0, 64, 64))
+    with pytest.raises(ValueError, match="Corrupt tile"):
+        drain(model, token)
+
+    model = CanvasModel()
+    model.open_project(ProjectFile.open(path))
+    model.start_loading((0, 0, 64, 64))
+    with pytest.raises(ValueError, match="Corrupt tile"):
+        model.ensure_loaded()
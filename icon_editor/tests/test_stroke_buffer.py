@@ -0,0 +1,27 @@
+from PIL import Image
+
+from core.editor_tools import StrokeBuffer, draw_brush_line
+
+RED = (220, 20, 20, 255)
+
+
+def test_mask_covers_only_the_stroke():
+    stroke = StrokeBuffer((4096, 4096), RED, 9)
+    assert stroke.mask is None
+    stroke.add_dab((2000, 1000))
+    assert stroke.mask.width < 512 and stroke.mask.height < 512
+
+
+def test_mask_grows_without_changing_pixels():
+    size = (1200, 900)
+    points = [(1190, 890), (1100, 850), (20, 30), (600, 5)]
+    stroke = StrokeBuffer(size, RED, 9)
+    expected = Image.new("RGBA", size)
+    stroke.add_dab(points[0])
+    draw_brush_line(expected, points[0], points[0], RED, 9)
+    for p0, p1 in zip(points, points[1:]):
+        stroke.add_line(p0, p1)
+        draw_brush_line(expected, p0, p1, RED, 9)
+    layer = Image.new("RGBA", size)
+    stroke.commit(layer)
+    assert layer.tobytes() == expected.tobytes()
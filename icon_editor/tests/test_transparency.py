@@ -0,0 +1,83 @@
+import subprocess
+import sys
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+from core.transparency import remove_background
+
+APP_DIR = Path(__file__).resolve().parent.parent
+WHITE = (255, 255, 255, 255)
+
+
+def ringed_image():
+    """White background, a black ring, and an enclosed white eye plus an off-white patch inside it."""
+    image = Image.new("RGBA", (64, 64), WHITE)
+    draw = ImageDraw.Draw(image)
+    draw.ellipse((12, 12, 52, 52), fill=(0, 0, 0, 255))
+    draw.rectangle((26, 26, 32, 38), fill=WHITE)
+    draw.rectangle((34, 26, 38, 38), fill=(248, 250, 246, 255))
+    # Off-white outside the ring too
+    draw.rectangle((2, 2, 6, 6), fill=(248, 250, 246, 255))
+    return image
+
+
+def alpha(image, xy):
+    return image.getpixel(xy)[3]
+
+
+def test_global_is_the_default():
+    image = ringed_image()
+    remove_background(image)
+    assert alpha(image, (0, 0)) == 0
+    assert alpha(image, (28, 30)) == 0
+    assert alpha(image, (16, 32)) == 255
+
+
+def test_edge_connected_keeps_enclosed_areas():
+    image = ringed_image()
+    remove_background(image, contiguous=True)
+    assert alpha(image, (0, 0)) == 0
+    assert alpha(image, (28, 30)) == 255
+    assert alpha(image, (16, 32)) == 255
+
+
+def test_tolerance():
+    exact = ringed_image()
+    remove_background(exact, tolerance=0)
+    assert alpha(exact, (4, 4)) == 255 and alpha(exact, (36, 30)) == 255
+    loose = ringed_image()
+    remove_background(loose, tolerance=10)
+    assert alpha(loose, (4, 4)) == 0 and alpha(loose, (36, 30)) == 0
+    connected = ringed_image()
+    remove_background(connected, tolerance=10, contiguous=True)
+    assert alpha(connected, (4, 4)) == 0 and alpha(connected, (36, 30)) == 255
+
+
+def test_feather_fades_only_the_foreground_edge():
+    hard = ringed_image()
+    remove_background(hard, contiguous=True)
+    soft = ringed_image()
+    remove_background(soft, contiguous=True, feather=3)
+    # Background stays fully clear and the ring's centre stays opaque
+    assert alpha(soft, (0, 0)) == 0
+    assert alpha(soft, (20, 32)) == 255
+    # Just inside the ring's outer edge alpha fades, and never rises above the hard cut
+    assert 0 < alpha(soft, (13, 32)) < 255
+    assert all(s <= h for s, h in zip(soft.getchannel("A").getdata(), hard.getchannel("A").getdata()))
+
+
+def test_cli_removes_globally_unless_asked_for_edge_only(tmp_path):
+    src = tmp_path / "ring.png"
+    ringed_image().save(src)
+    for flags, eye_alpha in (([], 0), (["--bg-contiguous"], 255)):
+        out = tmp_path / f"ring{len(flags)}.ico"
+        result = subprocess.run(
+            [sys.executable, "main.py", "--cli", "--input", str(src), "--output", str(out), "--sizes", "64",
+             "--remove-bg", "--export-pngs", *flags],
+            cwd=APP_DIR, capture_output=True, text=True, timeout=120,
+        )
+        assert result.returncode == 0, result.stderr
+        png = Image.open(tmp_path / f"{out.stem}_png" / f"{out.stem}_64.png").convert("RGBA")
+        assert alpha(png, (0, 0)) == 0
+        assert alpha(png, (28, 30)) == eye_alpha
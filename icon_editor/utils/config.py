@@ -10,6 +10,11 @@ class AppConfig:
         self.path = path or DEFAULT_PATH
         self.recent_files: list[str] = []
         self.theme: str = "System"
+        # Undo history budgets; older steps are compressed, then spilled to a temp file
+        self.history_memory_mb: int = 256
+        self.history_disk_mb: int = 2048
+        # Crash-recovery journal of the open document
+        self.autosave: bool = True
         self._load()
 
     def _load(self):
@@ -18,15 +23,24 @@ class AppConfig:
                 data = json.loads(self.path.read_text(encoding="utf-8"))
                 self.recent_files = list(data.get("recent_files", []))[:5]
                 self.theme = str(data.get("theme", "System"))
+                self.history_memory_mb = max(16, int(data.get("history_memory_mb", 256)))
+                self.history_disk_mb = max(0, int(data.get("history_disk_mb", 2048)))
+                self.autosave = bool(data.get("autosave", True))
         except Exception:
             self.recent_files = []
             self.theme = "System"
+            self.history_memory_mb = 256
+            self.history_disk_mb = 2048
+            self.autosave = True
 
     def save(self):
         try:
             data = {
                 "recent_files": self.recent_files[:5],
-                "theme": self.theme
+                "theme": self.theme,
+                "history_memory_mb": self.history_memory_mb,
+                "history_disk_mb": self.history_disk_mb,
+                "autosave": self.autosave,
             }
             self.path.write_text(json.dumps(data, indent=2), encoding="utf-8")
         except Exception:
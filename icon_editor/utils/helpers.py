@@ -57,3 +57,25 @@ def parse_sizes_list(s: str) -> list[int]:
         except Exception:
             pass
     return out
+
+
+def clip_rect(rect, size):
+    """Clip an (x0, y0, x1, y1) rect to (0, 0, w, h); None if nothing is left."""
+    if rect is None:
+        return None
+    x0, y0, x1, y1 = rect
+    w, h = size
+    x0, y0 = max(0, int(x0)), max(0, int(y0))
+    x1, y1 = min(w, int(x1)), min(h, int(y1))
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+
+def union_rect(a, b):
+    """Bounding union of two (x0, y0, x1, y1) rects, either of which may be None."""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
@@ -0,0 +1,139 @@
+import functools
+import json
+import time
+from collections import deque
+from contextlib import nullcontext
+from pathlib import Path
+
+
+DEFAULT_LOG = Path.home() / ".icon_editor_perf.jsonl"
+# Frames kept for the averages the HUD shows
+RECENT_FRAMES = 120
+
+_NULL = nullcontext()
+
+
+class _Span:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, (time.perf_counter() - self.start) * 1000)
+
+
+class FrameProfiler:
+    """
+    Named timings grouped into display frames. Work timed with span() or record()
+    between two end_frame() calls lands in that frame's record, and every name also
+    keeps running call statistics (count, total and max ms), so one-off work like a
+    history push shows up both ways. While disabled, span() hands out a shared no-op
+    context and nothing is recorded.
+
+    With a log open, each finished frame is written as a JSON line; a frame is written
+    once the next one ends, so late amend() calls (Tk idle time) are included.
+    """
+
+    def __init__(self, recent: int = RECENT_FRAMES):
+        self.enabled = False
+        self.frames: deque = deque(maxlen=recent)
+        # name -> [calls, total ms, max ms]
+        self.calls: dict[str, list] = {}
+        self._current: dict[str, float] = {}
+        self._frame_no = 0
+        self._log = None
+        self._unlogged = None
+
+    def reset(self):
+        self.frames.clear()
+        self.calls.clear()
+        self._current = {}
+        self._unlogged = None
+
+    def span(self, name: str):
+        return _Span(self, name) if self.enabled else _NULL
+
+    def record(self, name: str, ms: float):
+        if not self.enabled:
+            return
+        self._current[name] = self._current.get(name, 0.0) + ms
+        stats = self.calls.get(name)
+        if stats is None:
+            self.calls[name] = [1, ms, ms]
+        else:
+            stats[0] += 1
+            stats[1] += ms
+            stats[2] = max(stats[2], ms)
+
+    def end_frame(self, total_ms: float, **fields) -> dict | None:
+        """Close the current frame with its total time and any extra fields; returns its record."""
+        if not self.enabled:
+            return None
+        self._frame_no += 1
+        frame = {"frame": self._frame_no, "t": round(time.time(), 3), "total": total_ms, **self._current, **fields}
+        self._current = {}
+        self.frames.append(frame)
+        if self._unlogged is not None:
+            self._write(self._unlogged)
+        self._unlogged = frame if self._log is not None else None
+        return frame
+
+    def amend(self, name: str, ms: float):
+        """Add time that is only known after the last frame ended (e.g. Tk redrawing it)."""
+        if self.enabled and self.frames:
+            frame = self.frames[-1]
+            frame[name] = frame.get(name, 0.0) + ms
+
+    def averages(self) -> dict:
+        """Mean ms per frame of every name over the recent frames (0 for frames without it)."""
+        n = len(self.frames)
+        if not n:
+            return {}
+        sums: dict[str, float] = {}
+        for frame in self.frames:
+            for name, value in frame.items():
+                if name not in ("frame", "t") and isinstance(value, (int, float)):
+                    sums[name] = sums.get(name, 0.0) + value
+        return {name: total / n for name, total in sums.items()}
+
+    def open_log(self, path=DEFAULT_LOG):
+        self.close_log()
+        self._log = open(path, "a", encoding="utf-8")
+
+    def close_log(self):
+        if self._log is None:
+            return
+        if self._unlogged is not None:
+            self._write(self._unlogged)
+            self._unlogged = None
+        self._log.close()
+        self._log = None
+
+    def log(self, record: dict):
+        """Write a record of any other kind (a memory or tool summary) to the log."""
+        if self._log is not None:
+            self._write({"t": round(time.time(), 3), **record})
+
+    def _write(self, record: dict):
+        try:
+            self._log.write(json.dumps(record, separators=(",", ":"), default=str) + "\n")
+        except (OSError, ValueError):
+            # A failing log must not take the editor down; stop logging
+            self._log = None
+            self._unlogged = None
+
+
+def profiled(name: str):
+    """Method decorator timing every call into self.profiler under name."""
+    def decorate(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            with self.profiler.span(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorate